@@ -0,0 +1,213 @@
+import math
+import sys
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+try:
+    # Optional, only needed by clients that negotiate MessagePack
+    import msgpack  # type: ignore
+    MSGPACK_AVAILABLE = True
+except Exception:
+    msgpack = None
+    MSGPACK_AVAILABLE = False
+
+
+"""MessagePack content negotiation for the API routes.
+
+Requests with Content-Type application/msgpack are decoded before validation,
+and endpoints answer with MessagePack when the Accept header ranks it above
+JSON (q-values and wildcards are honoured; q=0 excludes a type).
+Float columns travel as packed little-endian float64 arrays (bin values)
+instead of per-object maps:
+- distance responses are a map of columns: name, lat, lon, distance_km,
+  duration_seconds (NaN for missing) and distance_method
+- request "destinations" may be given either as a list of maps or as a map of
+  columns (e.g. {"name": [...], "lat": <bin>, "lon": <bin>})
+JSON stays the default and both encodings carry the same values.
+- msgpack
+"""
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+_MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+
+
+def pack_floats(values: Sequence[Optional[float]]) -> bytes:
+    """Pack floats as little-endian float64; None becomes NaN. - pack_floats"""
+    arr = array("d", [math.nan if v is None else v for v in values])
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def unpack_floats(data: bytes) -> List[Optional[float]]:
+    """Inverse of pack_floats; NaN becomes None. - unpack_floats"""
+    if len(data) % 8:
+        raise ValueError("Packed float64 column length must be a multiple of 8")
+    arr = array("d")
+    arr.frombytes(data)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return [None if math.isnan(v) else v for v in arr]
+
+
+def _is_msgpack(media_type: Optional[str]) -> bool:
+    """True when a Content-Type value names MessagePack. - is_msgpack"""
+    if not media_type:
+        return False
+    return media_type.split(";")[0].strip().lower() in _MSGPACK_MEDIA_TYPES
+
+
+def parse_accept(accept: str) -> List[Tuple[str, float]]:
+    """(media range, q) pairs of an Accept header; malformed q-values count as 0. - parse_accept"""
+    ranges: List[Tuple[str, float]] = []
+    for part in accept.split(","):
+        params = part.split(";")
+        media_range = params[0].strip().lower()
+        if not media_range:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = min(1.0, max(0.0, float(value.strip())))
+                except ValueError:
+                    q = 0.0
+        ranges.append((media_range, q))
+    return ranges
+
+
+def _preference(ranges: List[Tuple[str, float]], media_types: Sequence[str]) -> Tuple[float, int]:
+    """(q, specificity) of the most specific range matching any of media_types; q 0 when none does. - preference
+
+    Specificity is 2 for an exact type, 1 for type/* and 0 for */*.
+    """
+    best: Tuple[float, int] = (0.0, -1)
+    for media_range, q in ranges:
+        if media_range in media_types:
+            specificity = 2
+        elif media_range == "*/*":
+            specificity = 0
+        elif media_range.endswith("/*") and any(t.startswith(media_range[:-1]) for t in media_types):
+            specificity = 1
+        else:
+            continue
+        if specificity > best[1] or (specificity == best[1] and q > best[0]):
+            best = (q, specificity)
+    return best
+
+
+def prefers_msgpack(accept: Optional[str]) -> bool:
+    """True when an Accept header ranks MessagePack above JSON. - prefers_msgpack
+
+    Each type gets the q of its most specific matching range (RFC 9110).
+    MessagePack needs q > 0 and must beat JSON's q; on equal q a type named
+    explicitly beats one only matched by a wildcard, and JSON wins full ties.
+    """
+    if not accept:
+        return False
+    ranges = parse_accept(accept)
+    msgpack_pref = _preference(ranges, _MSGPACK_MEDIA_TYPES)
+    if msgpack_pref[0] <= 0.0:
+        return False
+    return msgpack_pref > _preference(ranges, ("application/json",))
+
+
+def wants_msgpack(request: Request) -> bool:
+    """True when the client prefers MessagePack and it can be produced. - wants_msgpack"""
+    return MSGPACK_AVAILABLE and prefers_msgpack(request.headers.get("accept"))
+
+
+def _expand_columns(columns: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Turn a map of columns (lists or packed float64 bins) into a list of row maps. - expand_columns"""
+    expanded = {k: unpack_floats(v) if isinstance(v, (bytes, bytearray)) else list(v) for k, v in columns.items()}
+    lengths = {len(v) for v in expanded.values()}
+    if len(lengths) > 1:
+        raise ValueError("All destination columns must have the same length")
+    n = lengths.pop() if lengths else 0
+    return [{k: v[i] for k, v in expanded.items()} for i in range(n)]
+
+
+def decode_body(raw: bytes) -> Any:
+    """Decode a MessagePack request body into the JSON-equivalent structure. - decode_body"""
+    data = msgpack.unpackb(raw, raw=False)
+    if isinstance(data, dict) and isinstance(data.get("destinations"), dict):
+        data["destinations"] = _expand_columns(data["destinations"])
+    return data
+
+
+def encode_distance_results(results: Sequence[Any]) -> bytes:
+    """Encode DistanceResult rows as a map of columns. - encode_distance_results"""
+    return msgpack.packb(
+        {
+            "name": [r.name for r in results],
+            "lat": pack_floats([r.lat for r in results]),
+            "lon": pack_floats([r.lon for r in results]),
+            "distance_km": pack_floats([r.distance_km for r in results]),
+            "duration_seconds": pack_floats([r.duration_seconds for r in results]),
+            "distance_method": [r.distance_method for r in results],
+        },
+        use_bin_type=True,
+    )
+
+
+def encode_model(model: Union[BaseModel, List[BaseModel]]) -> bytes:
+    """Encode a response model as a MessagePack map (a list of models as an array of maps). - encode_model"""
+    if isinstance(model, list):
+        return msgpack.packb([m.dict() for m in model], use_bin_type=True)
+    return msgpack.packb(model.dict(), use_bin_type=True)
+
+
+def _template_headers(template: Optional[Response]) -> Dict[str, str]:
+    """Headers set on the injected response, minus the ones the new body determines. - template_headers"""
+    if template is None:
+        return {}
+    return {k: v for k, v in template.headers.items() if k.lower() not in ("content-length", "content-type")}
+
+
+def msgpack_response(content: bytes, template: Optional[Response] = None) -> Response:
+    """Build a MessagePack response, copying headers set on the injected response. - msgpack_response"""
+    return Response(content=content, media_type=MSGPACK_MEDIA_TYPE, headers=_template_headers(template))
+
+
+def json_response(content: Any, template: Optional[Response] = None) -> Response:
+    """Build a JSON response from plain data, copying headers set on the injected response. - json_response"""
+    return JSONResponse(content=content, headers=_template_headers(template))
+
+
+class MsgPackRequest(Request):
+    """Request whose json() decodes a MessagePack body. - msgpack_request"""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            try:
+                self._json = decode_body(await self.body())
+            except Exception as exc:
+                raise HTTPException(status_code=400, detail=f"Invalid MessagePack body: {exc}") from exc
+        return self._json
+
+
+class MsgPackRoute(APIRoute):
+    """APIRoute that accepts MessagePack request bodies. - msgpack_route"""
+
+    def get_route_handler(self) -> Callable:
+        original = super().get_route_handler()
+
+        async def handler(request: Request) -> Response:
+            if _is_msgpack(request.headers.get("content-type")):
+                if not MSGPACK_AVAILABLE:
+                    raise HTTPException(status_code=415, detail="MessagePack support is not installed")
+                # Present the body as JSON to FastAPI's parser; MsgPackRequest.json() decodes it
+                scope = dict(request.scope)
+                scope["headers"] = [
+                    (k, b"application/json" if k == b"content-type" else v) for k, v in request.scope["headers"]
+                ]
+                request = MsgPackRequest(scope, request.receive)
+            return await original(request)
+
+        return handler
@@ -1,19 +1,58 @@
-from typing import List, Tuple, Any
-from fastapi import APIRouter, HTTPException, Depends
+from typing import List, Tuple, Any, Optional
+from fastapi import APIRouter, HTTPException, Depends, Header, Request, Response, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
 import httpx
 
 from app.api import schemas
+from app.api.negotiation import (
+    MsgPackRoute,
+    wants_msgpack,
+    encode_distance_results,
+    encode_model,
+    json_response,
+    msgpack_response,
+)
 from app.core.config import Settings, get_settings
-from app.services.geocode import geocode_address, geocode_best_effort
-from app.services.distance import haversine_distance, distance_via_best_method
+from app.core.http import http_client
+from app.core.tracing import span
+from app.core.deadline import Deadline, DeadlineExceeded, TIME_BUDGET_HEADER, run_with_deadline
+from app.services.geocode import batch_geocoding_available, geocode_address, geocode_best_effort, geocode_many
+from app.services.concurrency import limiter_stats
+from app.services.tracking import TrackingSession
+from app.services.distance import (
+    haversine_distance,
+    haversine_many,
+    geodesic_many,
+    distance_via_best_method,
+    LocalRoutes,
+    DEGRADED_SUFFIX,
+    OFFLINE_METHODS,
+    STRAIGHT_LINE_METHODS,
+    estimated_distance,
+)
 
 
 """API routes for distance computations. - api, routes"""
 
-router = APIRouter()
+# MsgPackRoute lets every endpoint accept application/msgpack request bodies
+router = APIRouter(route_class=MsgPackRoute)
 
+# Response headers describing results cut short by the request's time budget
+DEGRADED_HEADER = "X-Distance-Degraded"
+INCOMPLETE_HEADER = "X-Distance-Incomplete"
+# Response header counting method=auto rows that fell back to an offline estimate
+FALLBACK_HEADER = "X-Distance-Fallback"
 
-async def _resolve_latlon(item: Any, client: httpx.AsyncClient, settings: Settings) -> Tuple[float, float]:
+# distance_method values of rows that were actually routed
+ROUTED_METHODS = ("osrm", "local")
+
+
+async def _resolve_latlon(
+    item: Any,
+    client: httpx.AsyncClient,
+    settings: Settings,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[float, float]:
     """Resolve a lat/lon pair from either an object with lat/lon/address or a plain address string. - helper
 
     Accepts:
@@ -21,6 +60,7 @@ async def _resolve_latlon(item: Any, client: httpx.AsyncClient, settings: Settin
     - a pydantic model/object with attributes 'lat', 'lon', and/or 'address'
 
     Returns (lat, lon) or raises HTTPException for validation/geocoding errors.
+    Raises DeadlineExceeded if geocoding does not finish within the deadline.
     """
     # If a plain string is provided, treat it as an address
     if isinstance(item, str):
@@ -28,7 +68,7 @@ async def _resolve_latlon(item: Any, client: httpx.AsyncClient, settings: Settin
         if not address:
             raise HTTPException(status_code=422, detail="Address must be provided")
         try:
-            return await geocode_address(address, client, settings)
+            return await run_with_deadline(geocode_address(address, client, settings), deadline)
         except ValueError as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
 
@@ -42,7 +82,7 @@ async def _resolve_latlon(item: Any, client: httpx.AsyncClient, settings: Settin
 
     if address:
         try:
-            return await geocode_address(address, client, settings)
+            return await run_with_deadline(geocode_address(address, client, settings), deadline)
         except ValueError as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
 
@@ -52,58 +92,93 @@ async def _resolve_latlon(item: Any, client: httpx.AsyncClient, settings: Settin
 @router.post("/distance", response_model=List[schemas.DistanceResult])
 async def compute_distances(
     req: schemas.DistanceRequest,
+    request: Request,
+    response: Response,
     settings: Settings = Depends(get_settings),
+    time_budget_ms: Optional[float] = Header(None, alias=TIME_BUDGET_HEADER),
 ):
     """Compute distances from origin to provided destinations and return them ordered by distance. - compute, distances"""
-    async with httpx.AsyncClient(timeout=10.0) as client:
+    coords_only = _has_latlon(req.origin) and all(_has_latlon(d) for d in req.destinations)
+    if req.method in OFFLINE_METHODS and coords_only:
+        # Zero-I/O fast path: no HTTP client, one batched computation
+        with span("compute", rows=len(req.destinations)):
+            results = _offline_results(req.origin, req.destinations, req.method, settings)
+        return _finish_results(results, request, response, method=req.method)
+
+    deadline = _request_deadline(req, time_budget_ms)
+    async with http_client() as client:
         # Resolve origin
-        origin_lat, origin_lon = await _resolve_latlon(req.origin, client, settings)
+        origin_lat, origin_lon = await _resolve_origin(_resolve_latlon(req.origin, client, settings, deadline))
 
-        results: List[schemas.DistanceResult] = []
+        resolved: List[Tuple[str, float, float]] = []
+        skipped = 0
 
         for dest in req.destinations:
-            lat, lon = await _resolve_latlon(dest, client, settings)
-
-            # Try routing-based distance first (OSRM -> geodesic -> haversine)
-            dist_info = await distance_via_best_method(origin_lat, origin_lon, lat, lon, client, settings)
-
-            dist_km = dist_info.get("distance_km") or 0.0
-            duration = dist_info.get("duration_seconds")
-            method = dist_info.get("method")
-
-            results.append(
-                schemas.DistanceResult(
-                    name=dest.name or dest.address or "",
-                    lat=lat,
-                    lon=lon,
-                    distance_km=dist_km,
-                    duration_seconds=duration,
-                    distance_method=method,
-                )
-            )
+            try:
+                lat, lon = await _resolve_latlon(dest, client, settings, deadline)
+            except DeadlineExceeded:
+                skipped += 1
+                continue
 
-        # sort by distance asc
-        results.sort(key=lambda r: r.distance_km)
-        return results
+            resolved.append((dest.name or dest.address or "", lat, lon))
+
+        results = await _distance_results(resolved, origin_lat, origin_lon, client, settings, deadline, req.method)
+        return _finish_results(results, request, response, skipped, req.method)
 
 
 @router.post("/geocode", response_model=schemas.GeocodeResult)
 async def geocode_single(
     req: schemas.GeocodeRequest,
+    request: Request,
     settings: Settings = Depends(get_settings),
 ):
     """Geocode a single address and return its latitude and longitude. - geocode_single"""
-    async with httpx.AsyncClient(timeout=10.0) as client:
+    async with http_client() as client:
         try:
             lat, lon = await geocode_address(req.address, client, settings)
         except ValueError as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
-    return schemas.GeocodeResult(lat=lat, lon=lon)
+    return _respond_model(request, schemas.GeocodeResult(lat=lat, lon=lon))
+
+
+@router.get("/upstreams/limits", response_model=List[schemas.UpstreamLimit])
+async def upstream_limits():
+    """Current adaptive concurrency limit, in-flight and queued requests per upstream. - upstream_limits"""
+    return limiter_stats()
+
+
+@router.post("/geocode/batch", response_model=List[schemas.GeocodeBatchItem])
+async def geocode_batch(
+    req: schemas.GeocodeBatchRequest,
+    request: Request,
+    settings: Settings = Depends(get_settings),
+):
+    """Geocode many addresses, in input order; failures are reported per item. - geocode_batch
+
+    Only served by the database backend or a self-hosted Nominatim; 503 when
+    the public service is the only geocoder.
+    """
+    if not batch_geocoding_available(settings):
+        raise HTTPException(
+            status_code=503,
+            detail="Batch geocoding needs GEOCODE_BACKEND=db or a self-hosted Nominatim (NOMINATIM_URL or RUN_LOCAL)",
+        )
+    async with http_client() as client:
+        resolved = await geocode_many(req.addresses, client, settings)
+
+    items = []
+    for address, result in zip(req.addresses, resolved):
+        if isinstance(result, ValueError):
+            items.append(schemas.GeocodeBatchItem(address=address, error=str(result)))
+        else:
+            items.append(schemas.GeocodeBatchItem(address=address, lat=result[0], lon=result[1]))
+    return _respond_model(request, items)
 
 
 @router.post("/geocode/parts", response_model=schemas.GeocodeResult)
 async def geocode_parts(
     req: schemas.PartsGeocodeRequest,
+    request: Request,
     settings: Settings = Depends(get_settings),
 ):
     """Geocode using best-effort ordered parts, most specific to most generic. - geocode_parts"""
@@ -111,17 +186,18 @@ async def geocode_parts(
     if not parts:
         raise HTTPException(status_code=422, detail="parts must contain non-empty strings")
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
+    async with http_client() as client:
         try:
             lat, lon = await geocode_best_effort(parts, client, settings)
         except ValueError as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
-    return schemas.GeocodeResult(lat=lat, lon=lon)
+    return _respond_model(request, schemas.GeocodeResult(lat=lat, lon=lon))
 
 
 @router.post("/geocode/structured", response_model=schemas.GeocodeResult)
 async def geocode_structured(
     req: schemas.StructuredLocation,
+    request: Request,
     settings: Settings = Depends(get_settings),
 ):
     """Geocode from structured fields (street/neighborhood/city/state) using best-effort. - geocode_structured"""
@@ -129,145 +205,358 @@ async def geocode_structured(
     if not parts:
         raise HTTPException(status_code=422, detail="At least one non-empty field must be provided")
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
+    async with http_client() as client:
         try:
             lat, lon = await geocode_best_effort(parts, client, settings)
         except ValueError as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
-    return schemas.GeocodeResult(lat=lat, lon=lon)
+    return _respond_model(request, schemas.GeocodeResult(lat=lat, lon=lon))
 
 
 @router.post("/distance/addresses", response_model=List[schemas.DistanceResult])
 async def compute_distances_from_addresses(
     req: schemas.AddressDistanceRequest,
+    request: Request,
+    response: Response,
     settings: Settings = Depends(get_settings),
+    time_budget_ms: Optional[float] = Header(None, alias=TIME_BUDGET_HEADER),
 ):
     """Shortcut endpoint: accept origin + destinations as addresses only, geocode them and compute distances. - address_shortcut"""
     if not req.origin_address or not req.destinations:
         raise HTTPException(status_code=422, detail="origin_address and destinations are required")
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        try:
-            origin_lat, origin_lon = await _resolve_latlon(req.origin_address, client, settings)
-        except HTTPException:
-            raise
+    deadline = _request_deadline(req, time_budget_ms)
+    async with http_client() as client:
+        origin_lat, origin_lon = await _resolve_origin(_resolve_latlon(req.origin_address, client, settings, deadline))
 
-        results: List[schemas.DistanceResult] = []
+        resolved: List[Tuple[str, float, float]] = []
+        skipped = 0
         for dest in req.destinations:
-            lat, lon = await _resolve_latlon(dest, client, settings)
-
-            dist_info = await distance_via_best_method(origin_lat, origin_lon, lat, lon, client, settings)
-            dist_km = dist_info.get("distance_km") or 0.0
-            duration = dist_info.get("duration_seconds")
-            method = dist_info.get("method")
-
-            results.append(
-                schemas.DistanceResult(
-                    name=dest.name or dest.address or "",
-                    lat=lat,
-                    lon=lon,
-                    distance_km=dist_km,
-                    duration_seconds=duration,
-                    distance_method=method,
-                )
-            )
+            try:
+                lat, lon = await _resolve_latlon(dest, client, settings, deadline)
+            except DeadlineExceeded:
+                skipped += 1
+                continue
 
-        results.sort(key=lambda r: r.distance_km)
-        return results
+            resolved.append((dest.name or dest.address or "", lat, lon))
+
+        results = await _distance_results(resolved, origin_lat, origin_lon, client, settings, deadline, req.method)
+        return _finish_results(results, request, response, skipped, req.method)
 
 
 @router.post("/distance/parts", response_model=List[schemas.DistanceResult])
 async def compute_distances_from_parts(
     req: schemas.PartsDistanceRequest,
+    request: Request,
+    response: Response,
     settings: Settings = Depends(get_settings),
+    time_budget_ms: Optional[float] = Header(None, alias=TIME_BUDGET_HEADER),
 ):
     """Compute distances using best-effort geocoding from ordered parts. - distance_parts"""
-    async with httpx.AsyncClient(timeout=10.0) as client:
+    deadline = _request_deadline(req, time_budget_ms)
+    async with http_client() as client:
         origin_parts = _clean_parts(req.origin_parts)
         if not origin_parts:
             raise HTTPException(status_code=422, detail="origin_parts must contain non-empty strings")
 
         try:
-            origin_lat, origin_lon = await geocode_best_effort(origin_parts, client, settings)
+            origin_lat, origin_lon = await _resolve_origin(geocode_best_effort(origin_parts, client, settings, deadline))
         except ValueError as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-        results: List[schemas.DistanceResult] = []
+        resolved: List[Tuple[str, float, float]] = []
+        skipped = 0
         for dest in req.destinations:
             dest_parts = _clean_parts(dest.parts)
             if not dest_parts:
                 raise HTTPException(status_code=422, detail="Each destination must include non-empty parts")
 
             try:
-                lat, lon = await geocode_best_effort(dest_parts, client, settings)
+                lat, lon = await geocode_best_effort(dest_parts, client, settings, deadline)
+            except DeadlineExceeded:
+                skipped += 1
+                continue
             except ValueError as exc:
                 raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-            dist_info = await distance_via_best_method(origin_lat, origin_lon, lat, lon, client, settings)
-            dist_km = dist_info.get("distance_km") or 0.0
-            duration = dist_info.get("duration_seconds")
-            method = dist_info.get("method")
-
-            results.append(
-                schemas.DistanceResult(
-                    name=dest.name or ", ".join(dest_parts),
-                    lat=lat,
-                    lon=lon,
-                    distance_km=dist_km,
-                    duration_seconds=duration,
-                    distance_method=method,
-                )
-            )
+            resolved.append((dest.name or ", ".join(dest_parts), lat, lon))
 
-        results.sort(key=lambda r: r.distance_km)
-        return results
+        results = await _distance_results(resolved, origin_lat, origin_lon, client, settings, deadline, req.method)
+        return _finish_results(results, request, response, skipped, req.method)
 
 
 @router.post("/distance/structured", response_model=List[schemas.DistanceResult])
 async def compute_distances_structured(
     req: schemas.StructuredDistanceRequest,
+    request: Request,
+    response: Response,
     settings: Settings = Depends(get_settings),
+    time_budget_ms: Optional[float] = Header(None, alias=TIME_BUDGET_HEADER),
 ):
     """Compute distances from structured address fields using best-effort geocoding. - distance_structured"""
-    async with httpx.AsyncClient(timeout=10.0) as client:
+    deadline = _request_deadline(req, time_budget_ms)
+    async with http_client() as client:
         origin_parts = _loc_to_parts(req.origin)
         if not origin_parts:
             raise HTTPException(status_code=422, detail="Origin must include at least one non-empty field")
 
         try:
-            origin_lat, origin_lon = await geocode_best_effort(origin_parts, client, settings)
+            origin_lat, origin_lon = await _resolve_origin(geocode_best_effort(origin_parts, client, settings, deadline))
         except ValueError as exc:
             raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-        results: List[schemas.DistanceResult] = []
+        resolved: List[Tuple[str, float, float]] = []
+        skipped = 0
         for dest in req.destinations:
             dest_parts = _loc_to_parts(dest)
             if not dest_parts:
                 raise HTTPException(status_code=422, detail="Each destination must include at least one non-empty field")
 
             try:
-                lat, lon = await geocode_best_effort(dest_parts, client, settings)
+                lat, lon = await geocode_best_effort(dest_parts, client, settings, deadline)
+            except DeadlineExceeded:
+                skipped += 1
+                continue
             except ValueError as exc:
                 raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-            dist_info = await distance_via_best_method(origin_lat, origin_lon, lat, lon, client, settings)
-            dist_km = dist_info.get("distance_km") or 0.0
-            duration = dist_info.get("duration_seconds")
-            method = dist_info.get("method")
-
-            results.append(
-                schemas.DistanceResult(
-                    name=getattr(dest, "name", None) or ", ".join(dest_parts),
-                    lat=lat,
-                    lon=lon,
-                    distance_km=dist_km,
-                    duration_seconds=duration,
-                    distance_method=method,
-                )
+            resolved.append((getattr(dest, "name", None) or ", ".join(dest_parts), lat, lon))
+
+        results = await _distance_results(resolved, origin_lat, origin_lon, client, settings, deadline, req.method)
+        return _finish_results(results, request, response, skipped, req.method)
+
+
+@router.websocket("/distance/live")
+async def live_distances(websocket: WebSocket, settings: Settings = Depends(get_settings)):
+    """Live tracking: destinations are sent once, then origin updates stream in. - live_distances
+
+    Client messages:
+    - {"type": "destinations", "destinations": [...], "method"?, "limit"?, "min_move_m"?}
+    - {"type": "origin", "lat": ..., "lon": ...}
+
+    Server messages:
+    - {"type": "ready", "count": n} once destinations are resolved
+    - {"type": "update", "rows": [...], "removed": [ids]} with only the rows that changed
+    - {"type": "error", "detail": ...} for invalid messages; the connection stays open
+    """
+    await websocket.accept()
+    session: Optional[TrackingSession] = None
+    method = "auto"
+    points: List[Tuple[float, float]] = []
+    local_routes: Optional[LocalRoutes] = None
+
+    async with http_client() as client:
+
+        async def distance_fn(origin_lat: float, origin_lon: float, lat: float, lon: float):
+            nonlocal local_routes
+            # One local-graph search per origin update covers every destination
+            if local_routes is None or (local_routes.lat, local_routes.lon) != (origin_lat, origin_lon):
+                local_routes = LocalRoutes(origin_lat, origin_lon, points, settings)
+            return await distance_via_best_method(
+                origin_lat, origin_lon, lat, lon, client, settings, None, method, local_routes
             )
 
+        try:
+            while True:
+                try:
+                    message = await websocket.receive_json()
+                except (ValueError, KeyError):
+                    # Not JSON (json.JSONDecodeError is a ValueError), or a binary frame
+                    await websocket.send_json({"type": "error", "detail": "Messages must be JSON text frames"})
+                    continue
+                kind = message.get("type") if isinstance(message, dict) else None
+                try:
+                    if kind == "destinations":
+                        req = schemas.TrackingDestinationsMessage(**message)
+                        resolved = []
+                        for dest in req.destinations:
+                            lat, lon = await _resolve_latlon(dest, client, settings)
+                            resolved.append((dest.name or dest.address or "", lat, lon))
+                        method = req.method
+                        points = [(lat, lon) for _, lat, lon in resolved]
+                        local_routes = None
+                        session = TrackingSession(
+                            resolved,
+                            limit=req.limit,
+                            min_move_m=req.min_move_m,
+                            straight_line=method in STRAIGHT_LINE_METHODS,
+                        )
+                        await websocket.send_json({"type": "ready", "count": len(resolved)})
+                    elif kind == "origin":
+                        if session is None:
+                            raise HTTPException(status_code=409, detail="Send destinations before origin updates")
+                        origin = schemas.TrackingOriginMessage(**message)
+                        rows, removed = await session.update(origin.lat, origin.lon, distance_fn)
+                        if rows or removed:
+                            await websocket.send_json({"type": "update", "rows": rows, "removed": removed})
+                    else:
+                        raise HTTPException(status_code=422, detail=f"Unknown message type: {kind}")
+                except ValidationError as exc:
+                    await websocket.send_json({"type": "error", "detail": exc.errors()})
+                except HTTPException as exc:
+                    await websocket.send_json({"type": "error", "detail": exc.detail})
+                except RuntimeError as exc:
+                    # method="route" and OSRM failed
+                    await websocket.send_json({"type": "error", "detail": f"Routing failed: {exc}"})
+        except WebSocketDisconnect:
+            return
+
+
+def _request_deadline(req: Any, header_budget_ms: Optional[float]) -> Optional[Deadline]:
+    """Build the request deadline; the body's time_budget_ms wins over the header. - request_deadline"""
+    budget_ms = getattr(req, "time_budget_ms", None)
+    if budget_ms is None:
+        budget_ms = header_budget_ms
+    try:
+        return Deadline.from_budget_ms(budget_ms)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+
+
+async def _resolve_origin(aw: Any) -> Tuple[float, float]:
+    """Await origin resolution, turning an exhausted time budget into a 504. - resolve_origin"""
+    try:
+        return await aw
+    except DeadlineExceeded as exc:
+        raise HTTPException(status_code=504, detail="Time budget exhausted before the origin could be resolved") from exc
+
+
+async def _distance_result(
+    name: str,
+    origin_lat: float,
+    origin_lon: float,
+    lat: float,
+    lon: float,
+    client: Optional[httpx.AsyncClient],
+    settings: Settings,
+    deadline: Optional[Deadline],
+    method: str = "auto",
+    local_routes: Optional[LocalRoutes] = None,
+) -> schemas.DistanceResult:
+    """Compute the distance to one destination and build its result row. - distance_result"""
+    try:
+        dist_info = await distance_via_best_method(
+            origin_lat, origin_lon, lat, lon, client, settings, deadline, method, local_routes
+        )
+    except RuntimeError as exc:
+        # Only raised for method="route", which must not fall back
+        raise HTTPException(status_code=502, detail=f"Routing failed for '{name}': {exc}") from exc
+    return schemas.DistanceResult(
+        name=name,
+        lat=lat,
+        lon=lon,
+        distance_km=dist_info.get("distance_km") or 0.0,
+        duration_seconds=dist_info.get("duration_seconds"),
+        distance_method=dist_info.get("method"),
+    )
+
+
+async def _distance_results(
+    resolved: List[Tuple[str, float, float]],
+    origin_lat: float,
+    origin_lon: float,
+    client: Optional[httpx.AsyncClient],
+    settings: Settings,
+    deadline: Optional[Deadline],
+    method: str = "auto",
+) -> List[schemas.DistanceResult]:
+    """Result rows for resolved (name, lat, lon) destinations, sharing one local-graph search. - distance_results"""
+    local_routes = LocalRoutes(origin_lat, origin_lon, [(lat, lon) for _, lat, lon in resolved], settings)
+    return [
+        await _distance_result(name, origin_lat, origin_lon, lat, lon, client, settings, deadline, method, local_routes)
+        for name, lat, lon in resolved
+    ]
+
+
+def _has_latlon(item: Any) -> bool:
+    """True when the location already carries coordinates. - has_latlon"""
+    return getattr(item, "lat", None) is not None and getattr(item, "lon", None) is not None
+
+
+def _offline_results(
+    origin: Any,
+    destinations: List[Any],
+    method: str,
+    settings: Settings,
+) -> List[schemas.DistanceResult]:
+    """Batched no-I/O distances for destinations that all carry coordinates. - offline_results"""
+    if method == "estimated":
+        rows = [estimated_distance(origin.lat, origin.lon, d.lat, d.lon, settings) for d in destinations]
+    else:
+        points = [(d.lat, d.lon) for d in destinations]
+        distances: List[float] = []
+        label = "haversine"
+        if method == "geodesic":
+            try:
+                distances = geodesic_many(origin.lat, origin.lon, points)
+                label = "geodesic"
+            except RuntimeError:
+                pass
+        if label == "haversine":
+            distances = haversine_many(origin.lat, origin.lon, points)
+        rows = [{"distance_km": km, "duration_seconds": None, "method": label} for km in distances]
+
+    return [
+        schemas.DistanceResult(
+            name=d.name or d.address or "",
+            lat=d.lat,
+            lon=d.lon,
+            distance_km=row["distance_km"],
+            duration_seconds=row["duration_seconds"],
+            distance_method=row["method"],
+        )
+        for d, row in zip(destinations, rows)
+    ]
+
+
+def _finish_results(
+    results: List[schemas.DistanceResult],
+    request: Request,
+    response: Response,
+    skipped: int = 0,
+    method: Optional[str] = None,
+) -> Response:
+    """Sort results by distance and flag degraded, incomplete or fallback responses in headers. - finish_results
+
+    - X-Distance-Degraded: number of rows approximated because the time budget ran out
+    - X-Distance-Incomplete: number of destinations omitted because they could not be geocoded in time
+    - X-Distance-Fallback: with method "auto", number of other rows answered
+      offline because routing failed (such responses are not cached)
+
+    Returns a MessagePack response when the client asks for one, else JSON.
+    Rows are serialized here rather than by FastAPI so the "build" span
+    covers serialization (and the already-validated rows are not validated
+    again against the response model).
+    """
+    with span("build", rows=len(results)):
+        # sort by distance asc
         results.sort(key=lambda r: r.distance_km)
-        return results
+        degraded = sum(1 for r in results if (r.distance_method or "").endswith(DEGRADED_SUFFIX))
+        if degraded:
+            response.headers[DEGRADED_HEADER] = str(degraded)
+        if skipped:
+            response.headers[INCOMPLETE_HEADER] = str(skipped)
+        if method == "auto":
+            fallback = sum(
+                1
+                for r in results
+                if r.distance_method not in ROUTED_METHODS and not (r.distance_method or "").endswith(DEGRADED_SUFFIX)
+            )
+            if fallback:
+                response.headers[FALLBACK_HEADER] = str(fallback)
+        if wants_msgpack(request):
+            with span("serialize", format="msgpack"):
+                return msgpack_response(encode_distance_results(results), response)
+        with span("serialize", format="json"):
+            return json_response([r.dict() for r in results], response)
+
+
+def _respond_model(request: Request, model: Any) -> Any:
+    """Return model as MessagePack when the client asks for it, else as is. - respond_model"""
+    if wants_msgpack(request):
+        return msgpack_response(encode_model(model))
+    return model
+
 
 def _clean_parts(parts: List[str]) -> List[str]:
     """Normalize ordered parts by stripping and dropping empties. - clean_parts"""
@@ -1,10 +1,14 @@
-from typing import Optional, List
-from pydantic import BaseModel
+from typing import Optional, List, Literal
+from pydantic import BaseModel, Field
 
 
 """Pydantic schemas for request/response models. - schemas"""
 
 
+# Accuracy tier for distance endpoints (see app.services.distance.DISTANCE_METHODS)
+DistanceMethod = Literal["auto", "route", "geodesic", "fast", "estimated"]
+
+
 class Location(BaseModel):
     """Represent an origin or destination location. - location"""
     lat: Optional[float] = None
@@ -24,6 +28,10 @@ class DistanceRequest(BaseModel):
     """Request body for distance computations. - distance_request"""
     origin: Location
     destinations: List[Destination]
+    # Optional time budget in milliseconds (overrides the X-Time-Budget-Ms header)
+    time_budget_ms: Optional[float] = None
+    # Accuracy tier: fast (haversine), geodesic, estimated (detour-scaled), route (OSRM only) or auto
+    method: DistanceMethod = "auto"
 
 
 class DistanceResult(BaseModel):
@@ -34,7 +42,8 @@ class DistanceResult(BaseModel):
     distance_km: float
     # Optional estimated travel duration in seconds (when routing/OSRM is used)
     duration_seconds: Optional[float] = None
-    # Method used to compute distance: 'osrm', 'geodesic', 'haversine', etc.
+    # Method used to compute distance: 'osrm', 'estimated', 'geodesic', 'haversine', etc.
+    # Suffixed with '-degraded' when approximated because the time budget ran out.
     distance_method: Optional[str] = None
 
 
@@ -52,6 +61,19 @@ class GeocodeResult(BaseModel):
     lon: float
 
 
+class GeocodeBatchRequest(BaseModel):
+    """Request to geocode many addresses at once. - geocode_batch_request"""
+    addresses: List[str] = Field(..., min_items=1, max_items=1000)
+
+
+class GeocodeBatchItem(BaseModel):
+    """One address of a batch: lat/lon when found, otherwise the error. - geocode_batch_item"""
+    address: str
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    error: Optional[str] = None
+
+
 
 class PartsGeocodeRequest(BaseModel):
     """Request to geocode using ordered parts. - parts_geocode_request"""
@@ -67,6 +89,10 @@ class AddressDistanceRequest(BaseModel):
     """Request that provides origin address and a list of destinations by address. - address_distance_request"""
     origin_address: str
     destinations: List[AddressDestination]
+    # Optional time budget in milliseconds (overrides the X-Time-Budget-Ms header)
+    time_budget_ms: Optional[float] = None
+    # Accuracy tier: fast (haversine), geodesic, estimated (detour-scaled), route (OSRM only) or auto
+    method: DistanceMethod = "auto"
 
 # --- Best-effort parts-based schemas ---
 
@@ -81,6 +107,10 @@ class PartsDistanceRequest(BaseModel):
     """Distance request using origin parts and destination parts. - parts_distance_request"""
     origin_parts: List[str]
     destinations: List[PartsDestination]
+    # Optional time budget in milliseconds (overrides the X-Time-Budget-Ms header)
+    time_budget_ms: Optional[float] = None
+    # Accuracy tier: fast (haversine), geodesic, estimated (detour-scaled), route (OSRM only) or auto
+    method: DistanceMethod = "auto"
 
 
 # --- Structured address schemas (street/neighborhood/city/state) ---
@@ -107,3 +137,38 @@ class StructuredDistanceRequest(BaseModel):
     """Request using structured origin and destinations. - structured_distance_request"""
     origin: StructuredLocation
     destinations: List[StructuredDestination]
+    # Optional time budget in milliseconds (overrides the X-Time-Budget-Ms header)
+    time_budget_ms: Optional[float] = None
+    # Accuracy tier: fast (haversine), geodesic, estimated (detour-scaled), route (OSRM only) or auto
+    method: DistanceMethod = "auto"
+
+
+# --- Live-tracking WebSocket messages ---
+
+
+class TrackingDestinationsMessage(BaseModel):
+    """Client message setting the destinations of a live-tracking session. - tracking_destinations_message"""
+    destinations: List[Destination]
+    # Accuracy tier: fast (haversine), geodesic, estimated (detour-scaled), route (OSRM only) or auto
+    method: DistanceMethod = "auto"
+    # Only track the nearest `limit` destinations; lets the server skip routing the rest
+    limit: Optional[int] = Field(None, ge=1)
+    # Origin moves shorter than this (and distance changes below it) are not pushed
+    min_move_m: float = Field(10.0, ge=0)
+
+
+class TrackingOriginMessage(BaseModel):
+    """Client message with the current origin position. - tracking_origin_message"""
+    lat: float
+    lon: float
+
+
+class UpstreamLimit(BaseModel):
+    """Adaptive concurrency state of one upstream. - upstream_limit"""
+    upstream: str
+    limit: int
+    inflight: int
+    queued: int
+    max_queue: int
+    # Requests rejected because the queue was full
+    shed: int
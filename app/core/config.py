@@ -1,3 +1,5 @@
+from functools import lru_cache
+from typing import Any, Dict, List, Union
 from pydantic import BaseSettings
 
 
@@ -9,7 +11,8 @@ class Settings(BaseSettings):
 
     - Reads configuration from environment variables and a local .env file
     - Fields: nominatim_url, user_agent, database_url, run_local, public_nominatim_url
-      plus OSRM related configuration: use_osrm_online, osrm_service_url, osrm_profile
+      plus OSRM related configuration: use_osrm_online, osrm_service_url, osrm_profile,
+      osrm_backends and the pool health-check knobs
     """
     # Primary Nominatim-compatible endpoint (can be a local nominatim container)
     nominatim_url: str = ""
@@ -27,6 +30,38 @@ class Settings(BaseSettings):
     # Public Nominatim endpoint used as a fallback when a private/primary endpoint fails
     public_nominatim_url: str = "https://nominatim.openstreetmap.org"
 
+    # Hedged geocoding: when the primary Nominatim has not answered within the
+    # geocode_hedge_percentile of its recent latencies (geocode_hedge_default_delay_seconds
+    # until enough samples exist, never below geocode_hedge_min_delay_seconds), send the
+    # same query to public_nominatim_url and keep the first valid answer. At most
+    # geocode_hedge_max_fraction of requests are hedged.
+    geocode_hedge_enabled: bool = False
+    geocode_hedge_percentile: float = 95.0
+    geocode_hedge_min_delay_seconds: float = 0.05
+    geocode_hedge_default_delay_seconds: float = 1.0
+    geocode_hedge_max_fraction: float = 0.05
+
+    # Geocoding backend: "http" queries Nominatim's HTTP API; "db" first looks addresses up
+    # directly in the Nominatim Postgres at database_url (pooled asyncpg connections, between
+    # geocode_db_pool_min_size and geocode_db_pool_max_size) and uses HTTP only on no match.
+    # Connecting gives up after geocode_db_connect_timeout_seconds; after a failed connect
+    # lookups go straight to HTTP for geocode_db_retry_seconds.
+    geocode_backend: str = "http"
+    geocode_db_pool_min_size: int = 1
+    geocode_db_pool_max_size: int = 10
+    geocode_db_connect_timeout_seconds: float = 2.0
+    geocode_db_retry_seconds: float = 30.0
+
+    # Specificity memory for best-effort geocoding: remember, per normalized parts list, the
+    # level that resolved (for geocode_memory_success_ttl_seconds) and the levels that failed
+    # (for geocode_memory_failure_ttl_seconds), and start later lookups at the known-good level.
+    # Skipped levels are re-probed in the background at most every geocode_memory_reprobe_seconds.
+    geocode_memory_enabled: bool = False
+    geocode_memory_success_ttl_seconds: float = 86400.0
+    geocode_memory_failure_ttl_seconds: float = 3600.0
+    geocode_memory_max_entries: int = 10000
+    geocode_memory_reprobe_seconds: float = 600.0
+
     # OSRM configuration
     # If true, use the public router.project-osrm.org service (no local container required)
     # Set the environment variable USE_OSRM_ONLINE to control this behaviour.
@@ -38,12 +73,83 @@ class Settings(BaseSettings):
     # OSRM profile to use: driving, walking, cycling
     osrm_profile: str = "car"
 
+    # Optional pool of OSRM backends (JSON list via OSRM_BACKENDS). Each entry is a URL
+    # string or {"url": ..., "region": ..., "bbox": [min_lon, min_lat, max_lon, max_lat]}.
+    # When set, it takes precedence over osrm_service_url.
+    osrm_backends: List[Union[str, Dict[str, Any]]] = []
+
+    # Backend selection: "least_outstanding" or "latency" (latency-weighted random)
+    osrm_balance_strategy: str = "least_outstanding"
+
+    # Passive health checks: eject a backend after this many consecutive failures
+    # (errors or responses slower than osrm_slow_threshold_seconds) for osrm_eject_seconds.
+    osrm_eject_failures: int = 3
+    osrm_eject_seconds: float = 30.0
+    osrm_slow_threshold_seconds: float = 5.0
+
+    # Adaptive concurrency limits per upstream URL (OSRM and Nominatim): AIMD between
+    # upstream_limiter_min and upstream_limiter_max in-flight requests, starting at
+    # upstream_limiter_initial. Errors and responses slower than upstream_limiter_slow_seconds
+    # multiply the limit by upstream_limiter_backoff; fast successes raise it by ~1 per round.
+    # At most upstream_limiter_max_queue requests wait for a slot; further ones are shed.
+    upstream_limiter_enabled: bool = False
+    upstream_limiter_initial: int = 10
+    upstream_limiter_min: int = 1
+    upstream_limiter_max: int = 200
+    upstream_limiter_max_queue: int = 100
+    upstream_limiter_backoff: float = 0.7
+    upstream_limiter_slow_seconds: float = 2.0
+
+    # Detour-factor estimator: when enabled, successful OSRM routes calibrate per-cell
+    # detour factors and speeds (grid of detour_estimator_cell_deg degrees), and calibrated
+    # pairs fall back to an "estimated" road distance instead of straight-line.
+    # Set detour_estimator_path to persist the calibration (JSON) across restarts.
+    detour_estimator_enabled: bool = False
+    detour_estimator_path: str = ""
+    detour_estimator_cell_deg: float = 0.5
+    detour_estimator_min_samples: int = 20
+    detour_estimator_default_factor: float = 1.3
+    detour_estimator_default_speed_kmh: float = 40.0
+
+    # Embedded offline router: path to a road graph file built with scripts/build_road_graph.py.
+    # local_router_mode "fallback" routes locally only when OSRM fails, "primary" tries the
+    # local graph before OSRM. Points farther than local_router_max_snap_km from the nearest
+    # graph node are not routed locally.
+    local_graph_path: str = ""
+    local_router_mode: str = "fallback"
+    local_router_max_snap_km: float = 1.0
+
+    # Whole-response cache for /api/distance* POSTs: identical requests (canonical body,
+    # response format and result-relevant settings) within response_cache_ttl_seconds are
+    # replayed from memory with an ETag, and If-None-Match gets 304. Bounded by entry count
+    # and total body bytes.
+    response_cache_enabled: bool = False
+    response_cache_ttl_seconds: float = 60.0
+    response_cache_max_entries: int = 1000
+    response_cache_max_bytes: int = 16 * 1024 * 1024
+
+    # Per-request tracing: fraction of requests (0.0-1.0) that get span timing in a
+    # Server-Timing response header. When trace_export_path is set, sampled traces are
+    # also appended there as JSON lines.
+    trace_sample_rate: float = 0.0
+    trace_export_path: str = ""
+
     class Config:
         """Pydantic config: load environment from a .env file by default. - config"""
         env_file = ".env"
         env_file_encoding = "utf-8"
 
 
-def get_settings() -> Settings:
-    """Return a Settings instance for dependency injection. - get_settings"""
+@lru_cache()
+def _load_settings() -> Settings:
+    """Read environment and .env once per process. - load_settings"""
     return Settings()
+
+
+def get_settings() -> Settings:
+    """Return a Settings instance for dependency injection. - get_settings
+
+    The environment is read once; each call returns a cheap copy so callers
+    can adjust their instance without affecting others.
+    """
+    return _load_settings().copy()
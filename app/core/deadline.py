@@ -0,0 +1,60 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Optional
+
+
+"""Per-request time budgets.
+
+A Deadline is created from the client's time budget (X-Time-Budget-Ms header
+or the time_budget_ms request field) and passed down to the geocoding and
+distance services, which bound their upstream calls by the remaining time.
+- deadline
+"""
+
+# Request header carrying the client's time budget in milliseconds
+TIME_BUDGET_HEADER = "X-Time-Budget-Ms"
+
+
+class DeadlineExceeded(Exception):
+    """Raised when an operation cannot complete within the request's time budget. - deadline_exceeded"""
+
+
+class Deadline:
+    """A point in (monotonic) time by which the request must be answered. - deadline"""
+
+    def __init__(self, budget_seconds: float):
+        self.expires_at = time.monotonic() + max(0.0, budget_seconds)
+
+    @classmethod
+    def from_budget_ms(cls, budget_ms: Optional[float]) -> Optional["Deadline"]:
+        """Build a Deadline from a millisecond budget; None means no deadline. - from_budget_ms"""
+        if budget_ms is None:
+            return None
+        if budget_ms < 0:
+            raise ValueError("Time budget must be a non-negative number of milliseconds")
+        return cls(budget_ms / 1000.0)
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (never negative). - remaining"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        """True once no time is left. - expired"""
+        return self.remaining() <= 0.0
+
+
+async def run_with_deadline(aw: Awaitable[Any], deadline: Optional[Deadline]) -> Any:
+    """Await aw, cancelling it and raising DeadlineExceeded if the deadline passes first. - run_with_deadline"""
+    if deadline is None:
+        return await aw
+    if deadline.expired:
+        # Close the un-awaited coroutine to avoid "never awaited" warnings
+        close = getattr(aw, "close", None)
+        if close is not None:
+            close()
+        raise DeadlineExceeded("Time budget exhausted")
+    try:
+        return await asyncio.wait_for(aw, deadline.remaining())
+    except asyncio.TimeoutError as exc:
+        raise DeadlineExceeded("Time budget exhausted") from exc
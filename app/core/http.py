@@ -0,0 +1,47 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import httpx
+
+
+"""Shared outbound HTTP client.
+
+The application opens one pooled httpx.AsyncClient at startup so requests
+reuse warm upstream connections instead of paying connection setup each
+time. When no shared client exists (e.g. the app is driven without lifespan
+events, as in tests) http_client() falls back to a per-request client.
+- http
+"""
+
+# Per-call timeout used for every upstream request
+DEFAULT_TIMEOUT = 10.0
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def open_http_client() -> httpx.AsyncClient:
+    """Create the shared client (idempotent). - open_http_client"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=DEFAULT_TIMEOUT,
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    """Close the shared client if it is open. - close_http_client"""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+
+
+@asynccontextmanager
+async def http_client() -> AsyncIterator[httpx.AsyncClient]:
+    """Yield the shared client, or a short-lived one when none is open. - http_client"""
+    if _client is not None:
+        yield _client
+        return
+    async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT) as client:
+        yield client
@@ -0,0 +1,63 @@
+from typing import Any, Callable, Dict, Generic, List, Sequence, Tuple, TypeVar
+
+
+"""Process-wide service objects keyed by the settings that configure them.
+
+Pools, limiters, caches and learned state must outlive a single request, but
+get_settings() hands every caller its own copy of the settings. A Registry
+builds one object per distinct value of the settings fields it depends on and
+returns that same object for as long as the configuration is unchanged.
+clear_registries() forgets every object (used by the tests).
+- registry
+"""
+
+T = TypeVar("T")
+
+# Every registry created so far, so clear_registries() can reach them all
+_REGISTRIES: List["Registry[Any]"] = []
+
+
+def _hashable(value: Any) -> Any:
+    """Lists and dicts (e.g. OSRM_BACKENDS entries) as nested tuples. - hashable"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+
+class Registry(Generic[T]):
+    """Shared objects built by build(settings, *extra), one per key. - registry
+
+    The key is the extra arguments plus the values of the given settings
+    fields; fields missing from settings count as None.
+    """
+
+    def __init__(self, fields: Sequence[str], build: Callable[..., T]):
+        self.fields = tuple(fields)
+        self.build = build
+        self._objects: Dict[Tuple, T] = {}
+        _REGISTRIES.append(self)
+
+    def get(self, settings: Any, *extra: Any) -> T:
+        """Return the object for this configuration, building it on first use. - get"""
+        key = extra + tuple(_hashable(getattr(settings, name, None)) for name in self.fields)
+        obj = self._objects.get(key)
+        if obj is None:
+            obj = self.build(settings, *extra)
+            self._objects[key] = obj
+        return obj
+
+    def values(self) -> List[T]:
+        """Every object built so far. - values"""
+        return list(self._objects.values())
+
+    def clear(self) -> None:
+        """Forget every object. - clear"""
+        self._objects.clear()
+
+
+def clear_registries() -> None:
+    """Forget the objects of every registry. - clear_registries"""
+    for registry in _REGISTRIES:
+        registry.clear()
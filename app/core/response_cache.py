@@ -0,0 +1,283 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.registry import Registry
+
+
+"""Whole-response cache for repeated distance queries.
+
+ResponseCacheMiddleware is a plain ASGI middleware in front of the
+/api/distance* POST endpoints. The cache key is a SHA-256 over a canonical
+form of the request: path, negotiated response format, the JSON body with
+sorted keys (time_budget_ms dropped, it does not change a complete answer)
+and the settings that shape results (upstream URLs, OSRM profile, routing
+and estimator options). A hit replays the stored response without running
+geocoding, routing or serialization.
+
+Every cacheable response carries an ETag (a hash of its body). A request
+whose If-None-Match names the current ETag gets 304 Not Modified with no
+body. Responses that were degraded or incomplete because of a time budget,
+method=auto responses that fell back to offline estimates because routing
+failed, and non-200 responses, are never stored. Entries expire after a TTL and the
+cache is bounded by entry count and total body bytes (least recently used
+entries are evicted first).
+- response_cache
+"""
+
+CACHE_STATUS_HEADER = "x-response-cache"
+
+# Body fields that do not change a complete (non-degraded) response
+_IGNORED_BODY_FIELDS = ("time_budget_ms",)
+
+# Responses carrying these headers were cut short by a time budget, or fell
+# back to offline estimates because routing failed
+_UNCACHEABLE_HEADERS = (b"x-distance-degraded", b"x-distance-incomplete", b"x-distance-fallback")
+
+# Per-request headers that must not be replayed from the cache
+_VOLATILE_HEADERS = (b"content-length", b"etag", b"server-timing", CACHE_STATUS_HEADER.encode())
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class CachedResponse:
+    """A stored response. - cached_response"""
+
+    __slots__ = ("status", "headers", "body", "etag", "expires_at")
+
+    def __init__(self, status: int, headers: Headers, body: bytes, etag: str, expires_at: float):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """TTL cache of responses bounded by entry count and body bytes. - response_cache"""
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        max_entries: int = 1000,
+        max_bytes: int = 16 * 1024 * 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(0, max_bytes)
+        self._clock = clock
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Return the fresh entry for key, dropping it if expired. - get"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= self._clock():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, status: int, headers: Headers, body: bytes, etag: str) -> None:
+        """Store a response; bodies larger than the byte bound are not cached. - put"""
+        if len(body) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CachedResponse(status, headers, body, etag, self._clock() + self.ttl)
+        self._bytes += len(body)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+
+# Entries survive as long as the cache configuration is unchanged
+_CACHES: Registry[ResponseCache] = Registry(
+    ("response_cache_ttl_seconds", "response_cache_max_entries", "response_cache_max_bytes"),
+    lambda settings: ResponseCache(
+        ttl=settings.response_cache_ttl_seconds,
+        max_entries=settings.response_cache_max_entries,
+        max_bytes=settings.response_cache_max_bytes,
+    ),
+)
+
+
+def get_response_cache(settings: Any) -> ResponseCache:
+    """Return the shared response cache for the current settings. - get_response_cache"""
+    return _CACHES.get(settings)
+
+
+def _settings_fingerprint(settings: Any) -> List[Any]:
+    """Settings that change distance results (upstreams, profile, routing and estimator options). - settings_fingerprint"""
+    return [
+        settings.nominatim_url,
+        settings.public_nominatim_url,
+        settings.run_local,
+        settings.geocode_backend,
+        settings.use_osrm_online,
+        settings.osrm_service_url,
+        settings.osrm_profile,
+        settings.osrm_backends,
+        settings.detour_estimator_enabled,
+        settings.local_graph_path,
+        settings.local_router_mode,
+        settings.local_router_max_snap_km,
+    ]
+
+
+def _canonical_body(body: bytes, content_type: str) -> Any:
+    """JSON bodies as sorted-key JSON without ignored fields; anything else by digest. - canonical_body"""
+    if content_type.split(";")[0].strip().lower() == "application/json":
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            for field in _IGNORED_BODY_FIELDS:
+                data.pop(field, None)
+            return json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body).hexdigest()
+
+
+def cache_key(path: str, accept: str, content_type: str, body: bytes, settings: Any) -> str:
+    """SHA-256 over the canonical request and the relevant settings. - cache_key"""
+    canonical = json.dumps(
+        [path, accept.strip().lower(), _canonical_body(body, content_type), _settings_fingerprint(settings)],
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """RFC 7232 weak comparison of an If-None-Match value against etag. - etag_matches"""
+    if if_none_match.strip() == "*":
+        return True
+    tags = (t.strip() for t in if_none_match.split(","))
+    return any((t[2:] if t.startswith("W/") else t) == etag for t in tags)
+
+
+class ResponseCacheMiddleware:
+    """ASGI middleware serving repeated /api/distance* POSTs from the response cache. - response_cache_middleware"""
+
+    def __init__(self, app: Any, settings_factory: Callable[[], Any], path_prefix: str = "/api/distance"):
+        self.app = app
+        self.settings_factory = settings_factory
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+        settings = self.settings_factory()
+        if not settings.response_cache_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        cache = get_response_cache(settings)
+        key = cache_key(scope["path"], headers.get("accept", ""), headers.get("content-type", ""), body, settings)
+        if_none_match = headers.get("if-none-match")
+
+        entry = cache.get(key)
+        if entry is not None:
+            await _send_cached(send, entry.status, entry.headers, entry.body, entry.etag, if_none_match, "hit")
+            return
+
+        status, resp_headers, resp_body = await _run_app(self.app, scope, body)
+        if status != 200 or any(k.lower() in _UNCACHEABLE_HEADERS for k, _ in resp_headers):
+            await _send_raw(send, status, resp_headers, resp_body)
+            return
+
+        etag = '"' + hashlib.sha256(resp_body).hexdigest()[:32] + '"'
+        stored = [(k, v) for k, v in resp_headers if k.lower() not in _VOLATILE_HEADERS]
+        cache.put(key, status, stored, resp_body, etag)
+        passthrough = [(k, v) for k, v in resp_headers if k.lower() not in (b"content-length", b"etag")]
+        await _send_cached(send, status, passthrough, resp_body, etag, if_none_match, "miss")
+
+
+async def _read_body(receive: Callable) -> bytes:
+    """Drain the request body. - read_body"""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+async def _run_app(app: Any, scope: Dict[str, Any], body: bytes) -> Tuple[int, Headers, bytes]:
+    """Run the wrapped app on a buffered body and capture its response. - run_app"""
+    sent = False
+    finished = asyncio.Event()
+
+    async def replay() -> Dict[str, Any]:
+        nonlocal sent
+        if sent:
+            # Like a connected client: no disconnect until the response is complete,
+            # otherwise streaming layers would abort the body
+            await finished.wait()
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    status = 500
+    headers: Headers = []
+    chunks: List[bytes] = []
+
+    async def capture(message: Dict[str, Any]) -> None:
+        nonlocal status, headers
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            headers = list(message.get("headers", []))
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    try:
+        await app(scope, replay, capture)
+    finally:
+        finished.set()
+    return status, headers, b"".join(chunks)
+
+
+async def _send_raw(send: Callable, status: int, headers: Headers, body: bytes) -> None:
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_cached(
+    send: Callable,
+    status: int,
+    headers: Headers,
+    body: bytes,
+    etag: str,
+    if_none_match: Optional[str],
+    cache_status: str,
+) -> None:
+    """Send a cacheable response, or 304 when the client already has it. - send_cached"""
+    extra = [(b"etag", etag.encode("latin-1")), (CACHE_STATUS_HEADER.encode(), cache_status.encode())]
+    if if_none_match and _etag_matches(if_none_match, etag):
+        await _send_raw(send, 304, extra, b"")
+        return
+    out = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+    out.append((b"content-length", str(len(body)).encode("latin-1")))
+    await _send_raw(send, status, out + extra, body)
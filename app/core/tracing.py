@@ -0,0 +1,172 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+"""Lightweight per-request tracing.
+
+A sampled request gets a Trace stored in a context variable; span() records
+the duration of hot-path sections (Nominatim queries, OSRM calls, geodesic
+computation, response building) into it. When no trace is active span() is a
+no-op costing one context-variable lookup. At the end of the request the
+spans are summarized into a Server-Timing header and can be appended as one
+JSON line per request to a local file (which a log collector can tail).
+TracingMiddleware does the sampling as a plain ASGI middleware; it reads the
+sample rate and export path once, so unsampled requests cost one
+random() call.
+- tracing
+"""
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("distance_trace", default=None)
+
+
+class Trace:
+    """Spans recorded during one request. - trace"""
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, name: str, start: float, duration: float, attrs: Dict[str, Any]) -> None:
+        """Record a finished span (times from time.perf_counter()). - add"""
+        self.spans.append({"name": name, "start": start - self._t0, "duration": duration, "attrs": attrs})
+
+    def finish(self) -> None:
+        """Mark the end of the request. - finish"""
+        self.duration = time.perf_counter() - self._t0
+
+    def server_timing(self) -> str:
+        """Summarize spans per name as a Server-Timing header value. - server_timing"""
+        totals: Dict[str, List[float]] = {}
+        for s in self.spans:
+            entry = totals.setdefault(s["name"], [0.0, 0])
+            entry[0] += s["duration"]
+            entry[1] += 1
+
+        parts = []
+        for name, (duration, count) in totals.items():
+            parts.append(f'{name};dur={duration * 1000.0:.1f};desc="{count} call{"s" if count != 1 else ""}"')
+        if self.duration is not None:
+            parts.append(f"total;dur={self.duration * 1000.0:.1f}")
+        return ", ".join(parts)
+
+    def to_record(self, **fields: Any) -> Dict[str, Any]:
+        """JSON-serializable representation for exporters. - to_record"""
+        record = {
+            "trace_id": self.trace_id,
+            "start": self.started_at,
+            "duration_ms": (self.duration or 0.0) * 1000.0,
+            "spans": [
+                {
+                    "name": s["name"],
+                    "start_ms": s["start"] * 1000.0,
+                    "duration_ms": s["duration"] * 1000.0,
+                    **({"attrs": s["attrs"]} if s["attrs"] else {}),
+                }
+                for s in self.spans
+            ],
+        }
+        record.update(fields)
+        return record
+
+
+def start_trace(sample_rate: float) -> Optional[Trace]:
+    """Return a new Trace if this request is sampled, else None. - start_trace"""
+    if sample_rate <= 0.0 or (sample_rate < 1.0 and random.random() >= sample_rate):
+        return None
+    return Trace()
+
+
+def activate(trace: Trace) -> Token:
+    """Make trace the current one; pass the token to deactivate(). - activate"""
+    return _current.set(trace)
+
+
+def deactivate(token: Token) -> None:
+    """Restore the trace that was current before activate(). - deactivate"""
+    _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[None]:
+    """Time the enclosed block into the current trace, if any. - span"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter() - start, attrs)
+
+
+def export_jsonl(path: str, record: Dict[str, Any]) -> None:
+    """Append one trace record as a JSON line to path. - export_jsonl"""
+    with open(path, "a", encoding="utf-8") as fh:
+        fh.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+class TracingMiddleware:
+    """ASGI middleware tracing sampled HTTP requests. - tracing_middleware
+
+    The Server-Timing header is added when the response starts, so "total"
+    covers everything up to the first response byte (including response
+    serialization). The trace record is exported once the response is sent.
+    """
+
+    def __init__(self, app: Any, settings_factory: Callable[[], Any]):
+        self.app = app
+        self.settings_factory = settings_factory
+        self._config: Optional[Tuple[float, Optional[str]]] = None
+
+    def _sampling(self) -> Tuple[float, Optional[str]]:
+        """(sample rate, export path), read from the settings on first use. - sampling"""
+        if self._config is None:
+            settings = self.settings_factory()
+            self._config = (settings.trace_sample_rate, settings.trace_export_path or None)
+        return self._config
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        sample_rate, export_path = self._sampling()
+        trace = start_trace(sample_rate)
+        if trace is None:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                trace.finish()
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = activate(trace)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            deactivate(token)
+
+        if export_path:
+            record = trace.to_record(method=scope["method"], path=scope["path"], status=status)
+            try:
+                await asyncio.to_thread(export_jsonl, export_path, record)
+            except OSError:
+                # Tracing must never fail the request
+                pass
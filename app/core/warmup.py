@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from typing import Any, List
+import httpx
+
+from app.services.distance import PUBLIC_OSRM, geodesic_distance
+from app.services.local_router import get_local_router
+
+
+"""Startup warm-up and readiness state.
+
+warm_up() runs once in the background after startup: it forces lazy imports,
+maps the local road graph (if configured) and opens connections to the configured upstreams so the first real requests
+find warm connection pools. The /ready endpoint reports ready only after it
+has finished.
+- warmup
+"""
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for each warm-up probe; an unreachable upstream must not keep
+# the instance out of rotation for long.
+PROBE_TIMEOUT = 2.0
+
+
+class Readiness:
+    """Whether the instance has finished warming up. - readiness"""
+
+    def __init__(self):
+        self.ready = False
+
+
+readiness = Readiness()
+
+
+def _upstream_urls(settings: Any) -> List[str]:
+    """URLs worth pre-connecting to: primary Nominatim and OSRM backends. - upstream_urls"""
+    urls: List[str] = []
+    if settings.nominatim_url:
+        urls.append(settings.nominatim_url.rstrip("/") + "/status")
+    elif settings.run_local:
+        urls.append("http://nominatim:8080/status")
+
+    backends = getattr(settings, "osrm_backends", None) or []
+    if backends:
+        for spec in backends:
+            url = spec if isinstance(spec, str) else spec.get("url")
+            if url:
+                urls.append(url.rstrip("/") + "/")
+    elif settings.use_osrm_online:
+        urls.append(PUBLIC_OSRM + "/")
+    else:
+        urls.append(settings.osrm_service_url.rstrip("/") + "/")
+    return urls
+
+
+async def _probe(client: httpx.AsyncClient, url: str, user_agent: str) -> None:
+    """Open a connection to url; any HTTP response counts as success. - probe"""
+    try:
+        await client.get(url, headers={"User-Agent": user_agent}, timeout=PROBE_TIMEOUT)
+    except Exception as exc:
+        logger.warning("Warm-up probe to %s failed: %s", url, exc)
+
+
+async def warm_up(client: httpx.AsyncClient, settings: Any) -> None:
+    """Force lazy imports and pre-connect to upstreams, then mark the instance ready. - warm_up"""
+    try:
+        try:
+            geodesic_distance(0.0, 0.0, 0.0, 1.0)
+        except RuntimeError:
+            # geopy not installed; haversine will be used
+            pass
+
+        try:
+            graph = get_local_router(settings)
+            if graph is not None:
+                # Builds the snapping grid so the first local route does not pay for it
+                graph.nearest_node(0.0, 0.0, 0.0)
+        except (OSError, ValueError) as exc:
+            logger.warning("Could not load local road graph %s: %s", settings.local_graph_path, exc)
+
+        await asyncio.gather(*(_probe(client, url, settings.user_agent) for url in _upstream_urls(settings)))
+    finally:
+        readiness.ready = True
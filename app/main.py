@@ -1,5 +1,14 @@
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from app.api.routes import router
+from app.core.config import get_settings
+from app.core.http import open_http_client, close_http_client
+from app.core.response_cache import ResponseCacheMiddleware
+from app.core.tracing import TracingMiddleware
+from app.core.warmup import readiness, warm_up
+from app.services.estimator import save_detour_estimators
+from app.services.nominatim_db import close_nominatim_dbs
 
 
 """FastAPI application entrypoint.
@@ -10,8 +19,41 @@ app = FastAPI(title="Distance Finder")
 app.include_router(router, prefix="/api")
 
 
+# The lambdas look get_settings up at call time so tests can patch it.
+app.add_middleware(TracingMiddleware, settings_factory=lambda: get_settings())
+# Added after the tracing middleware so it runs first: cache hits skip the whole stack.
+app.add_middleware(ResponseCacheMiddleware, settings_factory=lambda: get_settings())
+
+
 # Simple root
 @app.get("/", tags=["root"])  
 async def root():
     """Root health endpoint. - health"""
     return {"status": "ok", "service": "distance-finder"}
+
+
+@app.get("/ready", tags=["root"])
+async def ready():
+    """Readiness endpoint: 503 until the startup warm-up has finished. - ready"""
+    if not readiness.ready:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready"}
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    """Load settings, open the shared HTTP client and warm up in the background. - startup"""
+    settings = get_settings()
+    client = open_http_client()
+    app.state.warm_up_task = asyncio.create_task(warm_up(client, settings))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop warm-up, close the shared HTTP client and database pools, and persist detour-estimator calibration. - shutdown"""
+    task = getattr(app.state, "warm_up_task", None)
+    if task is not None and not task.done():
+        task.cancel()
+    await close_http_client()
+    await close_nominatim_dbs()
+    save_detour_estimators()
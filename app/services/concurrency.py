@@ -0,0 +1,202 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional
+
+import httpx
+
+from app.core.registry import Registry
+
+
+"""Adaptive concurrency limits for self-hosted upstreams (OSRM, Nominatim).
+
+The public OSRM and Nominatim services are shared with everyone else, so
+their latency says little about our own load; callers do not limit them.
+
+Each upstream URL gets an AdaptiveLimiter that caps in-flight requests with
+an AIMD (additive-increase, multiplicative-decrease) limit:
+- a successful, fast response raises the limit by 1/limit, i.e. about one
+  slot per round of `limit` requests
+- a congestion signal (timeout, connection error, 5xx or 429) or a response
+  slower than slow_seconds multiplies the limit by backoff, at most once per
+  round (requests issued before the last decrease do not trigger another
+  one); other 4xx responses are answers from a healthy upstream and count as
+  successes
+- cancelled requests (deadline, lost hedge race) leave the limit unchanged
+  unless they had already been running longer than slow_seconds
+
+Requests over the limit wait in a FIFO queue; when max_queue requests are
+already waiting, new ones are shed immediately with UpstreamOverloaded so
+callers can fall back instead of piling onto a saturated upstream.
+- concurrency
+"""
+
+
+class UpstreamOverloaded(RuntimeError):
+    """Raised when an upstream's queue is full and the request is shed. - upstream_overloaded"""
+
+
+def is_congestion_status(status_code: int) -> bool:
+    """True for HTTP statuses that signal an overloaded or failing upstream. - is_congestion_status"""
+    return status_code >= 500 or status_code == 429
+
+
+def is_congestion_error(exc: BaseException) -> Optional[bool]:
+    """Whether an exception signals congestion; None when it says nothing about the upstream. - is_congestion_error"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return is_congestion_status(exc.response.status_code)
+    if isinstance(exc, (httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    return None
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a bounded wait queue. - adaptive_limiter"""
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int = 10,
+        min_limit: int = 1,
+        max_limit: int = 200,
+        max_queue: int = 100,
+        backoff: float = 0.7,
+        slow_seconds: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not 0.0 < backoff < 1.0:
+            raise ValueError(f"Limiter backoff must be in (0, 1): {backoff}")
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.max_queue = max(0, max_queue)
+        self.backoff = backoff
+        self.slow_seconds = slow_seconds
+        self._clock = clock
+        self._limit = float(min(self.max_limit, max(self.min_limit, initial_limit)))
+        self._last_decrease = float("-inf")
+        self.inflight = 0
+        self.shed = 0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+
+    @property
+    def limit(self) -> int:
+        """Current number of allowed in-flight requests. - limit"""
+        return int(self._limit)
+
+    @property
+    def queued(self) -> int:
+        """Requests waiting for a slot. - queued"""
+        return len(self._waiters)
+
+    async def acquire(self) -> float:
+        """Wait for a slot; returns the start time to pass to release(). - acquire"""
+        if self.inflight < self.limit and not self._waiters:
+            self.inflight += 1
+            return self._clock()
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            raise UpstreamOverloaded(f"Upstream {self.name} is overloaded ({self.inflight} in flight, {self.queued} queued)")
+
+        waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled; give it back
+                self.inflight -= 1
+                self._wake()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        return self._clock()
+
+    def release(self, started: float, failed: Optional[bool]) -> None:
+        """Free a slot and adapt the limit (failed=None: outcome unknown, e.g. cancelled). - release"""
+        self.inflight -= 1
+        latency = self._clock() - started
+        if failed or latency > self.slow_seconds:
+            if started >= self._last_decrease:
+                self._limit = max(float(self.min_limit), self._limit * self.backoff)
+                self._last_decrease = self._clock()
+        elif failed is False:
+            self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+        self._wake()
+
+    def _wake(self) -> None:
+        """Hand free slots to waiters in FIFO order. - wake"""
+        while self._waiters and self.inflight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.inflight += 1
+                waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold a slot for the enclosed call; exceptions are classified by is_congestion_error. - slot"""
+        started = await self.acquire()
+        failed: Optional[bool] = None
+        try:
+            yield
+            failed = False
+        except Exception as exc:
+            failed = is_congestion_error(exc)
+            raise
+        finally:
+            self.release(started, failed)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current limit, in-flight and queued requests. - stats"""
+        return {
+            "upstream": self.name,
+            "limit": self.limit,
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "shed": self.shed,
+        }
+
+
+def _build_limiter(settings: Any, kind: str, url: str) -> AdaptiveLimiter:
+    """Build the limiter of one upstream. - build_limiter"""
+    return AdaptiveLimiter(
+        f"{kind} {url}",
+        initial_limit=settings.upstream_limiter_initial,
+        min_limit=settings.upstream_limiter_min,
+        max_limit=settings.upstream_limiter_max,
+        max_queue=settings.upstream_limiter_max_queue,
+        backoff=settings.upstream_limiter_backoff,
+        slow_seconds=settings.upstream_limiter_slow_seconds,
+    )
+
+
+# One limiter per upstream; the learned limit survives as long as the
+# limiter configuration is unchanged
+_LIMITERS: Registry[AdaptiveLimiter] = Registry(
+    (
+        "upstream_limiter_initial",
+        "upstream_limiter_min",
+        "upstream_limiter_max",
+        "upstream_limiter_max_queue",
+        "upstream_limiter_backoff",
+        "upstream_limiter_slow_seconds",
+    ),
+    _build_limiter,
+)
+
+
+def get_upstream_limiter(kind: str, url: str, settings: Any) -> Optional[AdaptiveLimiter]:
+    """Return the shared limiter for an upstream URL, or None when limiting is disabled. - get_upstream_limiter
+
+    Callers skip this for the public OSRM and Nominatim services.
+    """
+    if not getattr(settings, "upstream_limiter_enabled", False):
+        return None
+    return _LIMITERS.get(settings, kind, url.rstrip("/"))
+
+
+def limiter_stats() -> List[Dict[str, Any]]:
+    """Stats of every limiter created so far. - limiter_stats"""
+    return [limiter.stats() for limiter in _LIMITERS.values()]
@@ -1,29 +1,83 @@
 from math import radians, sin, cos, asin, sqrt
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Sequence, Tuple
+import asyncio
+import time
 import httpx
 
+from app.core.deadline import Deadline, DeadlineExceeded, run_with_deadline
+from app.core.tracing import span
+from app.services.concurrency import get_upstream_limiter, is_congestion_error, is_congestion_status
+from app.services.estimator import get_detour_estimator
+from app.services.local_router import get_local_router
+from app.services.osrm_pool import get_osrm_pool
+
 
 """Distance utilities.
 
 Provides a pure-Python Haversine implementation and an optional geodesic
-backend powered by geopy (if installed). Additionally provides an OSRM-based
+backend powered by geopy (if installed, imported lazily on first use). Additionally provides an OSRM-based
 routing distance (uses either public router.project-osrm.org or a configured
 OSRM service). Exported helpers:
 - haversine_distance: always-available Haversine in kilometers
 - geodesic_distance: optional geopy-based geodesic
-- osrm_route_distance: async call to an OSRM service returning distance and duration
-- fallback and helpers
+- osrm_route_distance: async call to an OSRM service (or a backend from the
+  OSRM pool, see app.services.osrm_pool) returning distance and duration
+- haversine_many / geodesic_many: one-to-many straight-line distances
+  (origin terms computed once for haversine; geodesic skips geopy's
+  per-pair objects)
+- straight_line_distance: geodesic with haversine fallback
+- estimated_distance: road distance/duration predicted by the detour estimator
+  (see app.services.estimator)
+- local_route_many / LocalRoutes: in-process one-to-many routing over a
+  memory-mapped road graph (see app.services.local_router), run in a worker
+  thread so the search does not block the event loop
+- distance_via_best_method: OSRM (and/or the local router) with straight-line
+  fallback, bounded by an optional deadline
 
 - distance
 """
 
-try:
-    # Optional, used only if available
-    from geopy.distance import geodesic as _geopy_geodesic  # type: ignore
-    GEOPY_AVAILABLE = True
-except Exception:
-    _geopy_geodesic = None
-    GEOPY_AVAILABLE = False
+PUBLIC_OSRM = "https://router.project-osrm.org"
+
+# Client-selectable accuracy tiers:
+# - fast: haversine only, no network I/O
+# - geodesic: geodesic (haversine if geopy is missing), no network I/O
+# - route: OSRM only, errors instead of falling back
+# - estimated: straight-line distance scaled by the calibrated detour factor, no network I/O
+# - auto: OSRM with straight-line (or estimated, once calibrated) fallback
+DISTANCE_METHODS = ("auto", "route", "geodesic", "fast", "estimated")
+OFFLINE_METHODS = ("geodesic", "fast", "estimated")
+# Tiers whose distance changes by at most the origin's move
+STRAIGHT_LINE_METHODS = ("geodesic", "fast")
+
+# Appended to distance_method when a result was approximated because the
+# request's time budget ran out (e.g. "geodesic-degraded")
+DEGRADED_SUFFIX = "-degraded"
+
+# geopy is optional and comparatively slow to import, so it is loaded on first
+# use (or during warm-up) rather than at module import.
+_geopy_geodesic = None
+# geographiclib's WGS-84 solver, which geopy's geodesic wraps (geopy depends on it)
+_wgs84 = None
+_geopy_loaded = False
+
+
+def _load_geopy():
+    """Import geopy's geodesic on first use; return it, or None if geopy is missing. - lazy import"""
+    global _geopy_geodesic, _wgs84, _geopy_loaded
+    if not _geopy_loaded:
+        try:
+            from geopy.distance import geodesic  # type: ignore
+            _geopy_geodesic = geodesic
+        except Exception:
+            _geopy_geodesic = None
+        try:
+            from geographiclib.geodesic import Geodesic  # type: ignore
+            _wgs84 = Geodesic.WGS84
+        except Exception:
+            _wgs84 = None
+        _geopy_loaded = True
+    return _geopy_geodesic
 
 
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -42,21 +96,64 @@ def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     return c * r
 
 
+def haversine_many(lat1: float, lon1: float, points: Sequence[Tuple[float, float]]) -> List[float]:
+    """Haversine distances (km) from one origin to many (lat, lon) points. - haversine_many
+
+    Equivalent to calling haversine_distance per pair, with the origin's
+    trigonometry computed once.
+    """
+    rlat1 = radians(lat1)
+    rlon1 = radians(lon1)
+    cos_lat1 = cos(rlat1)
+    out: List[float] = []
+    append = out.append
+    for lat2, lon2 in points:
+        rlat2 = radians(lat2)
+        a = sin((rlat2 - rlat1) / 2) ** 2 + cos_lat1 * cos(rlat2) * sin((radians(lon2) - rlon1) / 2) ** 2
+        append(2 * asin(sqrt(a)) * 6371.0)
+    return out
+
+
 def geodesic_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Compute geodesic distance (in kilometers) using geopy if available.
 
     Raises RuntimeError if geopy is not installed.
     - geodesic
     """
-    if not GEOPY_AVAILABLE or _geopy_geodesic is None:
+    geodesic = _load_geopy()
+    if geodesic is None:
         raise RuntimeError("geopy is not available; install geopy to use geodesic distances")
 
     # geopy expects (lat, lon) pairs
-    d = _geopy_geodesic((lat1, lon1), (lat2, lon2))
+    with span("geodesic"):
+        d = geodesic((lat1, lon1), (lat2, lon2))
     # geopy returns distance object with kilometers attribute
     return float(d.kilometers)
 
 
+def geodesic_many(lat1: float, lon1: float, points: Sequence[Tuple[float, float]]) -> List[float]:
+    """Geodesic distances (km) from one origin to many (lat, lon) points. - geodesic_many
+
+    Calls geographiclib's WGS-84 inverse solver directly, asking for the
+    distance only: same results as geodesic_distance without building geopy
+    Point and Distance objects or computing azimuths per pair (about 1.5x
+    faster). The inverse solution itself is still per pair; geographiclib has
+    no public way to reuse origin terms across pairs.
+    Raises RuntimeError if geopy is not installed.
+    """
+    geodesic = _load_geopy()
+    if geodesic is None:
+        raise RuntimeError("geopy is not available; install geopy to use geodesic distances")
+
+    with span("geodesic", pairs=len(points)):
+        if _wgs84 is None:
+            origin = (lat1, lon1)
+            return [float(geodesic(origin, p).kilometers) for p in points]
+        inverse = _wgs84.Inverse
+        mask = _wgs84.DISTANCE
+        return [inverse(lat1, lon1, lat2, lon2, mask)["s12"] / 1000.0 for lat2, lon2 in points]
+
+
 async def osrm_route_distance(
     lat1: float,
     lon1: float,
@@ -70,10 +167,28 @@ async def osrm_route_distance(
     Returns a dict with keys: distance_km (float), duration_seconds (float), method (str).
     If an error occurs an exception is raised so callers can fallback to haversine.
 
-    Use settings.use_osrm_online to decide between public OSRM and configured OSRM service URL.
+    When settings.osrm_backends is configured the request is sent to a backend
+    from the shared OSRM pool covering both coordinates; pairs no backend
+    covers (or whose covering backends are all ejected) go to the public
+    server if settings.use_osrm_online is set.
+    Otherwise use settings.use_osrm_online to decide between public OSRM and
+    configured OSRM service URL.
+
+    With settings.upstream_limiter_enabled the call to a self-hosted backend
+    waits for a slot of the upstream's adaptive concurrency limit (see app.services.concurrency) and
+    raises UpstreamOverloaded (a RuntimeError) when its queue is full.
     """
-    if settings.use_osrm_online:
-        base_url = "https://router.project-osrm.org"
+    backend = None
+    pool = get_osrm_pool(settings)
+    if pool is not None:
+        backend = pool.select(lat1, lon1, lat2, lon2)
+        if backend is None and not settings.use_osrm_online:
+            raise RuntimeError("No healthy OSRM backend covers the requested coordinates")
+
+    if backend is not None:
+        base_url = backend.url
+    elif settings.use_osrm_online:
+        base_url = PUBLIC_OSRM
     else:
         base_url = settings.osrm_service_url.rstrip("/")
 
@@ -85,21 +200,54 @@ async def osrm_route_distance(
 
     headers = {"User-Agent": getattr(settings, "user_agent", "distance-finder/1.0")}
 
+    # The public server's latency reflects everyone's load, not ours
+    limiter = get_upstream_limiter("osrm", base_url, settings) if base_url != PUBLIC_OSRM else None
+    limiter_started = await limiter.acquire() if limiter is not None else 0.0
+    # None until the call finishes (a cancelled call leaves the limit as is)
+    failed: Optional[bool] = None
+
+    if backend is not None:
+        backend.outstanding += 1
+    started = time.monotonic()
     try:
-        resp = await client.get(url, headers=headers)
+        with span("osrm", backend=base_url):
+            resp = await client.get(url, headers=headers)
+        failed = is_congestion_status(resp.status_code)
     except Exception as exc:
+        failed = is_congestion_error(exc)
+        if backend is not None:
+            pool.record_failure(backend)
         raise RuntimeError(f"OSRM request failed: {exc}") from exc
+    finally:
+        if backend is not None:
+            backend.outstanding -= 1
+        if limiter is not None:
+            limiter.release(limiter_started, failed)
 
     if resp.status_code != 200:
+        # 4xx means the request itself was rejected (e.g. NoRoute); only
+        # server-side errors say something about the backend's health.
+        if backend is not None:
+            if resp.status_code >= 500:
+                pool.record_failure(backend)
+            else:
+                pool.record_success(backend, time.monotonic() - started)
         raise RuntimeError(f"OSRM returned status {resp.status_code}")
 
-    data = resp.json()
-    if not data or data.get("code") != "Ok":
+    if backend is not None:
+        pool.record_success(backend, time.monotonic() - started)
+
+    try:
+        data = resp.json()
+    except ValueError as exc:
+        # e.g. an HTML error page from a proxy in front of OSRM
+        raise RuntimeError(f"OSRM returned invalid JSON: {exc}") from exc
+    if not isinstance(data, dict) or data.get("code") != "Ok":
         # Some OSRM instances might return different keys; be defensive
         raise RuntimeError(f"OSRM response error: {data}")
 
     routes = data.get("routes")
-    if not routes:
+    if not routes or not isinstance(routes, list) or not isinstance(routes[0], dict):
         raise RuntimeError("OSRM returned no routes")
 
     route = routes[0]
@@ -123,6 +271,119 @@ async def osrm_route_distance(
     return {"distance_km": distance_km, "duration_seconds": duration_seconds, "method": "osrm"}
 
 
+def straight_line_distance(
+    lat1: float,
+    lon1: float,
+    lat2: float,
+    lon2: float,
+    degraded: bool = False,
+) -> Dict[str, Any]:
+    """Geodesic distance if available, otherwise haversine. - straight_line
+
+    When degraded is True the method is suffixed with DEGRADED_SUFFIX to tell
+    clients the result was approximated because the time budget ran out.
+    """
+    suffix = DEGRADED_SUFFIX if degraded else ""
+    # Try geodesic if available
+    try:
+        d_km = geodesic_distance(lat1, lon1, lat2, lon2)
+        return {"distance_km": d_km, "duration_seconds": None, "method": "geodesic" + suffix}
+    except Exception:
+        # fallback to haversine
+        d_km = haversine_distance(lat1, lon1, lat2, lon2)
+        return {"distance_km": d_km, "duration_seconds": None, "method": "haversine" + suffix}
+
+
+def estimated_distance(lat1: float, lon1: float, lat2: float, lon2: float, settings: Any) -> Dict[str, Any]:
+    """Predict road distance and duration with the calibrated detour estimator. - estimated"""
+    straight_km = haversine_distance(lat1, lon1, lat2, lon2)
+    return get_detour_estimator(settings).estimate(lat1, lon1, lat2, lon2, straight_km)
+
+
+def _fallback_distance(
+    lat1: float,
+    lon1: float,
+    lat2: float,
+    lon2: float,
+    settings: Any,
+    degraded: bool = False,
+) -> Dict[str, Any]:
+    """Best offline answer: calibrated estimate when enabled, else straight-line. - fallback"""
+    if getattr(settings, "detour_estimator_enabled", False):
+        estimator = get_detour_estimator(settings)
+        if estimator.is_calibrated(lat1, lon1, lat2, lon2):
+            result = estimated_distance(lat1, lon1, lat2, lon2, settings)
+            if degraded:
+                result["method"] += DEGRADED_SUFFIX
+            return result
+    return straight_line_distance(lat1, lon1, lat2, lon2, degraded=degraded)
+
+
+def _record_route(lat1: float, lon1: float, lat2: float, lon2: float, result: Dict[str, Any], settings: Any) -> None:
+    """Feed a successful OSRM route into the detour estimator when enabled. - record_route"""
+    if not getattr(settings, "detour_estimator_enabled", False):
+        return
+    straight_km = haversine_distance(lat1, lon1, lat2, lon2)
+    get_detour_estimator(settings).record(
+        lat1, lon1, lat2, lon2, straight_km, result["distance_km"], result.get("duration_seconds")
+    )
+
+
+async def local_route_many(
+    lat1: float,
+    lon1: float,
+    points: Sequence[Tuple[float, float]],
+    settings: Any,
+) -> List[Optional[Dict[str, Any]]]:
+    """Route one origin to many points on the embedded road graph with a single search. - local_route_many
+
+    Returns None for every point when local routing is disabled, and per
+    point when it cannot be snapped or reached. The search runs in a worker
+    thread.
+    """
+    try:
+        graph = get_local_router(settings)
+    except (OSError, ValueError):
+        # Missing or invalid graph file: behave as if local routing were disabled
+        graph = None
+    if graph is None or not points:
+        return [None] * len(points)
+    with span("local_route", pairs=len(points)):
+        return await asyncio.to_thread(
+            graph.one_to_many, lat1, lon1, list(points), settings.local_router_max_snap_km
+        )
+
+
+class LocalRoutes:
+    """Local routes from one origin to a request's destinations, searched once on first use. - local_routes
+
+    Shared by the per-destination distance_via_best_method calls of a
+    request so the graph is searched once for all destinations (and not at
+    all in fallback mode when OSRM answers every pair).
+    """
+
+    def __init__(self, lat: float, lon: float, points: Sequence[Tuple[float, float]], settings: Any):
+        self.lat = lat
+        self.lon = lon
+        self.points = list(points)
+        self.settings = settings
+        self._routes: Optional[Dict[Tuple[float, float], Optional[Dict[str, Any]]]] = None
+        self._lock = asyncio.Lock()
+
+    async def get(self, lat: float, lon: float) -> Optional[Dict[str, Any]]:
+        """Local route from the origin to (lat, lon), or None. - get"""
+        if self._routes is None:
+            async with self._lock:
+                if self._routes is None:
+                    rows = await local_route_many(self.lat, self.lon, self.points, self.settings)
+                    self._routes = dict(zip(self.points, rows))
+        if (lat, lon) not in self._routes:
+            # Not one of the batched destinations
+            return (await local_route_many(self.lat, self.lon, [(lat, lon)], self.settings))[0]
+        route = self._routes[(lat, lon)]
+        return dict(route) if route is not None else None
+
+
 async def distance_via_best_method(
     lat1: float,
     lon1: float,
@@ -130,27 +391,69 @@ async def distance_via_best_method(
     lon2: float,
     client: Optional[httpx.AsyncClient],
     settings: Any,
+    deadline: Optional[Deadline] = None,
+    method: str = "auto",
+    local_routes: Optional[LocalRoutes] = None,
 ) -> Dict[str, Optional[float]]:
     """Try OSRM first (if client provided), fallback to geodesic/geographic haversine.
 
+    method selects the accuracy tier (see DISTANCE_METHODS): "fast",
+    "geodesic" and "estimated" never touch the network, "route" raises
+    RuntimeError instead of falling back when OSRM fails. With
+    settings.detour_estimator_enabled, OSRM results calibrate the estimator
+    and calibrated pairs fall back to "estimated" instead of straight-line.
+
+    With settings.local_graph_path, the embedded router (method "local") is
+    tried before OSRM when local_router_mode is "primary", or after OSRM
+    fails when it is "fallback"; "route" accepts either. Callers computing
+    many destinations from one origin pass a shared LocalRoutes so the graph
+    is searched once per request.
+
+    With a deadline, OSRM is only given the remaining time budget; if the
+    budget is already spent or runs out the straight-line result is marked
+    as degraded.
+
     Returns dict with distance_km, duration_seconds, method.
     """
+    if method == "fast":
+        d_km = haversine_distance(lat1, lon1, lat2, lon2)
+        return {"distance_km": d_km, "duration_seconds": None, "method": "haversine"}
+    if method == "geodesic":
+        return straight_line_distance(lat1, lon1, lat2, lon2)
+    if method == "estimated":
+        return estimated_distance(lat1, lon1, lat2, lon2, settings)
+
+    if local_routes is None:
+        local_routes = LocalRoutes(lat1, lon1, [(lat2, lon2)], settings)
+    local_mode = getattr(settings, "local_router_mode", "fallback")
+    if local_mode == "primary":
+        local = await local_routes.get(lat2, lon2)
+        if local is not None:
+            return local
+
     # Try OSRM if we have an HTTP client and settings allow it
+    osrm_error: Exception = RuntimeError("Routing requires an HTTP client")
     if client is not None:
         try:
-            result = await osrm_route_distance(lat1, lon1, lat2, lon2, client, settings)
+            result = await run_with_deadline(osrm_route_distance(lat1, lon1, lat2, lon2, client, settings), deadline)
             # If OSRM returned a valid distance, prefer it
             if result.get("distance_km") is not None:
+                _record_route(lat1, lon1, lat2, lon2, result, settings)
                 return result
-        except Exception:
-            # swallow and fallback
-            pass
-
-    # Try geodesic if available
-    try:
-        d_km = geodesic_distance(lat1, lon1, lat2, lon2)
-        return {"distance_km": d_km, "duration_seconds": None, "method": "geodesic"}
-    except Exception:
-        # fallback to haversine
-        d_km = haversine_distance(lat1, lon1, lat2, lon2)
-        return {"distance_km": d_km, "duration_seconds": None, "method": "haversine"}
+            osrm_error = RuntimeError("OSRM returned no distance")
+        except DeadlineExceeded:
+            # The local router answers in-process, so it still beats a degraded estimate
+            local = await local_routes.get(lat2, lon2) if local_mode == "fallback" else None
+            return local or _fallback_distance(lat1, lon1, lat2, lon2, settings, degraded=True)
+        except Exception as exc:
+            # swallow and fallback (unless method is "route" and no local route exists)
+            osrm_error = exc
+
+    if local_mode == "fallback":
+        local = await local_routes.get(lat2, lon2)
+        if local is not None:
+            return local
+    if method == "route":
+        raise osrm_error
+
+    return _fallback_distance(lat1, lon1, lat2, lon2, settings)
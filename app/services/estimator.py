@@ -0,0 +1,265 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+from math import floor
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.registry import Registry
+
+
+"""Calibrated detour-factor estimator for approximate road distances.
+
+Straight-line distances underestimate road distances, and by how much depends
+on the street network. The estimator records (straight-line, road distance,
+duration) triples from successful OSRM routes, aggregates them on a lat/lon
+grid keyed by the pair's midpoint, and fits per-cell:
+- a detour factor: sum(road_km) / sum(straight_km)
+- an average speed: sum(road_km) / sum(duration_seconds), both sums over the
+  samples that came with a duration only
+
+Cells with too few samples fall back to the global fit, then to the configured
+defaults. Calibration can be persisted to a JSON file so it survives restarts;
+periodic saves run in the default executor so the event loop never waits on
+the disk.
+- estimator
+"""
+
+# Index of each running sum in a cell's stats list; the _TIMED_* sums only
+# cover samples with a duration and feed the speed fit
+_N, _STRAIGHT, _ROAD, _DURATION, _TIMED_N, _TIMED_ROAD = 0, 1, 2, 3, 4, 5
+_STATS_SIZE = 6
+
+# Pairs closer than this are dominated by snapping noise and are not recorded
+MIN_STRAIGHT_KM = 0.05
+
+# Observations with a larger road/straight ratio are treated as outliers
+# (ferries, unroutable detours) and ignored
+MAX_DETOUR_FACTOR = 5.0
+
+
+class DetourEstimator:
+    """Grid of fitted detour factors and speeds. - detour_estimator"""
+
+    def __init__(
+        self,
+        cell_deg: float = 0.5,
+        min_samples: int = 20,
+        default_factor: float = 1.3,
+        default_speed_kmh: float = 40.0,
+        path: Optional[str] = None,
+        save_every: int = 100,
+    ):
+        if cell_deg <= 0:
+            raise ValueError("Estimator cell size must be positive")
+        self.cell_deg = cell_deg
+        self.min_samples = max(1, min_samples)
+        self.default_factor = default_factor
+        self.default_speed_kmh = default_speed_kmh
+        self.path = path or None
+        self.save_every = max(1, save_every)
+        self._cells: Dict[Tuple[int, int], List[float]] = {}
+        self._global: List[float] = [0.0] * _STATS_SIZE
+        self._unsaved = 0
+        # Background save in flight, if any
+        self._pending: Optional["asyncio.Future[None]"] = None
+        # Snapshots are numbered so an older one never overwrites a newer one
+        self._snapshots = 0
+        self._written = 0
+        self._write_lock = threading.Lock()
+
+        if self.path:
+            self.load()
+
+    def _cell(self, lat1: float, lon1: float, lat2: float, lon2: float) -> Tuple[int, int]:
+        """Grid cell of the pair's midpoint. - cell"""
+        return (floor((lat1 + lat2) / 2 / self.cell_deg), floor((lon1 + lon2) / 2 / self.cell_deg))
+
+    def record(
+        self,
+        lat1: float,
+        lon1: float,
+        lat2: float,
+        lon2: float,
+        straight_km: float,
+        road_km: float,
+        duration_seconds: Optional[float],
+    ) -> None:
+        """Add one routed observation to the calibration. - record
+
+        straight_km must come from the same straight-line formula later passed
+        to estimate() (haversine in app.services.distance).
+        """
+        if straight_km < MIN_STRAIGHT_KM or road_km is None or road_km <= 0:
+            return
+        if road_km / straight_km > MAX_DETOUR_FACTOR:
+            return
+
+        timed = duration_seconds is not None and duration_seconds > 0
+        stats = self._cells.setdefault(self._cell(lat1, lon1, lat2, lon2), [0.0] * _STATS_SIZE)
+        for target in (stats, self._global):
+            target[_N] += 1
+            target[_STRAIGHT] += straight_km
+            target[_ROAD] += road_km
+            if timed:
+                target[_TIMED_N] += 1
+                target[_TIMED_ROAD] += road_km
+                target[_DURATION] += duration_seconds
+
+        self._unsaved += 1
+        if self.path and self._unsaved >= self.save_every and self._pending is None:
+            self._save_in_background()
+
+    def _fitted_stats(
+        self, lat1: float, lon1: float, lat2: float, lon2: float, count: int = _N
+    ) -> Optional[List[float]]:
+        """Stats of the pair's cell, or the global stats, with enough samples (counted at index count). - fitted_stats"""
+        stats = self._cells.get(self._cell(lat1, lon1, lat2, lon2))
+        if stats is not None and stats[count] >= self.min_samples:
+            return stats
+        if self._global[count] >= self.min_samples:
+            return self._global
+        return None
+
+    def is_calibrated(self, lat1: float, lon1: float, lat2: float, lon2: float) -> bool:
+        """True when a fitted factor (cell or global) is available for the pair. - is_calibrated"""
+        return self._fitted_stats(lat1, lon1, lat2, lon2) is not None
+
+    def estimate(self, lat1: float, lon1: float, lat2: float, lon2: float, straight_km: float) -> Dict[str, Any]:
+        """Estimate road distance and duration for a pair from its straight-line distance. - estimate
+
+        Returns dict with distance_km, duration_seconds and method "estimated".
+        """
+        factor = self.default_factor
+        speed_kms = self.default_speed_kmh / 3600.0
+
+        stats = self._fitted_stats(lat1, lon1, lat2, lon2)
+        if stats is not None:
+            factor = stats[_ROAD] / stats[_STRAIGHT]
+        timed = self._fitted_stats(lat1, lon1, lat2, lon2, count=_TIMED_N)
+        if timed is not None:
+            speed_kms = timed[_TIMED_ROAD] / timed[_DURATION]
+
+        distance_km = straight_km * factor
+        duration_seconds = distance_km / speed_kms if speed_kms > 0 else None
+        return {"distance_km": distance_km, "duration_seconds": duration_seconds, "method": "estimated"}
+
+    def load(self) -> None:
+        """Load calibration from self.path; a missing or mismatched file is ignored. - load"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return
+        if data.get("cell_deg") != self.cell_deg:
+            # Cells from a different grid cannot be reused
+            return
+
+        global_stats = [float(v) for v in data.get("global", [0.0] * _STATS_SIZE)]
+        cells: Dict[Tuple[int, int], List[float]] = {}
+        for key, stats in data.get("cells", {}).items():
+            i, j = key.split(",")
+            cells[(int(i), int(j))] = [float(v) for v in stats]
+        if len(global_stats) != _STATS_SIZE or any(len(stats) != _STATS_SIZE for stats in cells.values()):
+            # Written with a different stats layout (e.g. before timed sums existed)
+            return
+        self._cells = cells
+        self._global = global_stats
+
+    def save(self) -> None:
+        """Persist calibration to self.path atomically (blocking; see record() for background saves). - save"""
+        if not self.path:
+            return
+        count = self._unsaved
+        version, data = self._snapshot()
+        try:
+            self._write(version, data)
+        except Exception:
+            self._unsaved += count
+            raise
+
+    def _snapshot(self) -> Tuple[int, Dict[str, Any]]:
+        """Numbered copy of the calibration, safe to serialize in another thread; resets the unsaved count. - snapshot"""
+        self._snapshots += 1
+        self._unsaved = 0
+        data = {
+            "cell_deg": self.cell_deg,
+            "global": list(self._global),
+            "cells": {f"{i},{j}": list(stats) for (i, j), stats in self._cells.items()},
+        }
+        return self._snapshots, data
+
+    def _save_in_background(self) -> None:
+        """Write a snapshot in the default executor; synchronously when no event loop runs. - save_in_background"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        count = self._unsaved
+        version, data = self._snapshot()
+        self._pending = loop.run_in_executor(None, self._write, version, data)
+
+        def done(future: "asyncio.Future[None]") -> None:
+            self._pending = None
+            if future.cancelled() or future.exception() is not None:
+                # Keep the samples counted so the next record() retries
+                self._unsaved += count
+
+        self._pending.add_done_callback(done)
+
+    def _write(self, version: int, data: Dict[str, Any]) -> None:
+        """Atomically write snapshot data unless a newer snapshot is already on disk. - write"""
+        with self._write_lock:
+            if version <= self._written:
+                return
+            self._write_file(data)
+            self._written = version
+
+    def _write_file(self, data: Dict[str, Any]) -> None:
+        """Write data to self.path via a temporary file and rename. - write_file"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(data, fh)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+# Calibration accumulates as long as the estimator configuration is unchanged
+_ESTIMATORS: Registry[DetourEstimator] = Registry(
+    (
+        "detour_estimator_cell_deg",
+        "detour_estimator_min_samples",
+        "detour_estimator_default_factor",
+        "detour_estimator_default_speed_kmh",
+        "detour_estimator_path",
+    ),
+    lambda settings: DetourEstimator(
+        cell_deg=settings.detour_estimator_cell_deg,
+        min_samples=settings.detour_estimator_min_samples,
+        default_factor=settings.detour_estimator_default_factor,
+        default_speed_kmh=settings.detour_estimator_default_speed_kmh,
+        path=settings.detour_estimator_path,
+    ),
+)
+
+
+def get_detour_estimator(settings: Any) -> DetourEstimator:
+    """Return the shared estimator for the current settings. - get_detour_estimator"""
+    return _ESTIMATORS.get(settings)
+
+
+def save_detour_estimators() -> None:
+    """Persist every estimator that has a path configured (called on shutdown). - save_detour_estimators"""
+    for estimator in _ESTIMATORS.values():
+        if estimator.path and estimator._unsaved:
+            estimator.save()
@@ -1,20 +1,46 @@
-from typing import Tuple, List
+from typing import Tuple, List, Any, Optional, Set, Union
+import asyncio
+import logging
+import time
 import httpx
 
 from app.core.config import Settings
+from app.core.deadline import Deadline, run_with_deadline
+from app.core.http import http_client
+from app.core.tracing import span
+from app.services.concurrency import UpstreamOverloaded, get_upstream_limiter
+from app.services.hedging import get_hedge_policy
+from app.services.nominatim_db import DATABASE_ERRORS, DatabaseUnavailable, get_nominatim_db
+from app.services.specificity import PartsKey, get_specificity_memory, normalize_parts
 
 
 """Simple geocoding service that queries a Nominatim-compatible endpoint.
 
 This module will try the configured Nominatim URL and fall back to the public
 nominatim.openstreetmap.org service if the primary endpoint fails or returns
-no results.
+no results. With settings.geocode_hedge_enabled the fallback is also raced
+against a slow primary (see app.services.hedging). With
+settings.geocode_memory_enabled, geocode_best_effort remembers which level of
+specificity resolves for each parts list (see app.services.specificity).
+With settings.geocode_backend = "db", addresses are first looked up directly
+in the local Nominatim database (see app.services.nominatim_db), using HTTP
+only for addresses it cannot match.
 - geocode
 """
 
+logger = logging.getLogger(__name__)
+
 # Module-level public fallback constant (tests import this)
 PUBLIC_NOMINATIM = "https://nominatim.openstreetmap.org"
 
+# Concurrent lookups against the self-hosted Nominatim for the addresses of a
+# batch the database did not match
+BATCH_HTTP_CONCURRENCY = 4
+
+
+class AddressNotFound(ValueError):
+    """Raised when the geocoder answered but found no match (as opposed to failing). - address_not_found"""
+
 
 async def _query_nominatim(address: str, client: httpx.AsyncClient, url: str, user_agent: str):
     """Internal helper to query a Nominatim /search endpoint. - helper"""
@@ -26,6 +52,22 @@ async def _query_nominatim(address: str, client: httpx.AsyncClient, url: str, us
     return resp.json()
 
 
+async def _limited_query(address: str, client: httpx.AsyncClient, url: str, settings: Settings):
+    """_query_nominatim within a self-hosted endpoint's adaptive concurrency limit, when enabled. - helper"""
+    # Public-service time is reported separately so fallbacks stand out in Server-Timing
+    public_url = settings.public_nominatim_url or PUBLIC_NOMINATIM
+    public = url.rstrip("/") == public_url.rstrip("/")
+    name = "nominatim_public" if public else "nominatim"
+    # The public service's latency reflects everyone's load, not ours
+    limiter = None if public else get_upstream_limiter("nominatim", url, settings)
+    if limiter is None:
+        with span(name):
+            return await _query_nominatim(address, client, url, settings.user_agent)
+    async with limiter.slot():
+        with span(name):
+            return await _query_nominatim(address, client, url, settings.user_agent)
+
+
 async def geocode_address(address: str, client: httpx.AsyncClient, settings: Settings) -> Tuple[float, float]:
     """Geocode an address string using the configured Nominatim endpoint.
 
@@ -37,31 +79,120 @@ async def geocode_address(address: str, client: httpx.AsyncClient, settings: Set
 
     Returns (lat, lon) as floats. Raises ValueError if not found or both
     endpoints fail.
+
+    With settings.geocode_backend == "db" the local Nominatim database is
+    queried first and HTTP is only used when it finds no match.
     - geocode_address
     """
-    public_url = settings.public_nominatim_url or PUBLIC_NOMINATIM
+    if settings.geocode_backend == "db":
+        found = (await _db_lookup([address], settings))[0]
+        if found is not None:
+            return found
+    return await _geocode_http(address, client, settings)
+
+
+async def _db_lookup(addresses: List[str], settings: Settings) -> List[Optional[Tuple[float, float]]]:
+    """Batch database lookup; database errors are logged and count as no match so HTTP takes over. - helper"""
+    try:
+        return await get_nominatim_db(settings).lookup_many(addresses)
+    except DatabaseUnavailable:
+        # Logged once when the connect failed; skipped until the retry window passes
+        return [None] * len(addresses)
+    except DATABASE_ERRORS as exc:
+        logger.warning("Nominatim database lookup failed, using HTTP: %r", exc, exc_info=True)
+        return [None] * len(addresses)
+
+
+async def geocode_many(
+    addresses: List[str],
+    client: httpx.AsyncClient,
+    settings: Settings,
+) -> List[Union[Tuple[float, float], ValueError]]:
+    """Geocode many addresses, in one database round trip when geocode_backend is "db". - geocode_many
 
-    # Determine primary url: prefer explicitly configured settings.nominatim_url,
-    # otherwise if run_local is True use the typical nominatim container URL,
-    # otherwise fall back to the public service.
+    Returns, per address, (lat, lon) or a ValueError. Addresses the database
+    does not match go to the self-hosted Nominatim only: a batch never fans
+    out to the public service (its usage policy allows 1 request/s), so
+    without a self-hosted endpoint they are reported as not found. See
+    batch_geocoding_available.
+    """
+    if settings.geocode_backend == "db":
+        found: List[Optional[Tuple[float, float]]] = await _db_lookup(addresses, settings)
+    else:
+        found = [None] * len(addresses)
+
+    semaphore = asyncio.Semaphore(BATCH_HTTP_CONCURRENCY)
+    url = self_hosted_nominatim_url(settings)
+
+    async def fallback(address: str) -> Union[Tuple[float, float], ValueError]:
+        if url is None:
+            return AddressNotFound(f"Address not found in the Nominatim database: {address}")
+        async with semaphore:
+            try:
+                return await _geocode_self_hosted(address, client, url, settings)
+            except ValueError as exc:
+                return exc
+
+    misses = [i for i, latlon in enumerate(found) if latlon is None]
+    resolved = await asyncio.gather(*(fallback(addresses[i]) for i in misses))
+    results: List[Union[Tuple[float, float], ValueError]] = list(found)  # type: ignore[arg-type]
+    for i, result in zip(misses, resolved):
+        results[i] = result
+    return results
+
+
+def self_hosted_nominatim_url(settings: Settings) -> Optional[str]:
+    """The self-hosted primary Nominatim URL, or None when only the public service is configured. - helper
+
+    Prefers an explicitly configured settings.nominatim_url, otherwise the
+    typical nominatim container URL when run_local is True.
+    """
     if settings.nominatim_url:
-        primary_url = settings.nominatim_url.rstrip("/")
+        url = settings.nominatim_url.rstrip("/")
     elif settings.run_local:
-        primary_url = "http://nominatim:8080"
+        url = "http://nominatim:8080"
     else:
-        primary_url = public_url.rstrip("/")
+        return None
+    public_url = (settings.public_nominatim_url or PUBLIC_NOMINATIM).rstrip("/")
+    return None if url == public_url else url
+
+
+def batch_geocoding_available(settings: Settings) -> bool:
+    """True when batches can be served without the public Nominatim (database backend or self-hosted HTTP). - batch_geocoding_available"""
+    return settings.geocode_backend == "db" or self_hosted_nominatim_url(settings) is not None
+
+
+async def _geocode_self_hosted(address: str, client: httpx.AsyncClient, url: str, settings: Settings) -> Tuple[float, float]:
+    """geocode_address against the self-hosted endpoint only, with no public fallback or hedge. - helper"""
+    try:
+        data = await _limited_query(address, client, url, settings)
+    except (httpx.HTTPError, UpstreamOverloaded) as exc:
+        raise ValueError(f"Geocoding request failed for address '{address}': {exc}") from exc
+    if not data:
+        raise AddressNotFound(f"Address not found: {address}")
+    return _first_latlon(address, data)
+
+
+async def _geocode_http(address: str, client: httpx.AsyncClient, settings: Settings) -> Tuple[float, float]:
+    """geocode_address over Nominatim's HTTP API (primary, hedge and public fallback). - helper"""
+    public_url = settings.public_nominatim_url or PUBLIC_NOMINATIM
+    primary_url = self_hosted_nominatim_url(settings) or public_url.rstrip("/")
 
     tried_public = primary_url.rstrip("/") == public_url.rstrip("/")
 
+    if settings.geocode_hedge_enabled and not tried_public:
+        data = await _hedged_query(address, client, primary_url, public_url, settings)
+        return _first_latlon(address, data)
+
     # Try primary endpoint
     try:
-        data = await _query_nominatim(address, client, primary_url, settings.user_agent)
-    except httpx.RequestError as exc:
-        # network-level error, try public fallback if available
+        data = await _limited_query(address, client, primary_url, settings)
+    except (httpx.RequestError, UpstreamOverloaded) as exc:
+        # network-level error (or shed by the concurrency limiter), try public fallback if available
         if tried_public:
             raise ValueError(f"Geocoding request failed for address '{address}': {exc}") from exc
         try:
-            data = await _query_nominatim(address, client, public_url, settings.user_agent)
+            data = await _limited_query(address, client, public_url, settings)
         except Exception as exc2:
             raise ValueError(f"Geocoding failed for address '{address}': primary error {exc}; fallback error {exc2}") from exc2
     except httpx.HTTPStatusError as exc:
@@ -69,21 +200,26 @@ async def geocode_address(address: str, client: httpx.AsyncClient, settings: Set
         if tried_public:
             raise ValueError(f"Geocoding HTTP error for address '{address}': {exc}") from exc
         try:
-            data = await _query_nominatim(address, client, public_url, settings.user_agent)
+            data = await _limited_query(address, client, public_url, settings)
         except Exception as exc2:
             raise ValueError(f"Geocoding failed for address '{address}': primary HTTP error {exc}; fallback error {exc2}") from exc2
 
     # If primary returned but no results, attempt fallback (if applicable)
     if not data:
         if tried_public:
-            raise ValueError(f"Address not found: {address}")
+            raise AddressNotFound(f"Address not found: {address}")
         try:
-            data = await _query_nominatim(address, client, public_url, settings.user_agent)
+            data = await _limited_query(address, client, public_url, settings)
         except Exception as exc:
             raise ValueError(f"Address not found and fallback failed for: {address}. Error: {exc}") from exc
         if not data:
-            raise ValueError(f"Address not found: {address}")
+            raise AddressNotFound(f"Address not found: {address}")
+
+    return _first_latlon(address, data)
 
+
+def _first_latlon(address: str, data: List[Any]) -> Tuple[float, float]:
+    """Extract (lat, lon) from the first Nominatim result item. - helper"""
     item = data[0]
     try:
         lat = float(item["lat"])
@@ -93,12 +229,105 @@ async def geocode_address(address: str, client: httpx.AsyncClient, settings: Set
 
     return lat, lon
 
-async def geocode_best_effort(parts: List[str], client: httpx.AsyncClient, settings: Settings) -> Tuple[float, float]:
+
+async def _hedged_query(
+    address: str,
+    client: httpx.AsyncClient,
+    primary_url: str,
+    public_url: str,
+    settings: Settings,
+) -> List[Any]:
+    """Query the primary endpoint, hedging to the public one if it is slow. - helper
+
+    If the primary has not answered after the policy delay and the hedge budget
+    allows it, the same query is sent to the public endpoint and the first
+    non-empty answer wins; the other request is cancelled. If the primary
+    fails or returns nothing before a hedge was sent, the public endpoint is
+    queried as a regular fallback.
+
+    Returns the non-empty result list or raises ValueError.
+    """
+    policy = get_hedge_policy(settings)
+    policy.record_request()
+
+    started = time.monotonic()
+    primary = asyncio.ensure_future(_limited_query(address, client, primary_url, settings))
+    secondary = None
+    pending = {primary}
+    errors: List[str] = []
+
+    try:
+        done, _ = await asyncio.wait(pending, timeout=policy.delay())
+        if not done and policy.try_acquire():
+            secondary = asyncio.ensure_future(_limited_query(address, client, public_url, settings))
+            pending.add(secondary)
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    data = task.result()
+                except Exception as exc:
+                    errors.append(f"{'primary' if task is primary else 'fallback'} error {exc}")
+                    continue
+                if task is primary:
+                    # Only answers are latency samples: fast failures would pull
+                    # the hedge delay down, and cancelled calls have no latency
+                    policy.observe(time.monotonic() - started)
+                if data:
+                    return data
+
+            if not pending and secondary is None:
+                secondary = asyncio.ensure_future(_limited_query(address, client, public_url, settings))
+                pending.add(secondary)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if errors:
+        raise ValueError(f"Geocoding failed for address '{address}': {'; '.join(errors)}")
+    raise AddressNotFound(f"Address not found: {address}")
+
+
+# Background re-probe tasks, referenced so they are not garbage-collected mid-run
+_reprobes: Set["asyncio.Task[None]"] = set()
+
+
+async def _reprobe(cleaned: List[str], key: PartsKey, levels: List[int], settings: Settings) -> None:
+    """Retry skipped, more specific levels and remember the first that resolves. - reprobe"""
+    memory = get_specificity_memory(settings)
+    try:
+        async with http_client() as client:
+            for level in levels:
+                try:
+                    await geocode_address(", ".join(cleaned[level:]), client, settings)
+                except AddressNotFound:
+                    memory.record_failure(key, level)
+                    continue
+                memory.record_success(key, level)
+                return
+    except Exception:
+        # Best effort: a failed probe just leaves the memory as it was
+        pass
+
+
+async def geocode_best_effort(
+    parts: List[str],
+    client: httpx.AsyncClient,
+    settings: Settings,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[float, float]:
     """Best-effort geocoding by progressively dropping most specific parts. - geocode_best_effort
 
     Accepts parts ordered from most specific to most generic. Tries the full
     joined address first, then iteratively removes the first element until a
-    result is found or none remain.
+    result is found or none remain. Raises DeadlineExceeded if the deadline
+    passes before a candidate resolves.
+
+    With settings.geocode_memory_enabled, levels remembered as failing are
+    skipped and lookups start at the last level that resolved; the skipped
+    levels are re-probed in the background every
+    settings.geocode_memory_reprobe_seconds.
     """
     if not parts:
         raise ValueError("No address parts provided")
@@ -107,11 +336,27 @@ async def geocode_best_effort(parts: List[str], client: httpx.AsyncClient, setti
     if not cleaned:
         raise ValueError("No valid address parts provided")
 
-    for i in range(0, len(cleaned)):
+    memory = get_specificity_memory(settings) if settings.geocode_memory_enabled else None
+    key = normalize_parts(cleaned)
+    levels = memory.plan(key) if memory is not None else range(0, len(cleaned))
+
+    for i in levels:
         candidate = ", ".join(cleaned[i:])
         try:
-            return await geocode_address(candidate, client, settings)
-        except ValueError:
+            with span("geocode_attempt", level=i):
+                result = await run_with_deadline(geocode_address(candidate, client, settings), deadline)
+        except ValueError as exc:
+            # Only "no match" answers are remembered; upstream errors may be transient
+            if memory is not None and isinstance(exc, AddressNotFound):
+                memory.record_failure(key, i)
             continue
+        if memory is not None:
+            memory.record_success(key, i)
+            probe = memory.probe_levels(key, i)
+            if probe:
+                task = asyncio.ensure_future(_reprobe(cleaned, key, probe, settings))
+                _reprobes.add(task)
+                task.add_done_callback(_reprobes.discard)
+        return result
 
-    raise ValueError(f"Address not found from provided parts: {cleaned}")
+    raise AddressNotFound(f"Address not found from provided parts: {cleaned}")
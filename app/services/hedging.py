@@ -0,0 +1,84 @@
+from collections import deque
+from typing import Any, Deque
+
+from app.core.registry import Registry
+
+
+"""Hedged-request policy used by the geocoding service.
+
+A hedge is a duplicate request sent to a secondary endpoint when the primary
+has not answered within a delay derived from its recent latency distribution
+(e.g. the 95th percentile). A token budget bounds the fraction of requests
+that may be hedged so load on the secondary stays capped.
+- hedging
+"""
+
+
+class HedgePolicy:
+    """Track primary latencies and decide when (and whether) to hedge. - hedge_policy"""
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        min_delay: float = 0.05,
+        default_delay: float = 1.0,
+        max_fraction: float = 0.05,
+        window: int = 200,
+        min_samples: int = 20,
+        burst: float = 10.0,
+    ):
+        if not 0.0 < percentile <= 100.0:
+            raise ValueError(f"Hedge percentile must be in (0, 100]: {percentile}")
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.max_fraction = max(0.0, max_fraction)
+        self.min_samples = min_samples
+        self.burst = burst
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._tokens = 0.0
+
+    def observe(self, latency: float) -> None:
+        """Record how long the primary took to answer; failed or cancelled calls are not samples. - observe"""
+        self._samples.append(latency)
+
+    def delay(self) -> float:
+        """Return how long to wait for the primary before hedging. - delay"""
+        if len(self._samples) < self.min_samples:
+            return max(self.min_delay, self.default_delay)
+        ordered = sorted(self._samples)
+        idx = min(len(ordered) - 1, int(round(self.percentile / 100.0 * (len(ordered) - 1))))
+        return max(self.min_delay, ordered[idx])
+
+    def record_request(self) -> None:
+        """Credit the budget for one primary request. - record_request"""
+        self._tokens = min(self.burst, self._tokens + self.max_fraction)
+
+    def try_acquire(self) -> bool:
+        """Spend one hedge from the budget; return False when the budget is exhausted. - try_acquire"""
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+
+# Latency history lives as long as the hedging configuration is unchanged
+_POLICIES: Registry[HedgePolicy] = Registry(
+    (
+        "geocode_hedge_percentile",
+        "geocode_hedge_min_delay_seconds",
+        "geocode_hedge_default_delay_seconds",
+        "geocode_hedge_max_fraction",
+    ),
+    lambda settings: HedgePolicy(
+        percentile=settings.geocode_hedge_percentile,
+        min_delay=settings.geocode_hedge_min_delay_seconds,
+        default_delay=settings.geocode_hedge_default_delay_seconds,
+        max_fraction=settings.geocode_hedge_max_fraction,
+    ),
+)
+
+
+def get_hedge_policy(settings: Any) -> HedgePolicy:
+    """Return the shared geocoding hedge policy for the current settings. - get_hedge_policy"""
+    return _POLICIES.get(settings)
@@ -0,0 +1,318 @@
+import heapq
+import mmap
+import struct
+import sys
+import xml.etree.ElementTree as ET
+from array import array
+from math import cos, floor, radians, sqrt
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.core.registry import Registry
+
+
+"""Embedded offline routing over a preprocessed road graph.
+
+The graph is a compact binary file (built from a small OSM XML extract with
+build_graph_from_osm or scripts/build_road_graph.py) that is memory-mapped at
+load, so startup is cheap and pages are shared between worker processes.
+Queries snap coordinates to the nearest graph node and run a multi-target
+Dijkstra on travel time, stopping as soon as every target is settled.
+
+File layout (little-endian):
+- header: magic b"DFRG", version u32, node_count u32, edge_count u32
+- node_lat, node_lon: float64[node_count]
+- offsets: uint32[node_count + 1] (CSR row pointers into the edge arrays)
+- targets: uint32[edge_count]
+- distance_m, duration_s: float32[edge_count]
+- local_router
+"""
+
+MAGIC = b"DFRG"
+VERSION = 1
+_HEADER = struct.Struct("<4sIII")
+
+# Default speeds (km/h) per OSM highway type for graphs built from OSM XML
+DEFAULT_SPEEDS_KMH: Dict[str, float] = {
+    "motorway": 100.0,
+    "motorway_link": 60.0,
+    "trunk": 80.0,
+    "trunk_link": 50.0,
+    "primary": 60.0,
+    "primary_link": 40.0,
+    "secondary": 50.0,
+    "secondary_link": 40.0,
+    "tertiary": 40.0,
+    "tertiary_link": 30.0,
+    "unclassified": 30.0,
+    "residential": 30.0,
+    "living_street": 10.0,
+    "service": 15.0,
+}
+
+# Size (degrees) of the grid buckets used to find the nearest node
+_SNAP_CELL_DEG = 0.01
+
+_EARTH_RADIUS_KM = 6371.0
+
+
+def _local_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Equirectangular distance in km; accurate for the short spans used here (snapping, OSM segments). - local_km"""
+    x = radians(lon2 - lon1) * cos(radians((lat1 + lat2) / 2))
+    y = radians(lat2 - lat1)
+    return sqrt(x * x + y * y) * _EARTH_RADIUS_KM
+
+
+class RoadGraph:
+    """A memory-mapped road graph answering shortest-path queries. - road_graph"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n, m = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"Not a road graph file (or unsupported version): {path}")
+        self.node_count = n
+        self.edge_count = m
+
+        view = memoryview(self._mmap)
+        pos = _HEADER.size
+        self.node_lat, pos = _column(view, pos, "d", n)
+        self.node_lon, pos = _column(view, pos, "d", n)
+        self.offsets, pos = _column(view, pos, "I", n + 1)
+        self.targets, pos = _column(view, pos, "I", m)
+        self.distance_m, pos = _column(view, pos, "f", m)
+        self.duration_s, pos = _column(view, pos, "f", m)
+        self._grid: Optional[Dict[Tuple[int, int], List[int]]] = None
+
+    def close(self) -> None:
+        """Release the memory map and file handle. - close"""
+        for attr in ("node_lat", "node_lon", "offsets", "targets", "distance_m", "duration_s"):
+            col = getattr(self, attr, None)
+            if isinstance(col, memoryview):
+                col.release()
+        if getattr(self, "_mmap", None) is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+        self._file.close()
+
+    def _build_grid(self) -> Dict[Tuple[int, int], List[int]]:
+        """Bucket nodes on a lat/lon grid for nearest-node lookups (built lazily). - build_grid"""
+        grid: Dict[Tuple[int, int], List[int]] = {}
+        lats, lons = self.node_lat, self.node_lon
+        for i in range(self.node_count):
+            key = (floor(lats[i] / _SNAP_CELL_DEG), floor(lons[i] / _SNAP_CELL_DEG))
+            grid.setdefault(key, []).append(i)
+        return grid
+
+    def nearest_node(self, lat: float, lon: float, max_km: float) -> Optional[int]:
+        """Closest node within max_km of (lat, lon), or None. - nearest_node"""
+        if self._grid is None:
+            self._grid = self._build_grid()
+        ci, cj = floor(lat / _SNAP_CELL_DEG), floor(lon / _SNAP_CELL_DEG)
+        # One grid cell spans at least ~1.1 km * cos(lat); search enough rings to cover max_km
+        rings = max(1, int(max_km / (111.0 * _SNAP_CELL_DEG * max(0.1, cos(radians(lat))))) + 1)
+
+        best, best_km = None, max_km
+        for di in range(-rings, rings + 1):
+            for dj in range(-rings, rings + 1):
+                for node in self._grid.get((ci + di, cj + dj), ()):
+                    d = _local_km(lat, lon, self.node_lat[node], self.node_lon[node])
+                    if d <= best_km:
+                        best, best_km = node, d
+        return best
+
+    def one_to_many(
+        self,
+        lat: float,
+        lon: float,
+        destinations: Sequence[Tuple[float, float]],
+        max_snap_km: float = 1.0,
+    ) -> List[Optional[Dict[str, Any]]]:
+        """Fastest-route distance and duration from one origin to many destinations. - one_to_many
+
+        Returns one dict (distance_km, duration_seconds, method "local") per
+        destination, or None where a point cannot be snapped or is unreachable.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(destinations)
+        source = self.nearest_node(lat, lon, max_snap_km)
+        if source is None:
+            return results
+
+        wanted: Dict[int, List[int]] = {}
+        for i, (d_lat, d_lon) in enumerate(destinations):
+            node = self.nearest_node(d_lat, d_lon, max_snap_km)
+            if node is not None:
+                wanted.setdefault(node, []).append(i)
+        if not wanted:
+            return results
+
+        settled = self._dijkstra(source, set(wanted))
+        for node, indexes in wanted.items():
+            if node in settled:
+                duration, distance = settled[node]
+                for i in indexes:
+                    results[i] = {"distance_km": distance / 1000.0, "duration_seconds": duration, "method": "local"}
+        return results
+
+    def route(
+        self,
+        lat1: float,
+        lon1: float,
+        lat2: float,
+        lon2: float,
+        max_snap_km: float = 1.0,
+    ) -> Optional[Dict[str, Any]]:
+        """Single-pair convenience wrapper around one_to_many. - route"""
+        return self.one_to_many(lat1, lon1, [(lat2, lon2)], max_snap_km)[0]
+
+    def _dijkstra(self, source: int, targets: Iterable[int]) -> Dict[int, Tuple[float, float]]:
+        """Multi-target Dijkstra on duration; returns {target: (duration_s, distance_m)} for reached targets. - dijkstra"""
+        remaining = set(targets)
+        offsets, edge_to = self.offsets, self.targets
+        edge_dur, edge_dist = self.duration_s, self.distance_m
+
+        best: Dict[int, float] = {source: 0.0}
+        found: Dict[int, Tuple[float, float]] = {}
+        heap: List[Tuple[float, float, int]] = [(0.0, 0.0, source)]
+        done = set()
+        while heap and remaining:
+            duration, distance, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            if node in remaining:
+                remaining.discard(node)
+                found[node] = (duration, distance)
+            for e in range(offsets[node], offsets[node + 1]):
+                nxt = edge_to[e]
+                if nxt in done:
+                    continue
+                cand = duration + edge_dur[e]
+                if cand < best.get(nxt, float("inf")):
+                    best[nxt] = cand
+                    heapq.heappush(heap, (cand, distance + edge_dist[e], nxt))
+        return found
+
+
+def _column(view: memoryview, pos: int, fmt: str, count: int):
+    """Slice a typed column out of the mapped file; returns (column, next position). - column"""
+    size = struct.calcsize(fmt) * count
+    raw = view[pos : pos + size]
+    if sys.byteorder == "little":
+        col: Any = raw.cast(fmt)
+    else:
+        # Big-endian hosts pay for a byte-swapped copy
+        col = array(fmt)
+        col.frombytes(raw)
+        col.byteswap()
+    return col, pos + size
+
+
+def write_graph(
+    path: str,
+    lats: Sequence[float],
+    lons: Sequence[float],
+    edges: Iterable[Tuple[int, int, float, float]],
+) -> None:
+    """Write a graph file from node coordinates and (from, to, distance_m, duration_s) edges. - write_graph"""
+    n = len(lats)
+    adjacency: List[List[Tuple[int, float, float]]] = [[] for _ in range(n)]
+    for u, v, dist_m, dur_s in edges:
+        adjacency[u].append((v, dist_m, dur_s))
+
+    offsets = array("I", [0])
+    targets, distances, durations = array("I"), array("f"), array("f")
+    for out in adjacency:
+        for v, dist_m, dur_s in out:
+            targets.append(v)
+            distances.append(dist_m)
+            durations.append(dur_s)
+        offsets.append(len(targets))
+
+    columns = [array("d", lats), array("d", lons), offsets, targets, distances, durations]
+    if sys.byteorder != "little":
+        for col in columns:
+            col.byteswap()
+    with open(path, "wb") as fh:
+        fh.write(_HEADER.pack(MAGIC, VERSION, n, len(targets)))
+        for col in columns:
+            fh.write(col.tobytes())
+
+
+def _way_speed(tags: Dict[str, str], speeds: Dict[str, float]) -> Optional[float]:
+    """Speed (km/h) for a way, honouring a numeric maxspeed tag; None if not routable. - way_speed"""
+    speed = speeds.get(tags.get("highway", ""))
+    if speed is None:
+        return None
+    maxspeed = tags.get("maxspeed", "").split(" ")[0]
+    if maxspeed.isdigit():
+        speed = min(speed, float(maxspeed)) if speed else float(maxspeed)
+    return speed
+
+
+def build_graph_from_osm(osm_path: str, out_path: str, speeds: Optional[Dict[str, float]] = None) -> Tuple[int, int]:
+    """Build a graph file from an OSM XML extract (car profile); returns (nodes, edges). - build_graph_from_osm"""
+    speeds = speeds or DEFAULT_SPEEDS_KMH
+    coords: Dict[str, Tuple[float, float]] = {}
+    ways: List[Tuple[List[str], float, int]] = []
+
+    for _, elem in ET.iterparse(osm_path, events=("end",)):
+        if elem.tag == "node":
+            coords[elem.get("id")] = (float(elem.get("lat")), float(elem.get("lon")))
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in elem.findall("tag")}
+            speed = _way_speed(tags, speeds)
+            if speed:
+                oneway = tags.get("oneway", "")
+                implied_oneway = tags.get("highway") == "motorway" or tags.get("junction") == "roundabout"
+                if oneway in ("yes", "1", "true") or implied_oneway:
+                    direction = 1
+                elif oneway == "-1":
+                    direction = -1
+                else:
+                    direction = 0
+                ways.append(([nd.get("ref") for nd in elem.findall("nd")], speed, direction))
+            elem.clear()
+
+    index: Dict[str, int] = {}
+    lats: List[float] = []
+    lons: List[float] = []
+    edges: List[Tuple[int, int, float, float]] = []
+
+    def node_index(ref: str) -> int:
+        if ref not in index:
+            index[ref] = len(lats)
+            lat, lon = coords[ref]
+            lats.append(lat)
+            lons.append(lon)
+        return index[ref]
+
+    for refs, speed, direction in ways:
+        refs = [r for r in refs if r in coords]
+        for a, b in zip(refs, refs[1:]):
+            u, v = node_index(a), node_index(b)
+            dist_m = _local_km(lats[u], lons[u], lats[v], lons[v]) * 1000.0
+            dur_s = dist_m / (speed / 3.6)
+            if direction >= 0:
+                edges.append((u, v, dist_m, dur_s))
+            if direction <= 0:
+                edges.append((v, u, dist_m, dur_s))
+
+    write_graph(out_path, lats, lons, edges)
+    return len(lats), len(edges)
+
+
+# Graphs are kept by path so the mapping is opened once per process
+_GRAPHS: Registry[RoadGraph] = Registry(("local_graph_path",), lambda settings: RoadGraph(settings.local_graph_path))
+
+
+def get_local_router(settings: Any) -> Optional[RoadGraph]:
+    """Return the configured road graph, or None when local routing is disabled. - get_local_router"""
+    if not getattr(settings, "local_graph_path", ""):
+        return None
+    return _GRAPHS.get(settings)
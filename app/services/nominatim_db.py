@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+try:
+    # Optional, only needed with geocode_backend = "db"
+    import asyncpg  # type: ignore
+    ASYNCPG_AVAILABLE = True
+except Exception:
+    asyncpg = None
+    ASYNCPG_AVAILABLE = False
+
+from app.core.tracing import span
+from app.core.registry import Registry
+
+
+"""Direct geocoding against a local Nominatim Postgres database.
+
+Skips Nominatim's HTTP/PHP layer: addresses are matched against the placex
+table over a pooled asyncpg connection. asyncpg prepares each statement once
+per connection and reuses it from its statement cache, and a whole batch of
+addresses is resolved in one round trip by unnesting the inputs into a
+lateral lookup.
+
+Matching is deliberately simple: the first comma-separated term of an address
+must equal a place name (case-insensitive), and every later term must name
+one of the place's address parents (place_addressline). Among matches the
+most important place wins. Anything fancier (abbreviations, partial names,
+house numbers) is left to the HTTP backend, which callers fall back to when
+this one finds no match. Connecting is bounded by a short timeout, and
+after a failed connect the database is skipped (lookups raise immediately so
+callers go straight to HTTP) until a retry window has passed. Connection
+and server errors are logged; other exceptions propagate. An expression
+index makes lookups fast:
+    CREATE INDEX idx_placex_lower_name ON placex (lower(name->'name'));
+- nominatim_db
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseUnavailable(RuntimeError):
+    """Raised when the database cannot be used: asyncpg missing, or a failed connect is backing off. - database_unavailable"""
+
+
+# Errors meaning the database could not answer (connection loss, timeouts,
+# server-side errors); anything else is a bug and propagates
+if ASYNCPG_AVAILABLE:
+    DATABASE_ERRORS: Tuple[type, ...] = (
+        DatabaseUnavailable,
+        OSError,
+        asyncio.TimeoutError,
+        asyncpg.PostgresError,
+        asyncpg.InterfaceError,
+    )
+else:
+    DATABASE_ERRORS = (DatabaseUnavailable, OSError, asyncio.TimeoutError)
+
+
+# Joins the context terms of one address into a single text value for the
+# query (a unit separator cannot occur in a cleaned address term)
+CONTEXT_SEPARATOR = "\x1f"
+
+LOOKUP_SQL = """
+SELECT q.idx, m.lat, m.lon
+FROM unnest($1::text[], $2::text[]) WITH ORDINALITY AS q(name, context, idx)
+CROSS JOIN LATERAL (
+    SELECT ST_Y(p.centroid) AS lat, ST_X(p.centroid) AS lon
+    FROM placex p
+    WHERE lower(p.name->'name') = q.name
+      AND p.linked_place_id IS NULL
+      AND p.rank_search > 0
+      AND NOT EXISTS (
+        SELECT 1
+        FROM unnest(string_to_array(q.context, E'\\x1f')) AS c(term)
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM place_addressline a
+            JOIN placex ap ON ap.place_id = a.address_place_id
+            WHERE a.place_id = p.place_id AND lower(ap.name->'name') = c.term
+        )
+      )
+    ORDER BY p.importance DESC NULLS LAST
+    LIMIT 1
+) AS m
+"""
+
+
+def split_address(address: str) -> Tuple[str, Tuple[str, ...]]:
+    """Lower-cased name term and context terms of a comma-separated address. - split_address"""
+    terms = [" ".join(t.split()).lower() for t in address.split(",")]
+    terms = [t for t in terms if t]
+    if not terms:
+        return "", ()
+    return terms[0], tuple(terms[1:])
+
+
+class NominatimDB:
+    """Pooled connection to the Nominatim database. - nominatim_db"""
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 1,
+        max_size: int = 10,
+        connect_timeout: float = 2.0,
+        retry_seconds: float = 30.0,
+        pool_factory: Optional[Callable[..., Any]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.dsn = dsn
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size)
+        self.connect_timeout = connect_timeout
+        self.retry_seconds = retry_seconds
+        self._pool_factory = pool_factory
+        self._clock = clock
+        self._pool: Any = None
+        # No connection attempts before this time (set after a failed connect)
+        self._retry_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def pool(self) -> Any:
+        """Create the pool on first use; raises DatabaseUnavailable at once while a failed connect is backing off. - pool"""
+        if self._pool is not None:
+            return self._pool
+        if self._clock() < self._retry_at:
+            raise DatabaseUnavailable("Nominatim database unavailable, retrying later")
+        async with self._lock:
+            if self._pool is not None:
+                return self._pool
+            # Waiters behind a failed attempt must not retry it
+            if self._clock() < self._retry_at:
+                raise DatabaseUnavailable("Nominatim database unavailable, retrying later")
+            factory = self._pool_factory
+            if factory is None:
+                if asyncpg is None:
+                    raise DatabaseUnavailable("asyncpg is required for geocode_backend=db")
+                factory = asyncpg.create_pool
+            try:
+                self._pool = await factory(
+                    self.dsn,
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    timeout=self.connect_timeout,
+                )
+            except Exception as exc:
+                self._retry_at = self._clock() + self.retry_seconds
+                logger.warning(
+                    "Could not connect to the Nominatim database, using HTTP for %.0fs: %s", self.retry_seconds, exc
+                )
+                raise DatabaseUnavailable(f"Could not connect to the Nominatim database: {exc}") from exc
+        return self._pool
+
+    async def lookup_many(self, addresses: Sequence[str]) -> List[Optional[Tuple[float, float]]]:
+        """Resolve addresses in one query; None where nothing matched. - lookup_many"""
+        results: List[Optional[Tuple[float, float]]] = [None] * len(addresses)
+        names: List[str] = []
+        contexts: List[str] = []
+        positions: List[int] = []
+        for i, address in enumerate(addresses):
+            name, context = split_address(address)
+            if name:
+                names.append(name)
+                contexts.append(CONTEXT_SEPARATOR.join(context))
+                positions.append(i)
+        if not names:
+            return results
+
+        pool = await self.pool()
+        with span("nominatim_db", rows=len(names)):
+            async with pool.acquire() as conn:
+                rows = await conn.fetch(LOOKUP_SQL, names, contexts)
+        for idx, lat, lon in rows:
+            # WITH ORDINALITY counts from 1
+            results[positions[idx - 1]] = (float(lat), float(lon))
+        return results
+
+    async def close(self) -> None:
+        """Close the pool if it was opened. - close"""
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await pool.close()
+
+
+# One connection pool per database configuration
+_DATABASES: Registry[NominatimDB] = Registry(
+    (
+        "database_url",
+        "geocode_db_pool_min_size",
+        "geocode_db_pool_max_size",
+        "geocode_db_connect_timeout_seconds",
+        "geocode_db_retry_seconds",
+    ),
+    lambda settings: NominatimDB(
+        settings.database_url,
+        min_size=settings.geocode_db_pool_min_size,
+        max_size=settings.geocode_db_pool_max_size,
+        connect_timeout=settings.geocode_db_connect_timeout_seconds,
+        retry_seconds=settings.geocode_db_retry_seconds,
+    ),
+)
+
+
+def get_nominatim_db(settings: Any) -> NominatimDB:
+    """Return the shared database backend for the current settings. - get_nominatim_db"""
+    return _DATABASES.get(settings)
+
+
+async def close_nominatim_dbs() -> None:
+    """Close every open pool (called on shutdown). - close_nominatim_dbs"""
+    for db in _DATABASES.values():
+        await db.close()
@@ -0,0 +1,191 @@
+import random
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.core.registry import Registry
+
+
+"""OSRM backend pool with region-aware, health-aware selection.
+
+Settings.osrm_backends lists one or more OSRM instances. Each entry is either a
+plain URL string or an object with keys:
+- url: base URL of the OSRM service (required)
+- region: optional label, only used for logging/inspection
+- bbox: optional [min_lon, min_lat, max_lon, max_lat]; when present the backend
+  is only used for pairs whose both coordinates fall inside the box
+
+Selection picks among the healthy backends covering both coordinates using
+either least-outstanding-requests or latency-weighted random choice. Health is
+tracked passively: consecutive failures (errors or responses slower than the
+configured threshold) eject a backend for a cooldown period, after which it is
+tried again.
+- osrm_pool
+"""
+
+
+class OsrmBackend:
+    """A single OSRM instance and its passive health state. - osrm_backend"""
+
+    def __init__(self, url: str, region: Optional[str] = None, bbox: Optional[Sequence[float]] = None):
+        self.url = url.rstrip("/")
+        self.region = region
+        self.bbox: Optional[Tuple[float, float, float, float]] = None
+        if bbox is not None:
+            if len(bbox) != 4:
+                raise ValueError(f"OSRM backend bbox must be [min_lon, min_lat, max_lon, max_lat]: {bbox}")
+            self.bbox = tuple(float(v) for v in bbox)  # type: ignore[assignment]
+
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def covers(self, lat: float, lon: float) -> bool:
+        """Return True when the point lies within this backend's bbox (or no bbox is set). - covers"""
+        if self.bbox is None:
+            return True
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        return min_lon <= lon <= max_lon and min_lat <= lat <= max_lat
+
+    def is_healthy(self, now: float) -> bool:
+        """Return True when the backend is not currently ejected. - is_healthy"""
+        return now >= self.ejected_until
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a JSON-serializable view of the backend state. - snapshot"""
+        return {
+            "url": self.url,
+            "region": self.region,
+            "bbox": list(self.bbox) if self.bbox else None,
+            "outstanding": self.outstanding,
+            "ewma_latency": self.ewma_latency,
+            "consecutive_failures": self.consecutive_failures,
+            "ejected": not self.is_healthy(time.monotonic()),
+        }
+
+
+class OsrmPool:
+    """Pool of OSRM backends with passive health checks. - osrm_pool"""
+
+    # Weight given to the newest latency sample in the moving average
+    EWMA_ALPHA = 0.3
+
+    def __init__(
+        self,
+        backends: List[OsrmBackend],
+        strategy: str = "least_outstanding",
+        eject_failures: int = 3,
+        eject_seconds: float = 30.0,
+        slow_threshold_seconds: float = 5.0,
+    ):
+        if strategy not in ("least_outstanding", "latency"):
+            raise ValueError(f"Unknown OSRM balancing strategy: {strategy}")
+        self.backends = backends
+        self.strategy = strategy
+        self.eject_failures = max(1, eject_failures)
+        self.eject_seconds = eject_seconds
+        self.slow_threshold_seconds = slow_threshold_seconds
+
+    def candidates(self, lat1: float, lon1: float, lat2: float, lon2: float) -> List[OsrmBackend]:
+        """Return backends whose coverage includes both coordinates. - candidates"""
+        return [b for b in self.backends if b.covers(lat1, lon1) and b.covers(lat2, lon2)]
+
+    def select(self, lat1: float, lon1: float, lat2: float, lon2: float) -> Optional[OsrmBackend]:
+        """Pick a healthy backend covering both coordinates, or None. - select
+
+        Also None when covering backends exist but all are ejected, so the
+        request goes to the public server if use_osrm_online allows it.
+        """
+        covering = self.candidates(lat1, lon1, lat2, lon2)
+        if not covering:
+            return None
+
+        now = time.monotonic()
+        healthy = [b for b in covering if b.is_healthy(now)]
+        if not healthy:
+            return None
+
+        if self.strategy == "latency":
+            return self._pick_by_latency(healthy)
+        return min(healthy, key=lambda b: (b.outstanding, b.ewma_latency or 0.0))
+
+    def _pick_by_latency(self, backends: List[OsrmBackend]) -> OsrmBackend:
+        """Weighted random choice favouring backends with lower observed latency. - pick_by_latency"""
+        known = [b.ewma_latency for b in backends if b.ewma_latency is not None]
+        # Backends without samples yet get the average weight so they are still probed
+        default = sum(known) / len(known) if known else 1.0
+        weights = [1.0 / max(b.ewma_latency if b.ewma_latency is not None else default, 1e-3) for b in backends]
+        return random.choices(backends, weights=weights, k=1)[0]
+
+    def record_success(self, backend: OsrmBackend, latency: float) -> None:
+        """Record a completed request; slow responses count as failures. - record_success"""
+        if backend.ewma_latency is None:
+            backend.ewma_latency = latency
+        else:
+            backend.ewma_latency = self.EWMA_ALPHA * latency + (1 - self.EWMA_ALPHA) * backend.ewma_latency
+
+        if latency > self.slow_threshold_seconds:
+            self._register_failure(backend)
+        else:
+            backend.consecutive_failures = 0
+
+    def record_failure(self, backend: OsrmBackend) -> None:
+        """Record a failed request and eject the backend if it keeps failing. - record_failure"""
+        self._register_failure(backend)
+
+    def _register_failure(self, backend: OsrmBackend) -> None:
+        """Bump the failure counter and eject once the threshold is reached. - register_failure"""
+        backend.consecutive_failures += 1
+        # The counter is not reset on ejection: a recovered backend that fails
+        # again right away is ejected on the next failure.
+        if backend.consecutive_failures >= self.eject_failures:
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Return the state of every backend. - snapshot"""
+        return [b.snapshot() for b in self.backends]
+
+
+def parse_backends(specs: Sequence[Any]) -> List[OsrmBackend]:
+    """Build OsrmBackend objects from Settings.osrm_backends entries. - parse_backends"""
+    backends: List[OsrmBackend] = []
+    for spec in specs:
+        if isinstance(spec, str):
+            if spec.strip():
+                backends.append(OsrmBackend(spec.strip()))
+            continue
+        if not isinstance(spec, dict) or not spec.get("url"):
+            raise ValueError(f"Invalid OSRM backend entry: {spec}")
+        backends.append(OsrmBackend(spec["url"], region=spec.get("region"), bbox=spec.get("bbox")))
+    return backends
+
+
+def _build_pool(settings: Any) -> OsrmPool:
+    """Build the pool for the configured backends. - build_pool"""
+    return OsrmPool(
+        parse_backends(settings.osrm_backends),
+        strategy=getattr(settings, "osrm_balance_strategy", "least_outstanding"),
+        eject_failures=getattr(settings, "osrm_eject_failures", 3),
+        eject_seconds=getattr(settings, "osrm_eject_seconds", 30.0),
+        slow_threshold_seconds=getattr(settings, "osrm_slow_threshold_seconds", 5.0),
+    )
+
+
+# Health state lives as long as the backend configuration is unchanged
+_POOLS: Registry[OsrmPool] = Registry(
+    (
+        "osrm_backends",
+        "osrm_balance_strategy",
+        "osrm_eject_failures",
+        "osrm_eject_seconds",
+        "osrm_slow_threshold_seconds",
+    ),
+    _build_pool,
+)
+
+
+def get_osrm_pool(settings: Any) -> Optional[OsrmPool]:
+    """Return the shared pool for the configured backends, or None when none are configured. - get_osrm_pool"""
+    if not getattr(settings, "osrm_backends", None):
+        return None
+    return _POOLS.get(settings)
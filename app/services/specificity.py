@@ -0,0 +1,140 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.core.registry import Registry
+
+
+"""Learned specificity memory for best-effort geocoding.
+
+geocode_best_effort drops the most specific address parts one at a time until
+Nominatim resolves the remainder. For part combinations Nominatim never
+resolves (an unknown street in a known neighborhood, say) every request pays
+the same failed lookups. The memory records, per normalized parts list, the
+level (number of leading parts dropped) that last succeeded and the levels
+that failed, each with an expiry, so later lookups start at the known-good
+level. Levels skipped that way are re-probed occasionally in the background,
+and a more specific level that starts resolving replaces the remembered one.
+- specificity
+"""
+
+PartsKey = Tuple[str, ...]
+
+
+def normalize_parts(parts: Sequence[str]) -> PartsKey:
+    """Case- and whitespace-insensitive key for a cleaned parts list. - normalize_parts"""
+    return tuple(" ".join(p.split()).casefold() for p in parts)
+
+
+class _Entry:
+    """What is known about one parts list. - entry"""
+
+    __slots__ = ("good_level", "good_until", "failed_until", "next_probe")
+
+    def __init__(self):
+        self.good_level: Optional[int] = None
+        self.good_until = 0.0
+        # level -> time until which the level is assumed to fail
+        self.failed_until: Dict[int, float] = {}
+        self.next_probe = 0.0
+
+
+class SpecificityMemory:
+    """LRU-bounded map from normalized parts to known-good and failed levels. - specificity_memory"""
+
+    def __init__(
+        self,
+        success_ttl: float = 86400.0,
+        failure_ttl: float = 3600.0,
+        max_entries: int = 10000,
+        reprobe_interval: float = 600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.success_ttl = success_ttl
+        self.failure_ttl = failure_ttl
+        self.max_entries = max(1, max_entries)
+        self.reprobe_interval = reprobe_interval
+        self._clock = clock
+        self._entries: "OrderedDict[PartsKey, _Entry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get(self, key: PartsKey, create: bool = False) -> Optional[_Entry]:
+        """Look up (optionally creating) an entry and mark it recently used. - get"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        elif create:
+            entry = _Entry()
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def plan(self, key: PartsKey) -> List[int]:
+        """Levels to try, most specific first, skipping levels known to fail. - plan
+
+        With an unexpired known-good level the plan starts there.
+        """
+        now = self._clock()
+        entry = self._get(key)
+        if entry is None:
+            return list(range(len(key)))
+        start = entry.good_level if entry.good_level is not None and entry.good_until > now else 0
+        return [lvl for lvl in range(start, len(key)) if entry.failed_until.get(lvl, 0.0) <= now]
+
+    def record_success(self, key: PartsKey, level: int) -> None:
+        """Remember level as the most specific one that resolves. - record_success"""
+        entry = self._get(key, create=True)
+        now = self._clock()
+        entry.good_level = level
+        entry.good_until = now + self.success_ttl
+        entry.failed_until.pop(level, None)
+        if not entry.next_probe:
+            # The more specific levels were just tried; wait before re-probing them
+            entry.next_probe = now + self.reprobe_interval
+
+    def record_failure(self, key: PartsKey, level: int) -> None:
+        """Remember that level did not resolve. - record_failure"""
+        entry = self._get(key, create=True)
+        entry.failed_until[level] = self._clock() + self.failure_ttl
+        if entry.good_level == level:
+            entry.good_level = None
+
+    def probe_levels(self, key: PartsKey, resolved_level: int) -> List[int]:
+        """More specific levels worth re-probing in the background, or [] if not due yet. - probe_levels
+
+        Claims the probe slot for the key, so concurrent callers do not start
+        duplicate probes.
+        """
+        if resolved_level <= 0:
+            return []
+        entry = self._get(key, create=True)
+        now = self._clock()
+        if entry.next_probe > now:
+            return []
+        entry.next_probe = now + self.reprobe_interval
+        return list(range(resolved_level))
+
+
+# What was learned survives as long as the memory configuration is unchanged
+_MEMORIES: Registry[SpecificityMemory] = Registry(
+    (
+        "geocode_memory_success_ttl_seconds",
+        "geocode_memory_failure_ttl_seconds",
+        "geocode_memory_max_entries",
+        "geocode_memory_reprobe_seconds",
+    ),
+    lambda settings: SpecificityMemory(
+        success_ttl=settings.geocode_memory_success_ttl_seconds,
+        failure_ttl=settings.geocode_memory_failure_ttl_seconds,
+        max_entries=settings.geocode_memory_max_entries,
+        reprobe_interval=settings.geocode_memory_reprobe_seconds,
+    ),
+)
+
+
+def get_specificity_memory(settings: Any) -> SpecificityMemory:
+    """Return the shared specificity memory for the current settings. - get_specificity_memory"""
+    return _MEMORIES.get(settings)
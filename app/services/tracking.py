@@ -0,0 +1,182 @@
+import heapq
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.services.distance import haversine_distance
+
+
+"""Incremental distance recomputation for live origin tracking.
+
+A TrackingSession holds the resolved destinations of one live-tracking
+connection and the rows last pushed to the client. On each origin update it:
+- ignores moves smaller than min_move_m (no distance can change by more than
+  the move itself for straight-line tiers, and only marginally for routes)
+- with a limit k, evaluates destinations in order of their straight-line
+  lower bound and stops once the next bound exceeds the k-th best distance,
+  so destinations that cannot enter the top k are never routed
+- without a limit and with a straight-line method, reuses a destination's
+  last computed distance while the origin has moved at most REUSE_MAX_DRIFT
+  of it since it was computed and the distance, widened by that move, cannot
+  swap places with any other destination (a straight-line distance changes by
+  at most the move); routed and estimated distances can jump by more than the
+  move, so those sessions recompute every destination
+- keeps the previous origin if an evaluation fails, so the next update is
+  compared against what the client last received
+- returns only rows whose rank or distance changed, plus the ids of rows that
+  dropped out of the ranked set
+- tracking
+"""
+
+# Straight-line (haversine) distance times this factor is a lower bound for
+# both geodesic and road distances (haversine deviates from the ellipsoid by
+# well under 1%).
+LOWER_BOUND_FACTOR = 0.99
+
+# Without a limit, a distance is reused while the origin has moved at most
+# this fraction of it since it was computed (and its rank cannot change), so
+# reused rows are off by at most 1%.
+REUSE_MAX_DRIFT = 0.01
+
+# (origin_lat, origin_lon, lat, lon) -> dict with distance_km, duration_seconds, method
+DistanceFn = Callable[[float, float, float, float], Awaitable[Dict[str, Any]]]
+
+
+class TrackingSession:
+    """Destinations and last pushed rows of one live-tracking connection. - tracking_session"""
+
+    def __init__(
+        self,
+        destinations: List[Tuple[str, float, float]],
+        limit: Optional[int] = None,
+        min_move_m: float = 10.0,
+        straight_line: bool = False,
+    ):
+        self.destinations = destinations
+        self.limit = limit
+        self.min_move_m = max(0.0, min_move_m)
+        # Distances come from a straight-line method, so unlimited sessions may reuse them
+        self.straight_line = straight_line
+        self.origin: Optional[Tuple[float, float]] = None
+        # id -> last row pushed to the client
+        self.pushed: Dict[int, Dict[str, Any]] = {}
+        # id -> (distance_km, info, origin lat, origin lon) of the last evaluation (no-limit sessions)
+        self._evaluated: Dict[int, Tuple[float, Dict[str, Any], float, float]] = {}
+
+    async def update(self, lat: float, lon: float, distance_fn: DistanceFn) -> Tuple[List[Dict[str, Any]], List[int]]:
+        """Recompute for a new origin and return (changed rows, removed ids). - update"""
+        if self.origin is not None:
+            moved_m = haversine_distance(self.origin[0], self.origin[1], lat, lon) * 1000.0
+            if moved_m < self.min_move_m:
+                return [], []
+
+        if self.limit is not None:
+            computed = await self._evaluate_top(lat, lon, distance_fn, self.limit)
+        elif self.straight_line:
+            computed = await self._evaluate_all(lat, lon, distance_fn)
+        else:
+            await self._evaluate(list(range(len(self.destinations))), lat, lon, distance_fn)
+            computed = [(self._evaluated[idx][0], idx, self._evaluated[idx][1]) for idx in range(len(self.destinations))]
+        # Only move the origin once the evaluation went through
+        self.origin = (lat, lon)
+        computed.sort(key=lambda c: c[0])
+
+        tolerance_km = self.min_move_m / 1000.0
+        current: Dict[int, Dict[str, Any]] = {}
+        changed: List[Dict[str, Any]] = []
+        for rank, (dist_km, idx, info) in enumerate(computed):
+            name, d_lat, d_lon = self.destinations[idx]
+            row = {
+                "id": idx,
+                "rank": rank,
+                "name": name,
+                "lat": d_lat,
+                "lon": d_lon,
+                "distance_km": dist_km,
+                "duration_seconds": info.get("duration_seconds"),
+                "distance_method": info.get("method"),
+            }
+            current[idx] = row
+            prev = self.pushed.get(idx)
+            if (
+                prev is None
+                or prev["rank"] != rank
+                or prev["distance_method"] != row["distance_method"]
+                or abs(prev["distance_km"] - dist_km) > tolerance_km
+            ):
+                changed.append(row)
+            else:
+                # Keep the last pushed values so small drifts accumulate
+                # against what the client actually has
+                current[idx] = prev
+
+        removed = sorted(idx for idx in self.pushed if idx not in current)
+        self.pushed = current
+        return changed, removed
+
+    async def _evaluate_top(
+        self, lat: float, lon: float, distance_fn: DistanceFn, limit: int
+    ) -> List[Tuple[float, int, Dict[str, Any]]]:
+        """The limit nearest destinations, skipping those whose lower bound cannot rank. - evaluate_top"""
+        bounds = sorted(
+            (haversine_distance(lat, lon, d_lat, d_lon) * LOWER_BOUND_FACTOR, idx)
+            for idx, (_, d_lat, d_lon) in enumerate(self.destinations)
+        )
+
+        computed: List[Tuple[float, int, Dict[str, Any]]] = []
+        # Max-heap (negated) of the k smallest distances computed so far
+        best: List[float] = []
+        for bound, idx in bounds:
+            if len(best) >= limit and bound > -best[0]:
+                # Every remaining destination is at least this far away
+                break
+            _, d_lat, d_lon = self.destinations[idx]
+            info = await distance_fn(lat, lon, d_lat, d_lon)
+            dist_km = info.get("distance_km") or 0.0
+            computed.append((dist_km, idx, info))
+            if len(best) < limit:
+                heapq.heappush(best, -dist_km)
+            elif dist_km < -best[0]:
+                heapq.heapreplace(best, -dist_km)
+
+        computed.sort(key=lambda c: c[0])
+        return computed[:limit]
+
+    async def _evaluate_all(self, lat: float, lon: float, distance_fn: DistanceFn) -> List[Tuple[float, int, Dict[str, Any]]]:
+        """Every destination, reusing earlier distances that cannot change rank. - evaluate_all"""
+        evaluated = self._evaluated
+        # (low, high, idx): where a reusable distance can be now
+        candidates: List[Tuple[float, float, int]] = []
+        stale: List[int] = []
+        for idx in range(len(self.destinations)):
+            prev = evaluated.get(idx)
+            if prev is None:
+                stale.append(idx)
+                continue
+            drift_km = haversine_distance(prev[2], prev[3], lat, lon)
+            if drift_km > prev[0] * REUSE_MAX_DRIFT:
+                stale.append(idx)
+            else:
+                candidates.append((prev[0] - drift_km, prev[0] + drift_km, idx))
+
+        await self._evaluate(stale, lat, lon, distance_fn)
+
+        # A candidate keeps its rank if its interval overlaps no other interval
+        # and contains no freshly computed distance
+        intervals = sorted(candidates + [(evaluated[idx][0], evaluated[idx][0], idx) for idx in stale])
+        fresh = set(stale)
+        recompute: List[int] = []
+        max_high = float("-inf")
+        for i, (low, high, idx) in enumerate(intervals):
+            next_low = intervals[i + 1][0] if i + 1 < len(intervals) else float("inf")
+            if idx not in fresh and not (low > max_high and high < next_low):
+                recompute.append(idx)
+            max_high = max(max_high, high)
+        await self._evaluate(recompute, lat, lon, distance_fn)
+
+        return [(evaluated[idx][0], idx, evaluated[idx][1]) for idx in range(len(self.destinations))]
+
+    async def _evaluate(self, indexes: List[int], lat: float, lon: float, distance_fn: DistanceFn) -> None:
+        """Compute and remember the distances of the given destinations. - evaluate"""
+        for idx in indexes:
+            _, d_lat, d_lon = self.destinations[idx]
+            info = await distance_fn(lat, lon, d_lat, d_lon)
+            self._evaluated[idx] = (info.get("distance_km") or 0.0, info, lat, lon)
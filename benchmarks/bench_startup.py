@@ -0,0 +1,77 @@
+"""Cold-start benchmark: import time of app.main and first-request latency.
+
+Each sample runs in a fresh interpreter so module caches are cold. The
+first-request measurement drives the ASGI app in-process (no network) with a
+coordinates-only geodesic request, which exercises settings loading, request
+validation and the lazily imported geodesic backend. With --warm the
+startup warm-up (app.core.warmup.warm_up) runs first against a stub upstream
+transport, showing what the first request costs once /ready reports ready.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs N] [--warm]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+_CHILD = r"""
+import asyncio, json, sys, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+
+import httpx
+
+async def main():
+    if "--warm" in sys.argv:
+        from app.core.config import get_settings
+        from app.core.warmup import warm_up
+        stub = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+        async with stub:
+            await warm_up(stub, get_settings())
+    payload = {
+        "origin": {"lat": -23.55052, "lon": -46.633308},
+        "destinations": [{"name": "Campinas", "lat": -22.9099, "lon": -47.0626}],
+        "method": "geodesic",
+    }
+    async with httpx.AsyncClient(app=app.main.app, base_url="http://bench") as ac:
+        s = time.perf_counter()
+        r = await ac.post("/api/distance", json=payload)
+        first = time.perf_counter() - s
+        assert r.status_code == 200, r.text
+        s = time.perf_counter()
+        await ac.post("/api/distance", json=payload)
+        second = time.perf_counter() - s
+    return first, second
+
+first, second = asyncio.run(main())
+print(json.dumps({"import": t1 - t0, "first": first, "second": second}))
+"""
+
+
+def _sample(warm: bool) -> dict:
+    cmd = [sys.executable, "-c", _CHILD] + (["--warm"] if warm else [])
+    out = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreters to sample")
+    parser.add_argument("--warm", action="store_true", help="run the startup warm-up before the first request")
+    args = parser.parse_args()
+
+    samples = [_sample(args.warm) for _ in range(args.runs)]
+    for key, label in (("import", "import app.main"), ("first", "first request"), ("second", "second request")):
+        values = [s[key] * 1000.0 for s in samples]
+        print(f"{label:<16} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
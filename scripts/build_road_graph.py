@@ -0,0 +1,40 @@
+"""Build a road graph file for the embedded local router from an OSM XML extract.
+
+Routable ways (highway=* with a known car speed) become directed edges
+weighted by length and travel time; oneway tags are honoured. The output is
+the memory-mapped format read by app.services.local_router.RoadGraph; point
+LOCAL_GRAPH_PATH at it.
+
+Convert PBF extracts to XML first, e.g. with osmium:
+    osmium cat region.osm.pbf -o region.osm
+
+Usage:
+    python scripts/build_road_graph.py region.osm region.graph
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from app.services.local_router import build_graph_from_osm  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("osm", help="input OSM XML file")
+    parser.add_argument("output", help="road graph file to write")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    nodes, edges = build_graph_from_osm(args.osm, args.output)
+    elapsed = time.perf_counter() - t0
+    size_kb = Path(args.output).stat().st_size / 1024.0
+    print(f"{args.output}: {nodes} nodes, {edges} edges, {size_kb:.1f} KiB in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import pytest
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.core.registry import clear_registries
+
+
+"""Shared fixtures for the test suite."""
+
+
+@pytest.fixture(autouse=True)
+def clear_shared_objects():
+    """Start and end every test without cached pools, limiters, caches or learned state. - clear_shared_objects"""
+    clear_registries()
+    yield
+    clear_registries()
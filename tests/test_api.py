@@ -134,3 +134,219 @@ async def test_missing_destination_fields_returns_422():
         }
         r = await ac.post("/api/distance", json=payload)
         assert r.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_distance_exhausted_budget_degrades(sample_destinations):
+    """A zero time budget skips routing and marks straight-line rows as degraded. - test_distance_exhausted_budget_degrades"""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        payload = {
+            "origin": {"lat": -23.55052, "lon": -46.633308},
+            "destinations": sample_destinations,
+        }
+        r = await ac.post("/api/distance", json=payload, headers={"X-Time-Budget-Ms": "0"})
+        assert r.status_code == 200
+        data = r.json()
+        assert len(data) == len(sample_destinations)
+        assert all(item["distance_method"].endswith("-degraded") for item in data)
+        assert r.headers["X-Distance-Degraded"] == str(len(sample_destinations))
+
+
+@pytest.mark.asyncio
+async def test_distance_budget_omits_slow_destinations(monkeypatch, sample_destinations):
+    """Destinations that cannot be geocoded within the budget are omitted and counted. - test_distance_budget_omits_slow_destinations"""
+    import asyncio
+    import app.api.routes as routes_module
+
+    async def slow_geocode(address: str, client: httpx.AsyncClient, settings):
+        await asyncio.sleep(5)
+        return 0.0, 0.0
+
+    monkeypatch.setattr(routes_module, "geocode_address", slow_geocode)
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        payload = {
+            "origin": {"lat": -23.55052, "lon": -46.633308},
+            "destinations": sample_destinations + [{"name": "Slow", "address": "Somewhere slow"}],
+            "time_budget_ms": 50,
+        }
+        r = await ac.post("/api/distance", json=payload)
+        assert r.status_code == 200
+        names = [item["name"] for item in r.json()]
+        assert "Slow" not in names
+        assert r.headers["X-Distance-Incomplete"] == "1"
+
+
+@pytest.mark.asyncio
+async def test_distance_fast_method_skips_network(monkeypatch, sample_destinations):
+    """method=fast with coordinates never creates an HTTP client and returns haversine rows. - test_distance_fast_method_skips_network"""
+    import app.api.routes as routes_module
+
+    class NoClient:
+        def __init__(self, *args, **kwargs):
+            raise AssertionError("no HTTP client expected for method=fast")
+
+    monkeypatch.setattr(routes_module.httpx, "AsyncClient", NoClient)
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        payload = {
+            "origin": {"lat": -23.55052, "lon": -46.633308},
+            "destinations": sample_destinations,
+            "method": "fast",
+        }
+        r = await ac.post("/api/distance", json=payload)
+        assert r.status_code == 200
+        data = r.json()
+        distances = [item["distance_km"] for item in data]
+        assert distances == sorted(distances)
+        assert all(item["distance_method"] == "haversine" for item in data)
+
+
+@pytest.mark.asyncio
+async def test_distance_invalid_method_returns_422(sample_destinations):
+    """Unknown accuracy tiers are rejected by validation. - test_distance_invalid_method_returns_422"""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        payload = {
+            "origin": {"lat": -23.55052, "lon": -46.633308},
+            "destinations": sample_destinations,
+            "method": "teleport",
+        }
+        r = await ac.post("/api/distance", json=payload)
+        assert r.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_ready_reports_after_warm_up(monkeypatch, settings):
+    """/ready returns 503 until warm-up has probed the upstreams, then 200. - test_ready_reports_after_warm_up"""
+    from app.core import warmup
+
+    monkeypatch.setattr(warmup.readiness, "ready", False)
+    probed = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        probed.append(str(request.url))
+        return httpx.Response(200)
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.get("/ready")
+        assert r.status_code == 503
+
+        settings.nominatim_url = "http://nominatim:8080"
+        settings.use_osrm_online = False
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as upstream:
+            await warmup.warm_up(upstream, settings)
+
+        r = await ac.get("/ready")
+        assert r.status_code == 200
+
+    assert "http://nominatim:8080/status" in probed
+    assert settings.osrm_service_url.rstrip("/") + "/" in probed
+
+
+def test_get_settings_returns_independent_copies():
+    """Settings are loaded once but each caller gets its own copy. - test_get_settings_returns_independent_copies"""
+    first = get_settings()
+    first.nominatim_url = "https://changed.example"
+    assert get_settings().nominatim_url != "https://changed.example"
+
+
+def test_live_tracking_pushes_only_changes(sample_destinations):
+    """The live endpoint pushes the ranked rows, skips tiny moves and reports rank changes. - test_live_tracking_pushes_only_changes"""
+    from fastapi.testclient import TestClient
+
+    tc = TestClient(app)
+    with tc.websocket_connect("/api/distance/live") as ws:
+        ws.send_json({"type": "destinations", "destinations": sample_destinations, "method": "fast", "limit": 2})
+        assert ws.receive_json() == {"type": "ready", "count": 3}
+
+        # São Paulo: nearest are Santos and Campinas
+        ws.send_json({"type": "origin", "lat": -23.55052, "lon": -46.633308})
+        update = ws.receive_json()
+        assert update["type"] == "update"
+        assert [row["name"] for row in update["rows"]] == ["Santos", "Campinas"]
+        assert update["removed"] == []
+
+        # A 1 m move is ignored; the next message answers the move to Rio
+        ws.send_json({"type": "origin", "lat": -23.55051, "lon": -46.633308})
+        ws.send_json({"type": "origin", "lat": -22.95, "lon": -43.2})
+        update = ws.receive_json()
+        names = {row["name"]: row["rank"] for row in update["rows"]}
+        assert names["Rio"] == 0
+        assert names["Santos"] == 1
+        assert update["removed"] == [1]  # Campinas dropped out of the top 2
+
+
+def test_live_tracking_requires_destinations_first():
+    """An origin update before destinations yields an error message. - test_live_tracking_requires_destinations_first"""
+    from fastapi.testclient import TestClient
+
+    tc = TestClient(app)
+    with tc.websocket_connect("/api/distance/live") as ws:
+        ws.send_json({"type": "origin", "lat": 0.0, "lon": 0.0})
+        assert ws.receive_json()["type"] == "error"
+
+
+def test_live_tracking_survives_malformed_frames(sample_destinations):
+    """Non-JSON and binary frames yield error messages and the socket stays usable. - test_live_tracking_survives_malformed_frames"""
+    from fastapi.testclient import TestClient
+
+    tc = TestClient(app)
+    with tc.websocket_connect("/api/distance/live") as ws:
+        ws.send_text("{not json")
+        assert ws.receive_json()["type"] == "error"
+        ws.send_bytes(b"\x81")
+        assert ws.receive_json()["type"] == "error"
+
+        ws.send_json({"type": "destinations", "destinations": sample_destinations, "method": "fast"})
+        assert ws.receive_json() == {"type": "ready", "count": 3}
+
+
+@pytest.mark.asyncio
+async def test_server_timing_header_and_export(monkeypatch, tmp_path, sample_destinations):
+    """Sampled requests get a Server-Timing header and a JSON-lines trace record. - test_server_timing_header_and_export"""
+    import json
+    import app.main as main_module
+
+    export_path = tmp_path / "traces.jsonl"
+    traced = get_settings()
+    traced.trace_sample_rate = 1.0
+    traced.trace_export_path = str(export_path)
+    monkeypatch.setattr(main_module, "get_settings", lambda: traced)
+    # The tracing middleware reads its settings once; rebuild the stack to pick up the patch
+    monkeypatch.setattr(app, "middleware_stack", None)
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        payload = {
+            "origin": {"lat": -23.55052, "lon": -46.633308},
+            "destinations": sample_destinations,
+            "method": "geodesic",
+        }
+        r = await ac.post("/api/distance", json=payload)
+
+    assert r.status_code == 200
+    timing = r.headers["Server-Timing"]
+    assert "geodesic;dur=" in timing
+    assert "compute;dur=" in timing
+    assert "build;dur=" in timing
+    assert timing.count("build;dur=") == 1
+    assert "serialize;dur=" in timing
+    assert "total;dur=" in timing
+
+    record = json.loads(export_path.read_text().strip().splitlines()[-1])
+    assert record["path"] == "/api/distance"
+    assert record["status"] == 200
+    assert {s["name"] for s in record["spans"]} >= {"geodesic", "compute", "build"}
+
+
+@pytest.mark.asyncio
+async def test_unsampled_requests_have_no_server_timing(sample_destinations):
+    """With the default sample rate of 0 no Server-Timing header is added. - test_unsampled_requests_have_no_server_timing"""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        payload = {
+            "origin": {"lat": -23.55052, "lon": -46.633308},
+            "destinations": sample_destinations,
+            "method": "fast",
+        }
+        r = await ac.post("/api/distance", json=payload)
+    assert r.status_code == 200
+    assert "Server-Timing" not in r.headers
@@ -0,0 +1,206 @@
+import asyncio
+
+import httpx
+import pytest
+from httpx import AsyncClient
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.main import app
+import app.services.concurrency as concurrency_module
+import app.services.geocode as geocode_module
+from app.services.concurrency import AdaptiveLimiter, UpstreamOverloaded
+from app.services.distance import distance_via_best_method, osrm_route_distance
+from app.core.config import get_settings
+
+
+"""Unit tests for the adaptive upstream concurrency limiter (app.services.concurrency)."""
+
+SAO_PAULO = (-23.55052, -46.633308)
+CAMPINAS = (-22.9099, -47.0626)
+
+OSRM_OK = {"code": "Ok", "routes": [{"distance": 93596.3, "duration": 4576.7}]}
+
+
+@pytest.fixture
+def limited_settings():
+    """Settings with a small adaptive limit on every upstream. - limited_settings"""
+    settings = get_settings()
+    settings.upstream_limiter_enabled = True
+    settings.upstream_limiter_initial = 2
+    settings.upstream_limiter_max_queue = 1
+    settings.use_osrm_online = False
+    settings.osrm_service_url = "http://osrm.local:5000"
+    return settings
+
+
+def test_aimd_increases_slowly_and_backs_off_once_per_round():
+    """Fast successes add ~1 slot per round; simultaneous failures cut the limit once. - test_aimd_increases_slowly_and_backs_off_once_per_round"""
+    now = [0.0]
+    limiter = AdaptiveLimiter("test", initial_limit=4, backoff=0.5, slow_seconds=1.0, clock=lambda: now[0])
+
+    for _ in range(4):
+        limiter.inflight += 1
+        limiter.release(now[0], failed=False)
+    assert limiter.limit == 4
+    limiter.inflight += 1
+    limiter.release(now[0], failed=False)
+    assert limiter.limit == 5
+
+    # Three requests issued together all fail: only one decrease
+    started = now[0]
+    now[0] = 0.5
+    for _ in range(3):
+        limiter.inflight += 1
+        limiter.release(started, failed=True)
+    assert limiter.limit == 2
+
+    # A slow success counts as congestion, a cancelled fast call changes nothing
+    now[0] = 2.0
+    limiter.inflight += 1
+    limiter.release(0.6, failed=False)
+    assert limiter.limit == 1
+    limiter.inflight += 1
+    limiter.release(now[0], failed=None)
+    assert limiter.limit == 1
+    assert limiter.inflight == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_and_load_shedding():
+    """Requests over the limit queue in FIFO order; a full queue sheds. - test_queue_and_load_shedding"""
+    limiter = AdaptiveLimiter("test", initial_limit=1, max_queue=1)
+    started = await limiter.acquire()
+
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert limiter.queued == 1
+    with pytest.raises(UpstreamOverloaded):
+        await limiter.acquire()
+    assert limiter.stats()["shed"] == 1
+
+    limiter.release(started, failed=False)
+    second = await asyncio.wait_for(waiter, 1.0)
+    assert limiter.inflight == 1 and limiter.queued == 0
+    limiter.release(second, failed=False)
+    assert limiter.inflight == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    """A request cancelled while queued (e.g. by its deadline) frees its queue place. - test_cancelled_waiter_leaves_queue"""
+    limiter = AdaptiveLimiter("test", initial_limit=1, max_queue=1)
+    started = await limiter.acquire()
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(limiter.acquire(), 0.01)
+    assert limiter.queued == 0
+    limiter.release(started, failed=False)
+    assert limiter.inflight == 0
+
+
+@pytest.mark.asyncio
+async def test_slot_only_backs_off_on_congestion():
+    """Timeouts, connection errors, 5xx and 429 lower the limit; other 4xx and unrelated errors do not. - test_slot_only_backs_off_on_congestion"""
+    request = httpx.Request("GET", "http://upstream.local/search")
+
+    def status_error(code: int) -> httpx.HTTPStatusError:
+        return httpx.HTTPStatusError("status", request=request, response=httpx.Response(code, request=request))
+
+    cases = [
+        (status_error(404), False),
+        (status_error(400), False),
+        (ValueError("bad json"), False),
+        (status_error(429), True),
+        (status_error(503), True),
+        (httpx.ConnectError("refused"), True),
+        (httpx.ReadTimeout("slow"), True),
+    ]
+    for exc, backs_off in cases:
+        limiter = AdaptiveLimiter("test", initial_limit=10, backoff=0.5)
+        with pytest.raises(type(exc)):
+            async with limiter.slot():
+                raise exc
+        assert (limiter.limit < 10) is backs_off, exc
+        assert limiter.inflight == 0
+
+
+@pytest.mark.asyncio
+async def test_public_upstreams_are_not_limited(monkeypatch, limited_settings):
+    """The shared public OSRM and Nominatim services get no limiter. - test_public_upstreams_are_not_limited"""
+    limited_settings.use_osrm_online = True
+    limited_settings.nominatim_url = ""
+    limited_settings.run_local = False
+
+    async def found(address: str, client: httpx.AsyncClient, url: str, user_agent: str):
+        return [{"lat": "-23.55052", "lon": "-46.633308"}]
+
+    monkeypatch.setattr(geocode_module, "_query_nominatim", found)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, json=OSRM_OK))) as client:
+        await osrm_route_distance(*SAO_PAULO, *CAMPINAS, client, limited_settings)
+        await geocode_module.geocode_address("Praça da Sé, São Paulo", client, limited_settings)
+    assert concurrency_module.limiter_stats() == []
+
+
+@pytest.mark.asyncio
+async def test_osrm_calls_respect_limit(limited_settings):
+    """Concurrent OSRM calls never exceed the limit, and overflow beyond the queue is shed. - test_osrm_calls_respect_limit"""
+    active = []
+    peak = []
+    gate = asyncio.Event()
+
+    async def handler(request):
+        active.append(1)
+        peak.append(len(active))
+        await gate.wait()
+        active.pop()
+        return httpx.Response(200, json=OSRM_OK)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        calls = [asyncio.ensure_future(osrm_route_distance(*SAO_PAULO, *CAMPINAS, client, limited_settings)) for _ in range(4)]
+        await asyncio.sleep(0.05)
+        gate.set()
+        results = await asyncio.gather(*calls, return_exceptions=True)
+
+    assert max(peak) == 2
+    assert sum(isinstance(r, UpstreamOverloaded) for r in results) == 1
+    assert sum(isinstance(r, dict) for r in results) == 3
+
+    # With every slot taken and the queue full, the route is shed and falls back
+    limiter = concurrency_module.get_upstream_limiter("osrm", limited_settings.osrm_service_url, limited_settings)
+    held = [await limiter.acquire() for _ in range(limiter.limit)]
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, json=OSRM_OK))) as client:
+        result = await distance_via_best_method(*SAO_PAULO, *CAMPINAS, client, limited_settings)
+    assert result["method"] in ("geodesic", "haversine")
+    waiter.cancel()
+    for started in held:
+        limiter.release(started, failed=None)
+
+
+@pytest.mark.asyncio
+async def test_nominatim_errors_lower_the_limit(monkeypatch, limited_settings):
+    """Failing Nominatim calls back the limit off, visible in the limits endpoint. - test_nominatim_errors_lower_the_limit"""
+    limited_settings.upstream_limiter_initial = 10
+    limited_settings.nominatim_url = "http://nominatim.local:8080"
+
+    async def failing(address: str, client: httpx.AsyncClient, url: str, user_agent: str):
+        raise httpx.ConnectError("connection refused")
+
+    monkeypatch.setattr(geocode_module, "_query_nominatim", failing)
+    async with httpx.AsyncClient() as client:
+        with pytest.raises(ValueError):
+            await geocode_module.geocode_address("Praça da Sé, São Paulo", client, limited_settings)
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.get("/api/upstreams/limits")
+    assert r.status_code == 200
+    limits = {item["upstream"]: item for item in r.json()}
+    primary = limits["nominatim http://nominatim.local:8080"]
+    assert primary["limit"] == 7
+    assert primary["inflight"] == 0 and primary["queued"] == 0
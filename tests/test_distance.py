@@ -0,0 +1,30 @@
+import pytest
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+pytest.importorskip("geopy")
+
+from app.services.distance import geodesic_distance, geodesic_many, haversine_distance, haversine_many
+
+
+"""Unit tests for the one-to-many straight-line helpers (app.services.distance)."""
+
+ORIGIN = (-23.55052, -46.633308)
+POINTS = [(-22.9068, -43.1729), (-22.9099, -47.0626), (-8.0476, -34.877), ORIGIN]
+
+
+def test_geodesic_many_matches_pairwise():
+    """geodesic_many gives the same distances as geodesic_distance per pair. - test_geodesic_many_matches_pairwise"""
+    expected = [geodesic_distance(*ORIGIN, *p) for p in POINTS]
+    assert geodesic_many(*ORIGIN, POINTS) == pytest.approx(expected, rel=1e-12, abs=1e-9)
+
+
+def test_haversine_many_matches_pairwise():
+    """haversine_many gives the same distances as haversine_distance per pair. - test_haversine_many_matches_pairwise"""
+    expected = [haversine_distance(*ORIGIN, *p) for p in POINTS]
+    assert haversine_many(*ORIGIN, POINTS) == pytest.approx(expected, rel=1e-12, abs=1e-9)
@@ -0,0 +1,140 @@
+import json
+import threading
+
+import pytest
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import app.services.estimator as estimator_module
+from app.services.estimator import DetourEstimator
+from app.services.distance import distance_via_best_method, haversine_distance
+from app.core.config import get_settings
+
+
+"""Unit tests for the detour-factor estimator (app.services.estimator)."""
+
+SAO_PAULO = (-23.55052, -46.633308)
+GUARULHOS = (-23.4538, -46.5333)
+SANTO_ANDRE = (-23.6639, -46.5383)
+
+
+def _calibrate(estimator: DetourEstimator, factor: float, speed_kmh: float, samples: int) -> None:
+    straight = haversine_distance(*SAO_PAULO, *GUARULHOS)
+    road = straight * factor
+    for _ in range(samples):
+        estimator.record(*SAO_PAULO, *GUARULHOS, straight, road, road / speed_kmh * 3600.0)
+
+
+def test_estimate_uses_fitted_factor_and_speed():
+    """Calibrated cells scale straight-line distance and predict duration. - test_estimate_uses_fitted_factor_and_speed"""
+    estimator = DetourEstimator(min_samples=3)
+    _calibrate(estimator, factor=1.4, speed_kmh=30.0, samples=3)
+
+    straight = haversine_distance(*SAO_PAULO, *SANTO_ANDRE)
+    result = estimator.estimate(*SAO_PAULO, *SANTO_ANDRE, straight)
+
+    assert result["method"] == "estimated"
+    assert pytest.approx(result["distance_km"], rel=1e-6) == straight * 1.4
+    assert pytest.approx(result["duration_seconds"], rel=1e-6) == straight * 1.4 / 30.0 * 3600.0
+
+
+def test_uncalibrated_estimate_uses_defaults():
+    """Without enough samples the default factor and speed apply. - test_uncalibrated_estimate_uses_defaults"""
+    estimator = DetourEstimator(min_samples=5, default_factor=1.25, default_speed_kmh=50.0)
+    _calibrate(estimator, factor=2.0, speed_kmh=10.0, samples=2)
+
+    assert not estimator.is_calibrated(*SAO_PAULO, *GUARULHOS)
+    result = estimator.estimate(*SAO_PAULO, *GUARULHOS, 10.0)
+    assert pytest.approx(result["distance_km"], rel=1e-6) == 12.5
+    assert pytest.approx(result["duration_seconds"], rel=1e-6) == 12.5 / 50.0 * 3600.0
+
+
+def test_calibration_persists(tmp_path):
+    """Saved calibration is loaded by a new estimator using the same grid. - test_calibration_persists"""
+    path = str(tmp_path / "detour.json")
+    estimator = DetourEstimator(min_samples=3, path=path)
+    _calibrate(estimator, factor=1.5, speed_kmh=40.0, samples=3)
+    estimator.save()
+
+    reloaded = DetourEstimator(min_samples=3, path=path)
+    assert reloaded.is_calibrated(*SAO_PAULO, *GUARULHOS)
+
+    other_grid = DetourEstimator(min_samples=3, path=path, cell_deg=0.1)
+    assert not other_grid.is_calibrated(*SAO_PAULO, *GUARULHOS)
+
+
+def test_speed_ignores_samples_without_duration():
+    """Road km of routes without a duration do not inflate the fitted speed. - test_speed_ignores_samples_without_duration"""
+    estimator = DetourEstimator(min_samples=3)
+    _calibrate(estimator, factor=1.4, speed_kmh=30.0, samples=3)
+    straight = haversine_distance(*SAO_PAULO, *GUARULHOS)
+    for _ in range(3):
+        estimator.record(*SAO_PAULO, *GUARULHOS, straight, straight * 1.4, None)
+
+    result = estimator.estimate(*SAO_PAULO, *GUARULHOS, straight)
+    assert pytest.approx(result["duration_seconds"], rel=1e-6) == straight * 1.4 / 30.0 * 3600.0
+
+
+def test_untimed_samples_alone_use_default_speed():
+    """A factor can be fitted from untimed samples while the speed stays at its default. - test_untimed_samples_alone_use_default_speed"""
+    estimator = DetourEstimator(min_samples=3, default_speed_kmh=50.0)
+    straight = haversine_distance(*SAO_PAULO, *GUARULHOS)
+    for _ in range(3):
+        estimator.record(*SAO_PAULO, *GUARULHOS, straight, straight * 1.4, None)
+
+    result = estimator.estimate(*SAO_PAULO, *GUARULHOS, straight)
+    assert pytest.approx(result["distance_km"], rel=1e-6) == straight * 1.4
+    assert pytest.approx(result["duration_seconds"], rel=1e-6) == straight * 1.4 / 50.0 * 3600.0
+
+
+def test_calibration_without_timed_sums_is_ignored(tmp_path):
+    """Files written before timed sums existed use another layout and are ignored. - test_calibration_without_timed_sums_is_ignored"""
+    path = tmp_path / "detour.json"
+    path.write_text(json.dumps({"cell_deg": 0.5, "global": [3, 30.0, 42.0, 5040.0], "cells": {}}))
+    estimator = DetourEstimator(min_samples=3, path=str(path))
+
+    assert not estimator.is_calibrated(*SAO_PAULO, *GUARULHOS)
+
+
+@pytest.mark.asyncio
+async def test_periodic_save_runs_off_the_event_loop(tmp_path, monkeypatch):
+    """Inside a running loop, save_every triggers a write in the executor, not on the loop. - test_periodic_save_runs_off_the_event_loop"""
+    path = tmp_path / "detour.json"
+    estimator = DetourEstimator(min_samples=3, path=str(path), save_every=3)
+    writers = []
+    write_file = estimator._write_file
+
+    def tracking_write(data):
+        writers.append(threading.get_ident())
+        write_file(data)
+
+    monkeypatch.setattr(estimator, "_write_file", tracking_write)
+    _calibrate(estimator, factor=1.5, speed_kmh=40.0, samples=3)
+
+    assert estimator._pending is not None
+    await estimator._pending
+    assert writers and writers[0] != threading.get_ident()
+    assert DetourEstimator(min_samples=3, path=str(path)).is_calibrated(*SAO_PAULO, *GUARULHOS)
+
+
+@pytest.mark.asyncio
+async def test_fallback_uses_calibrated_estimate():
+    """Without OSRM, calibrated pairs fall back to the estimated method. - test_fallback_uses_calibrated_estimate"""
+    settings = get_settings()
+    settings.detour_estimator_enabled = True
+    settings.detour_estimator_min_samples = 3
+    settings.detour_estimator_path = ""
+    _calibrate(estimator_module.get_detour_estimator(settings), factor=1.4, speed_kmh=30.0, samples=3)
+
+    result = await distance_via_best_method(*SAO_PAULO, *GUARULHOS, None, settings)
+    assert result["method"] == "estimated"
+    assert result["duration_seconds"] is not None
+
+    settings.detour_estimator_enabled = False
+    result = await distance_via_best_method(*SAO_PAULO, *GUARULHOS, None, settings)
+    assert result["method"] in ("geodesic", "haversine")
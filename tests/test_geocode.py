@@ -107,3 +107,243 @@ async def test_geocode_both_endpoints_fail_raises(monkeypatch, settings):
     async with httpx.AsyncClient() as client:
         with pytest.raises(ValueError):
             await geocode_address("Praça da Sé, São Paulo", client, settings)
+
+
+@pytest.fixture
+def hedged_settings(settings):
+    """Settings with hedging enabled against a slow private primary. - hedged_settings"""
+    settings.nominatim_url = "https://example-nominatim.local"
+    settings.geocode_hedge_enabled = True
+    settings.geocode_hedge_default_delay_seconds = 0.01
+    settings.geocode_hedge_min_delay_seconds = 0.01
+    settings.geocode_hedge_max_fraction = 1.0
+    return settings
+
+
+@pytest.mark.asyncio
+async def test_geocode_hedge_wins_over_slow_primary(monkeypatch, hedged_settings):
+    """A slow primary is raced by the public endpoint and cancelled when the hedge answers first. - test_geocode_hedge_wins_over_slow_primary"""
+    import asyncio
+
+    primary_url = hedged_settings.nominatim_url.rstrip("/")
+    cancelled = []
+
+    async def fake_query(address: str, client: httpx.AsyncClient, url: str, user_agent: str):
+        if url.rstrip("/") == primary_url:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(url)
+                raise
+            return [{"lat": "0", "lon": "0"}]
+        return [{"lat": "-23.55052", "lon": "-46.633308"}]
+
+    monkeypatch.setattr(geocode_module, "_query_nominatim", fake_query)
+
+    async with httpx.AsyncClient() as client:
+        lat, lon = await asyncio.wait_for(geocode_address("Praça da Sé, São Paulo", client, hedged_settings), 1.0)
+        await asyncio.sleep(0)
+
+    assert pytest.approx(lat, rel=1e-6) == -23.55052
+    assert pytest.approx(lon, rel=1e-6) == -46.633308
+    assert cancelled == [primary_url]
+
+
+@pytest.mark.asyncio
+async def test_geocode_hedge_respects_budget(monkeypatch, hedged_settings):
+    """With no hedge budget the public endpoint is not queried while the primary is slow. - test_geocode_hedge_respects_budget"""
+    import asyncio
+
+    hedged_settings.geocode_hedge_max_fraction = 0.0
+    primary_url = hedged_settings.nominatim_url.rstrip("/")
+    calls = []
+
+    async def fake_query(address: str, client: httpx.AsyncClient, url: str, user_agent: str):
+        calls.append(url.rstrip("/"))
+        if url.rstrip("/") == primary_url:
+            await asyncio.sleep(0.05)
+            return [{"lat": "-23.55052", "lon": "-46.633308"}]
+        return [{"lat": "0", "lon": "0"}]
+
+    monkeypatch.setattr(geocode_module, "_query_nominatim", fake_query)
+
+    async with httpx.AsyncClient() as client:
+        lat, _ = await geocode_address("Praça da Sé, São Paulo", client, hedged_settings)
+
+    assert pytest.approx(lat, rel=1e-6) == -23.55052
+    assert calls == [primary_url]
+
+
+@pytest.mark.asyncio
+async def test_hedge_policy_samples_only_primary_answers(monkeypatch, hedged_settings):
+    """A primary cancelled by a winning hedge, or failing, adds no latency sample. - test_hedge_policy_samples_only_primary_answers"""
+    import asyncio
+    from app.services.hedging import get_hedge_policy
+
+    primary_url = hedged_settings.nominatim_url.rstrip("/")
+    primary_behaviour = ["slow"]
+
+    async def fake_query(address: str, client: httpx.AsyncClient, url: str, user_agent: str):
+        if url.rstrip("/") == primary_url:
+            if primary_behaviour[0] == "fail":
+                raise httpx.ConnectError("refused")
+            await asyncio.sleep(5 if primary_behaviour[0] == "slow" else 0)
+        return [{"lat": "-23.55052", "lon": "-46.633308"}]
+
+    monkeypatch.setattr(geocode_module, "_query_nominatim", fake_query)
+    policy = get_hedge_policy(hedged_settings)
+
+    async with httpx.AsyncClient() as client:
+        await asyncio.wait_for(geocode_address("Praça da Sé, São Paulo", client, hedged_settings), 1.0)
+        primary_behaviour[0] = "fail"
+        await geocode_address("Praça da Sé, São Paulo", client, hedged_settings)
+        assert len(policy._samples) == 0
+
+        primary_behaviour[0] = "fast"
+        await geocode_address("Praça da Sé, São Paulo", client, hedged_settings)
+    assert len(policy._samples) == 1
+
+
+@pytest.fixture
+def memory_settings(settings):
+    """Settings with the specificity memory enabled and a public-only geocoder. - memory_settings"""
+    settings.nominatim_url = ""
+    settings.run_local = False
+    settings.geocode_memory_enabled = True
+    return settings
+
+
+PARTS = ["Rua Inexistente 123", "Bairro Fantasma", "São Paulo", "SP"]
+
+
+@pytest.mark.asyncio
+async def test_best_effort_memory_skips_known_failures(monkeypatch, memory_settings):
+    """A second lookup of the same parts starts at the level that resolved before. - test_best_effort_memory_skips_known_failures"""
+    from app.services.geocode import geocode_best_effort
+
+    queried = []
+
+    async def fake_query(address: str, client: httpx.AsyncClient, url: str, user_agent: str):
+        queried.append(address)
+        if address.startswith("São Paulo"):
+            return [{"lat": "-23.55052", "lon": "-46.633308"}]
+        return []
+
+    monkeypatch.setattr(geocode_module, "_query_nominatim", fake_query)
+
+    async with httpx.AsyncClient() as client:
+        first = await geocode_best_effort(PARTS, client, memory_settings)
+        assert queried == ["Rua Inexistente 123, Bairro Fantasma, São Paulo, SP", "Bairro Fantasma, São Paulo, SP", "São Paulo, SP"]
+
+        queried.clear()
+        # Normalization ignores case and extra whitespace
+        second = await geocode_best_effort(["rua inexistente  123", "BAIRRO FANTASMA", "São Paulo", "SP"], client, memory_settings)
+        assert queried == ["São Paulo, SP"]
+    assert first == second
+
+
+@pytest.mark.asyncio
+async def test_best_effort_memory_reprobes_in_background(monkeypatch, memory_settings):
+    """Once the re-probe is due, skipped levels are retried and a better level is learned. - test_best_effort_memory_reprobes_in_background"""
+    import asyncio
+    from app.services.geocode import geocode_best_effort
+
+    memory_settings.geocode_memory_reprobe_seconds = 0.0
+    street_known = False
+    queried = []
+
+    async def fake_query(address: str, client: httpx.AsyncClient, url: str, user_agent: str):
+        queried.append(address)
+        if address.startswith("Rua") and street_known:
+            return [{"lat": "-23.5", "lon": "-46.6"}]
+        if address.startswith("São Paulo"):
+            return [{"lat": "-23.55052", "lon": "-46.633308"}]
+        return []
+
+    monkeypatch.setattr(geocode_module, "_query_nominatim", fake_query)
+
+    async with httpx.AsyncClient() as client:
+        await geocode_best_effort(PARTS, client, memory_settings)
+        await asyncio.gather(*geocode_module._reprobes)
+        street_known = True
+        queried.clear()
+
+        # Answered from the remembered level; the street is re-probed afterwards
+        lat, _ = await geocode_best_effort(PARTS, client, memory_settings)
+        assert pytest.approx(lat, rel=1e-6) == -23.55052
+        await asyncio.gather(*geocode_module._reprobes)
+        assert queried[0] == "São Paulo, SP"
+        assert queried[1].startswith("Rua")
+
+        queried.clear()
+        lat, _ = await geocode_best_effort(PARTS, client, memory_settings)
+        assert pytest.approx(lat, rel=1e-6) == -23.5
+        assert len(queried) == 1
+
+
+@pytest.mark.asyncio
+async def test_best_effort_memory_ignores_upstream_errors(monkeypatch, memory_settings):
+    """Network failures are not remembered as missing addresses. - test_best_effort_memory_ignores_upstream_errors"""
+    from app.services.geocode import geocode_best_effort
+    from app.services.specificity import get_specificity_memory, normalize_parts
+
+    async def always_fail(address: str, client: httpx.AsyncClient, url: str, user_agent: str):
+        raise httpx.RequestError("network down")
+
+    monkeypatch.setattr(geocode_module, "_query_nominatim", always_fail)
+
+    async with httpx.AsyncClient() as client:
+        with pytest.raises(ValueError):
+            await geocode_best_effort(PARTS, client, memory_settings)
+
+    memory = get_specificity_memory(memory_settings)
+    assert memory.plan(normalize_parts(PARTS)) == [0, 1, 2, 3]
+
+
+def test_specificity_memory_expiry_and_lru():
+    """Learned levels expire after their TTL and the least recently used entry is evicted. - test_specificity_memory_expiry_and_lru"""
+    from app.services.specificity import SpecificityMemory
+
+    now = [0.0]
+    memory = SpecificityMemory(success_ttl=100.0, failure_ttl=10.0, max_entries=2, clock=lambda: now[0])
+    key = ("a", "b", "c")
+    memory.record_failure(key, 0)
+    memory.record_success(key, 1)
+    assert memory.plan(key) == [1, 2]
+
+    # Failure expired: level 0 may be tried again, still skipped from the good level
+    now[0] = 20.0
+    assert memory.plan(key) == [1, 2]
+    # Success expired too: back to the full plan
+    now[0] = 150.0
+    assert memory.plan(key) == [0, 1, 2]
+
+    memory.record_success(("x",), 0)
+    memory.record_success(("y",), 0)
+    assert len(memory) == 2
+    assert key not in memory._entries
+
+
+@pytest.mark.asyncio
+async def test_public_span_label_follows_settings(monkeypatch, settings):
+    """Time on the configured public fallback is traced as nominatim_public. - test_public_span_label_follows_settings"""
+    from app.core.tracing import Trace, activate, deactivate
+
+    settings.nominatim_url = "https://example-nominatim.local"
+    settings.public_nominatim_url = "https://nominatim.example.org/"
+
+    async def fake_query(address: str, client: httpx.AsyncClient, url: str, user_agent: str):
+        if url.startswith("https://example-nominatim.local"):
+            raise httpx.RequestError("primary down")
+        return [{"lat": "-23.55052", "lon": "-46.633308"}]
+
+    monkeypatch.setattr(geocode_module, "_query_nominatim", fake_query)
+
+    trace = Trace()
+    token = activate(trace)
+    try:
+        async with httpx.AsyncClient() as client:
+            await geocode_address("Praça da Sé, São Paulo", client, settings)
+    finally:
+        deactivate(token)
+    assert [s["name"] for s in trace.spans] == ["nominatim", "nominatim_public"]
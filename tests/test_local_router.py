@@ -0,0 +1,212 @@
+import httpx
+import threading
+import pytest
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import app.services.local_router as local_router_module
+from app.services.local_router import RoadGraph, build_graph_from_osm, write_graph
+from app.services.distance import LocalRoutes, distance_via_best_method
+from app.core.config import get_settings
+
+
+"""Unit tests for the embedded local router (app.services.local_router)."""
+
+TOY_OSM = ROOT / "tests" / "data" / "toy.osm"
+
+# Node coordinates of tests/data/toy.osm
+SW = (-23.5500, -46.6300)
+SE = (-23.5500, -46.6200)
+NW = (-23.5450, -46.6300)
+NE = (-23.5450, -46.6200)
+FAR = (-23.6000, -46.7000)
+
+
+@pytest.fixture
+def graph_path(tmp_path):
+    """Toy OSM extract built into a graph file. - graph_path"""
+    path = str(tmp_path / "toy.graph")
+    build_graph_from_osm(str(TOY_OSM), path)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def close_graphs():
+    """Close the graphs opened by a test before they are forgotten. - close_graphs"""
+    yield
+    for graph in local_router_module._GRAPHS.values():
+        graph.close()
+
+
+def test_build_skips_unroutable_ways(graph_path):
+    """Footways and unreferenced nodes are left out of the graph. - test_build_skips_unroutable_ways"""
+    graph = RoadGraph(graph_path)
+    try:
+        # Six routed nodes; two-way residential segments add both directions
+        assert graph.node_count == 6
+        assert graph.edge_count == 2 * 2 + 2 + 2 * 2
+    finally:
+        graph.close()
+
+
+def test_route_prefers_fastest_path(graph_path):
+    """The southern street is shorter in time than going around via the primary. - test_route_prefers_fastest_path"""
+    graph = RoadGraph(graph_path)
+    try:
+        result = graph.route(*SW, *SE)
+        assert result["method"] == "local"
+        assert pytest.approx(result["distance_km"], rel=0.01) == 1.02
+        assert pytest.approx(result["duration_seconds"], rel=0.01) == 1.02 / 30.0 * 3600.0
+    finally:
+        graph.close()
+
+
+def test_route_honours_oneway(graph_path):
+    """Against the oneway the route detours over the southern street. - test_route_honours_oneway"""
+    graph = RoadGraph(graph_path)
+    try:
+        forward = graph.route(*NW, *NE)
+        backward = graph.route(*NE, *NW)
+        assert pytest.approx(forward["distance_km"], rel=0.01) == 1.02
+        assert backward["distance_km"] > 2.0
+    finally:
+        graph.close()
+
+
+def test_one_to_many_snaps_and_skips_far_points(graph_path):
+    """Nearby points snap to the graph; points beyond max_snap_km get None. - test_one_to_many_snaps_and_skips_far_points"""
+    graph = RoadGraph(graph_path)
+    try:
+        near_se = (SE[0] + 0.0002, SE[1] + 0.0002)
+        results = graph.one_to_many(*SW, [near_se, FAR, SW], max_snap_km=0.5)
+        assert pytest.approx(results[0]["distance_km"], rel=0.01) == 1.02
+        assert results[1] is None
+        assert results[2]["distance_km"] == 0.0
+        assert graph.route(*FAR, *SE, max_snap_km=0.5) is None
+    finally:
+        graph.close()
+
+
+def test_unreachable_target_returns_none(tmp_path):
+    """Disconnected components yield no route. - test_unreachable_target_returns_none"""
+    path = str(tmp_path / "split.graph")
+    write_graph(path, [0.0, 0.0, 0.0], [0.0, 0.001, 0.002], [(0, 1, 111.0, 10.0)])
+    graph = RoadGraph(path)
+    try:
+        assert graph.route(0.0, 0.0, 0.0, 0.001)["duration_seconds"] == pytest.approx(10.0)
+        assert graph.route(0.0, 0.0, 0.0, 0.002) is None
+    finally:
+        graph.close()
+
+
+def test_rejects_foreign_files(tmp_path):
+    """Files without the graph header are refused. - test_rejects_foreign_files"""
+    path = tmp_path / "not.graph"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        RoadGraph(str(path))
+
+
+def _failing_osrm_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(503)))
+
+
+@pytest.mark.asyncio
+async def test_local_router_is_osrm_fallback(graph_path):
+    """In fallback mode, failed OSRM calls are answered by the local graph. - test_local_router_is_osrm_fallback"""
+    settings = get_settings()
+    settings.local_graph_path = graph_path
+    settings.local_router_mode = "fallback"
+
+    async with _failing_osrm_client() as client:
+        result = await distance_via_best_method(*SW, *SE, client, settings)
+        assert result["method"] == "local"
+
+        # "route" accepts local results, and still errors when nothing can be routed
+        result = await distance_via_best_method(*SW, *SE, client, settings, method="route")
+        assert result["method"] == "local"
+        with pytest.raises(Exception):
+            await distance_via_best_method(*SW, *FAR, client, settings, method="route")
+
+        result = await distance_via_best_method(*SW, *FAR, client, settings)
+        assert result["method"] in ("geodesic", "haversine")
+
+
+@pytest.mark.asyncio
+async def test_local_router_primary_skips_osrm(graph_path):
+    """In primary mode the local graph answers before OSRM is called. - test_local_router_primary_skips_osrm"""
+    settings = get_settings()
+    settings.local_graph_path = graph_path
+    settings.local_router_mode = "primary"
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        result = await distance_via_best_method(*NW, *NE, client, settings)
+    assert result["method"] == "local"
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_local_routes_search_once_per_request(graph_path, monkeypatch):
+    """Destinations sharing a LocalRoutes cost one graph search, run off the event loop. - test_local_routes_search_once_per_request"""
+    settings = get_settings()
+    settings.local_graph_path = graph_path
+    settings.local_router_mode = "primary"
+    searches = []
+    dijkstra = RoadGraph._dijkstra
+
+    def counting_dijkstra(self, source, targets):
+        searches.append(threading.get_ident())
+        return dijkstra(self, source, targets)
+
+    monkeypatch.setattr(RoadGraph, "_dijkstra", counting_dijkstra)
+    destinations = [SE, NW, NE]
+    local_routes = LocalRoutes(*SW, destinations, settings)
+    async with _failing_osrm_client() as client:
+        results = [
+            await distance_via_best_method(*SW, *dest, client, settings, local_routes=local_routes)
+            for dest in destinations
+        ]
+    assert [r["method"] for r in results] == ["local"] * 3
+    assert len(searches) == 1
+    assert searches[0] != threading.get_ident()
+
+
+@pytest.mark.asyncio
+async def test_distance_endpoint_searches_graph_once(graph_path, monkeypatch):
+    """/api/distance routes all destinations of a request with one graph search. - test_distance_endpoint_searches_graph_once"""
+    from app.main import app
+
+    settings = get_settings()
+    settings.local_graph_path = graph_path
+    settings.local_router_mode = "primary"
+    searches = []
+    dijkstra = RoadGraph._dijkstra
+
+    def counting_dijkstra(self, source, targets):
+        searches.append(source)
+        return dijkstra(self, source, targets)
+
+    monkeypatch.setattr(RoadGraph, "_dijkstra", counting_dijkstra)
+    app.dependency_overrides[get_settings] = lambda: settings
+    try:
+        async with httpx.AsyncClient(app=app, base_url="http://test") as ac:
+            payload = {
+                "origin": {"lat": SW[0], "lon": SW[1]},
+                "destinations": [{"name": n, "lat": p[0], "lon": p[1]} for n, p in (("se", SE), ("nw", NW), ("ne", NE))],
+            }
+            r = await ac.post("/api/distance", json=payload)
+    finally:
+        app.dependency_overrides.pop(get_settings, None)
+    assert r.status_code == 200
+    assert [row["distance_method"] for row in r.json()] == ["local"] * 3
+    assert len(searches) == 1
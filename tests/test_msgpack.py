@@ -0,0 +1,118 @@
+import pytest
+import httpx
+from httpx import AsyncClient
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+msgpack = pytest.importorskip("msgpack")
+
+from app.main import app
+import app.services.geocode as geocode_module
+from app.api.negotiation import MSGPACK_MEDIA_TYPE, pack_floats, prefers_msgpack, unpack_floats
+
+
+"""Tests for MessagePack content negotiation (app.api.negotiation).
+
+The msgpack and JSON paths are checked for equivalent results.
+"""
+
+DESTINATIONS = [
+    {"name": "Rio", "lat": -22.9068, "lon": -43.1729},
+    {"name": "Campinas", "lat": -22.9099, "lon": -47.0626},
+    {"name": "Santos", "lat": -23.9608, "lon": -46.3336},
+]
+ORIGIN = {"lat": -23.55052, "lon": -46.633308}
+
+MSGPACK_HEADERS = {"Content-Type": MSGPACK_MEDIA_TYPE, "Accept": MSGPACK_MEDIA_TYPE}
+
+
+def test_pack_floats_roundtrip():
+    """Packed float64 columns roundtrip, with None encoded as NaN. - test_pack_floats_roundtrip"""
+    values = [1.5, None, -46.633308]
+    packed = pack_floats(values)
+    assert len(packed) == 24
+    assert unpack_floats(packed) == values
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        (None, False),
+        ("*/*", False),
+        ("application/json", False),
+        ("application/msgpack", True),
+        ("application/x-msgpack", True),
+        ("application/msgpack, */*;q=0.8", True),
+        ("application/msgpack, */*", True),
+        ("application/json, application/msgpack", False),
+        ("application/msgpack;q=0.5, application/json", False),
+        ("application/json;q=0.5, application/msgpack", True),
+        ("application/msgpack;q=0", False),
+        ("application/msgpack;q=0, */*", False),
+        ("application/*, application/json;q=0.1", True),
+        ("application/msgpack;q=bogus", False),
+    ],
+)
+def test_accept_negotiation_honours_q_values(accept, expected):
+    """MessagePack is chosen only when Accept ranks it above JSON. - test_accept_negotiation_honours_q_values"""
+    assert prefers_msgpack(accept) is expected
+
+
+@pytest.mark.asyncio
+async def test_distance_msgpack_matches_json():
+    """Columnar msgpack request and response carry the same results as JSON. - test_distance_msgpack_matches_json"""
+    payload = {"origin": ORIGIN, "destinations": DESTINATIONS, "method": "fast"}
+    columnar = {
+        "origin": ORIGIN,
+        "destinations": {
+            "name": [d["name"] for d in DESTINATIONS],
+            "lat": pack_floats([d["lat"] for d in DESTINATIONS]),
+            "lon": pack_floats([d["lon"] for d in DESTINATIONS]),
+        },
+        "method": "fast",
+    }
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r_json = await ac.post("/api/distance", json=payload)
+        r_pack = await ac.post("/api/distance", content=msgpack.packb(columnar, use_bin_type=True), headers=MSGPACK_HEADERS)
+
+    assert r_pack.status_code == 200
+    assert r_pack.headers["content-type"].startswith(MSGPACK_MEDIA_TYPE)
+    body = msgpack.unpackb(r_pack.content, raw=False)
+    expected = r_json.json()
+
+    assert body["name"] == [row["name"] for row in expected]
+    assert unpack_floats(body["distance_km"]) == [row["distance_km"] for row in expected]
+    assert unpack_floats(body["lat"]) == [row["lat"] for row in expected]
+    assert unpack_floats(body["duration_seconds"]) == [row["duration_seconds"] for row in expected]
+    assert body["distance_method"] == [row["distance_method"] for row in expected]
+
+
+@pytest.mark.asyncio
+async def test_geocode_msgpack(monkeypatch):
+    """The geocode route accepts and returns msgpack maps. - test_geocode_msgpack"""
+
+    async def fake_query(address: str, client: httpx.AsyncClient, url: str, user_agent: str):
+        return [{"lat": "-23.55052", "lon": "-46.633308"}]
+
+    monkeypatch.setattr(geocode_module, "_query_nominatim", fake_query)
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        body = msgpack.packb({"address": "Praça da Sé, São Paulo"}, use_bin_type=True)
+        r = await ac.post("/api/geocode", content=body, headers=MSGPACK_HEADERS)
+
+    assert r.status_code == 200
+    assert msgpack.unpackb(r.content, raw=False) == {"lat": -23.55052, "lon": -46.633308}
+
+
+@pytest.mark.asyncio
+async def test_invalid_msgpack_body_returns_400():
+    """Undecodable msgpack bodies are rejected. - test_invalid_msgpack_body_returns_400"""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.post("/api/distance", content=b"\xc1", headers=MSGPACK_HEADERS)
+    assert r.status_code == 400
@@ -0,0 +1,274 @@
+import pytest
+import httpx
+from httpx import AsyncClient
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.main import app
+import app.services.geocode as geocode_module
+import app.services.nominatim_db as nominatim_db_module
+from app.services.geocode import geocode_address, geocode_many
+from app.services.nominatim_db import CONTEXT_SEPARATOR, DatabaseUnavailable, LOOKUP_SQL, get_nominatim_db, split_address
+from app.core.config import get_settings
+
+
+"""Tests for the direct Nominatim database backend (app.services.nominatim_db).
+
+A fake asyncpg pool stands in for Postgres: it answers LOOKUP_SQL from a
+dict of place names with their address parents, the way the lateral lookup
+would (every context term must be one of the parents).
+"""
+
+PLACES = {
+    "praça da sé": ((-23.5503, -46.6340), {"são paulo", "sp"}),
+    "campinas": ((-22.9099, -47.0626), {"sp"}),
+}
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def fetch(self, sql, names, contexts):
+        assert sql == LOOKUP_SQL
+        self.pool.queries.append(list(zip(names, contexts)))
+        if self.pool.error is not None:
+            raise self.pool.error
+        rows = []
+        for idx, (name, context) in enumerate(zip(names, contexts), start=1):
+            place = PLACES.get(name)
+            terms = context.split(CONTEXT_SEPARATOR) if context else []
+            if place is not None and all(term in place[1] for term in terms):
+                rows.append((idx, *place[0]))
+        return rows
+
+
+class FakePool:
+    def __init__(self):
+        self.queries = []
+        self.error = None
+        self.closed = False
+
+    def acquire(self):
+        pool = self
+
+        class _Acquire:
+            async def __aenter__(self):
+                return FakeConnection(pool)
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return _Acquire()
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def db_settings():
+    """Settings using the database backend with a fake pool installed. - db_settings"""
+    settings = get_settings()
+    settings.geocode_backend = "db"
+    settings.geocode_hedge_enabled = False
+    settings.nominatim_url = "http://nominatim.local:8080"
+    settings.run_local = False
+    pool = FakePool()
+    get_nominatim_db(settings)._pool = pool
+    return settings, pool
+
+
+@pytest.fixture
+def http_calls(monkeypatch):
+    """Record HTTP geocoding calls; only Santos resolves over HTTP. - http_calls"""
+    calls = []
+
+    async def fake_query(address: str, client: httpx.AsyncClient, url: str, user_agent: str):
+        calls.append(address)
+        if address.startswith("Santos"):
+            return [{"lat": "-23.9608", "lon": "-46.3336"}]
+        return []
+
+    monkeypatch.setattr(geocode_module, "_query_nominatim", fake_query)
+    return calls
+
+
+def test_split_address():
+    """Addresses reduce to a lower-cased name and every later term as context. - test_split_address"""
+    assert split_address("Praça da Sé,  São   Paulo, SP") == ("praça da sé", ("são paulo", "sp"))
+    assert split_address(" Campinas ") == ("campinas", ())
+    assert split_address(" , ") == ("", ())
+
+
+@pytest.mark.asyncio
+async def test_geocode_many_is_one_round_trip_with_http_fallback(db_settings, http_calls):
+    """A batch is one database query; only unmatched addresses go over HTTP. - test_geocode_many_is_one_round_trip_with_http_fallback"""
+    settings, pool = db_settings
+    addresses = ["Praça da Sé, São Paulo, SP", "Santos, SP", "Campinas", "Nowhere"]
+
+    async with httpx.AsyncClient() as client:
+        results = await geocode_many(addresses, client, settings)
+
+    assert len(pool.queries) == 1
+    assert results[0] == (-23.5503, -46.6340)
+    assert results[1] == (-23.9608, -46.3336)
+    assert results[2] == (-22.9099, -47.0626)
+    assert isinstance(results[3], ValueError)
+    assert http_calls == ["Santos, SP", "Nowhere"]
+
+
+@pytest.mark.asyncio
+async def test_every_context_term_must_match(db_settings, http_calls):
+    """An address whose later terms do not all name parents of the place is left to HTTP. - test_every_context_term_must_match"""
+    settings, pool = db_settings
+    async with httpx.AsyncClient() as client:
+        results = await geocode_many(["Praça da Sé, São Paulo, RJ", "Campinas, SP"], client, settings)
+
+    assert pool.queries == [[("praça da sé", "são paulo" + CONTEXT_SEPARATOR + "rj"), ("campinas", "sp")]]
+    assert isinstance(results[0], ValueError)
+    assert results[1] == (-22.9099, -47.0626)
+    assert http_calls == ["Praça da Sé, São Paulo, RJ"]
+
+
+@pytest.mark.asyncio
+async def test_geocode_address_uses_database_first(db_settings, http_calls):
+    """Single lookups hit the database and skip HTTP when it matches. - test_geocode_address_uses_database_first"""
+    settings, _ = db_settings
+    async with httpx.AsyncClient() as client:
+        assert await geocode_address("Campinas", client, settings) == (-22.9099, -47.0626)
+    assert http_calls == []
+
+
+@pytest.mark.asyncio
+async def test_database_errors_fall_back_to_http(db_settings, http_calls, caplog):
+    """A failing database behaves like "no match", and the failure is logged. - test_database_errors_fall_back_to_http"""
+    settings, pool = db_settings
+    pool.error = OSError("connection refused")
+    with caplog.at_level("WARNING", logger="app.services.geocode"):
+        async with httpx.AsyncClient() as client:
+            assert await geocode_address("Santos, SP", client, settings) == (-23.9608, -46.3336)
+    assert http_calls == ["Santos, SP"]
+    assert "connection refused" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_unexpected_database_errors_propagate(db_settings, http_calls):
+    """Errors that are not database failures are not silently turned into HTTP lookups. - test_unexpected_database_errors_propagate"""
+    settings, pool = db_settings
+    pool.error = TypeError("bad row")
+    async with httpx.AsyncClient() as client:
+        with pytest.raises(TypeError):
+            await geocode_address("Santos, SP", client, settings)
+    assert http_calls == []
+
+
+@pytest.mark.asyncio
+async def test_close_nominatim_dbs(db_settings):
+    """Shutdown closes open pools. - test_close_nominatim_dbs"""
+    settings, pool = db_settings
+    await nominatim_db_module.close_nominatim_dbs()
+    assert pool.closed
+    assert get_nominatim_db(settings)._pool is None
+
+
+@pytest.mark.asyncio
+async def test_geocode_batch_endpoint(db_settings, http_calls):
+    """The batch endpoint answers in input order with per-item errors. - test_geocode_batch_endpoint"""
+    settings, _ = db_settings
+    app.dependency_overrides[get_settings] = lambda: settings
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            r = await ac.post("/api/geocode/batch", json={"addresses": ["Campinas", "Nowhere", "Santos"]})
+            empty = await ac.post("/api/geocode/batch", json={"addresses": []})
+    finally:
+        app.dependency_overrides.pop(get_settings, None)
+
+    assert r.status_code == 200
+    body = r.json()
+    assert [item["address"] for item in body] == ["Campinas", "Nowhere", "Santos"]
+    assert body[0]["lat"] == pytest.approx(-22.9099)
+    assert body[1]["lat"] is None and body[1]["error"]
+    assert body[2]["lon"] == pytest.approx(-46.3336)
+    assert empty.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_batch_misses_never_reach_the_public_service(db_settings, http_calls):
+    """Without a self-hosted Nominatim, database misses are reported instead of sent to the public service. - test_batch_misses_never_reach_the_public_service"""
+    settings, _ = db_settings
+    settings.nominatim_url = ""
+    async with httpx.AsyncClient() as client:
+        results = await geocode_many(["Campinas", "Santos, SP"], client, settings)
+
+    assert results[0] == (-22.9099, -47.0626)
+    assert isinstance(results[1], ValueError)
+    assert http_calls == []
+
+
+@pytest.mark.asyncio
+async def test_batch_endpoint_refuses_public_only_geocoding(http_calls):
+    """With the HTTP backend and only the public Nominatim, the batch endpoint answers 503. - test_batch_endpoint_refuses_public_only_geocoding"""
+    settings = get_settings()
+    settings.geocode_backend = "http"
+    settings.nominatim_url = ""
+    settings.run_local = False
+    app.dependency_overrides[get_settings] = lambda: settings
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            r = await ac.post("/api/geocode/batch", json={"addresses": ["Santos"]})
+    finally:
+        app.dependency_overrides.pop(get_settings, None)
+
+    assert r.status_code == 503
+    assert http_calls == []
+
+
+@pytest.mark.asyncio
+async def test_unreachable_database_backs_off():
+    """After a failed connect, lookups fail fast until the retry window passes. - test_unreachable_database_backs_off"""
+    from app.services.nominatim_db import NominatimDB
+
+    now = [0.0]
+    attempts = []
+
+    async def failing_pool(dsn, **kwargs):
+        attempts.append(kwargs["timeout"])
+        raise OSError("connection refused")
+
+    db = NominatimDB("postgresql://db", connect_timeout=1.5, retry_seconds=30.0, pool_factory=failing_pool, clock=lambda: now[0])
+    for _ in range(3):
+        with pytest.raises(Exception):
+            await db.lookup_many(["Campinas"])
+    assert attempts == [1.5]
+
+    now[0] = 31.0
+    with pytest.raises(DatabaseUnavailable) as info:
+        await db.lookup_many(["Campinas"])
+    assert isinstance(info.value.__cause__, OSError)
+    assert len(attempts) == 2
+
+
+@pytest.mark.asyncio
+async def test_unreachable_database_goes_straight_to_http(http_calls):
+    """geocode_address falls back to HTTP without retrying a database that just failed. - test_unreachable_database_goes_straight_to_http"""
+    settings = get_settings()
+    settings.geocode_backend = "db"
+    settings.nominatim_url = ""
+    settings.run_local = False
+    attempts = []
+
+    async def failing_pool(dsn, **kwargs):
+        attempts.append(dsn)
+        raise OSError("connection refused")
+
+    get_nominatim_db(settings)._pool_factory = failing_pool
+    async with httpx.AsyncClient() as client:
+        for _ in range(3):
+            assert await geocode_address("Santos, SP", client, settings) == (-23.9608, -46.3336)
+    assert len(attempts) == 1
+    assert http_calls == ["Santos, SP"] * 3
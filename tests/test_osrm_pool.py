@@ -0,0 +1,165 @@
+import pytest
+import httpx
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import app.services.osrm_pool as osrm_pool_module
+from app.services.osrm_pool import OsrmBackend, OsrmPool, get_osrm_pool
+from app.services.distance import distance_via_best_method, osrm_route_distance
+from app.core.config import get_settings
+
+
+"""Unit tests for the OSRM backend pool (app.services.osrm_pool).
+
+Routing calls go through httpx.MockTransport so no network I/O happens.
+"""
+
+SAO_PAULO = (-23.55052, -46.633308)
+CAMPINAS = (-22.9099, -47.0626)
+RECIFE = (-8.0476, -34.877)
+
+SUDESTE_BBOX = [-53.1, -25.4, -39.6, -14.2]
+
+
+def _route_response(distance_m: float = 93596.3, duration_s: float = 4576.7) -> httpx.Response:
+    return httpx.Response(200, json={"code": "Ok", "routes": [{"distance": distance_m, "duration": duration_s}]})
+
+
+def test_select_prefers_backend_covering_both_points():
+    """Only backends whose bbox contains both coordinates are eligible. - test_select_prefers_backend_covering_both_points"""
+    regional = OsrmBackend("http://osrm-se:5000", region="sudeste", bbox=SUDESTE_BBOX)
+    pool = OsrmPool([regional])
+
+    assert pool.select(*SAO_PAULO, *CAMPINAS) is regional
+    assert pool.select(*SAO_PAULO, *RECIFE) is None
+
+
+def test_least_outstanding_selection():
+    """The backend with fewer in-flight requests is chosen. - test_least_outstanding_selection"""
+    a = OsrmBackend("http://a:5000")
+    b = OsrmBackend("http://b:5000")
+    a.outstanding = 2
+    pool = OsrmPool([a, b])
+
+    assert pool.select(*SAO_PAULO, *CAMPINAS) is b
+
+
+def test_failing_backend_is_ejected_and_recovers(monkeypatch):
+    """Consecutive failures eject a backend until the cooldown expires. - test_failing_backend_is_ejected_and_recovers"""
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(osrm_pool_module.time, "monotonic", lambda: clock["now"])
+
+    a = OsrmBackend("http://a:5000")
+    b = OsrmBackend("http://b:5000")
+    pool = OsrmPool([a, b], eject_failures=2, eject_seconds=10.0)
+
+    pool.record_failure(a)
+    assert a.is_healthy(clock["now"])
+    pool.record_failure(a)
+    assert not a.is_healthy(clock["now"])
+
+    a.outstanding = 0
+    b.outstanding = 5
+    assert pool.select(*SAO_PAULO, *CAMPINAS) is b
+
+    clock["now"] += 11.0
+    assert pool.select(*SAO_PAULO, *CAMPINAS) is a
+
+    pool.record_success(a, 0.05)
+    assert a.consecutive_failures == 0
+
+
+def test_slow_responses_count_as_failures():
+    """Responses above the slow threshold contribute to ejection. - test_slow_responses_count_as_failures"""
+    a = OsrmBackend("http://a:5000")
+    pool = OsrmPool([a], eject_failures=1, slow_threshold_seconds=0.5)
+
+    pool.record_success(a, 2.0)
+    assert pool.select(*SAO_PAULO, *CAMPINAS) is None
+
+
+@pytest.mark.asyncio
+async def test_osrm_route_distance_uses_pool():
+    """osrm_route_distance sends the request to the regional backend covering the pair. - test_osrm_route_distance_uses_pool"""
+    settings = get_settings()
+    settings.use_osrm_online = False
+    settings.osrm_backends = [
+        {"url": "http://osrm-ne:5000", "region": "nordeste", "bbox": [-48.8, -18.4, -34.7, -1.0]},
+        {"url": "http://osrm-se:5000", "region": "sudeste", "bbox": SUDESTE_BBOX},
+    ]
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.url.host)
+        return _route_response()
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        result = await osrm_route_distance(*SAO_PAULO, *CAMPINAS, client, settings)
+
+    assert seen == ["osrm-se"]
+    assert result["method"] == "osrm"
+    assert pytest.approx(result["distance_km"], rel=1e-6) == 93.5963
+
+    pool = get_osrm_pool(settings)
+    se = [b for b in pool.backends if b.region == "sudeste"][0]
+    assert se.outstanding == 0
+    assert se.ewma_latency is not None
+
+
+@pytest.mark.asyncio
+async def test_osrm_route_distance_without_covering_backend_raises():
+    """Uncovered pairs raise when the public server is disabled so callers fall back. - test_osrm_route_distance_without_covering_backend_raises"""
+    settings = get_settings()
+    settings.use_osrm_online = False
+    settings.osrm_backends = [{"url": "http://osrm-se:5000", "bbox": SUDESTE_BBOX}]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise AssertionError("no request expected")
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with pytest.raises(RuntimeError):
+            await osrm_route_distance(*SAO_PAULO, *RECIFE, client, settings)
+
+
+@pytest.mark.asyncio
+async def test_non_json_osrm_response_is_a_routing_error():
+    """An HTML error page from OSRM surfaces as a RuntimeError, also for method="route". - test_non_json_osrm_response_is_a_routing_error"""
+    settings = get_settings()
+    settings.use_osrm_online = False
+    settings.osrm_backends = [{"url": "http://osrm-se:5000", "bbox": SUDESTE_BBOX}]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, text="<html>Bad gateway</html>", headers={"Content-Type": "text/html"})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with pytest.raises(RuntimeError, match="invalid JSON"):
+            await osrm_route_distance(*SAO_PAULO, *CAMPINAS, client, settings)
+        with pytest.raises(RuntimeError):
+            await distance_via_best_method(*SAO_PAULO, *CAMPINAS, client, settings, method="route")
+
+
+@pytest.mark.asyncio
+async def test_ejected_backends_fall_back_to_public_osrm():
+    """With every covering backend ejected, routes go to the public server when it is enabled. - test_ejected_backends_fall_back_to_public_osrm"""
+    settings = get_settings()
+    settings.use_osrm_online = True
+    settings.osrm_backends = [{"url": "http://osrm-se:5000", "bbox": SUDESTE_BBOX}]
+    settings.osrm_eject_failures = 1
+    pool = get_osrm_pool(settings)
+    pool.record_failure(pool.backends[0])
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.url.host)
+        return _route_response()
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        result = await osrm_route_distance(*SAO_PAULO, *CAMPINAS, client, settings)
+
+    assert seen == ["router.project-osrm.org"]
+    assert result["method"] == "osrm"
@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.core.config import get_settings
+from app.core.registry import Registry, clear_registries
+
+
+"""Unit tests for the shared settings-keyed registries (app.core.registry)."""
+
+
+def test_settings_copies_share_one_object():
+    """Each get_settings() copy with the same values gets the same object. - test_settings_copies_share_one_object"""
+    built = []
+    registry = Registry(("osrm_profile",), lambda settings: built.append(settings.osrm_profile) or object())
+
+    first = registry.get(get_settings())
+    assert registry.get(get_settings()) is first
+
+    other = get_settings()
+    other.osrm_profile = "bike"
+    assert registry.get(other) is not first
+    assert built == [get_settings().osrm_profile, "bike"]
+
+
+def test_extra_key_parts_and_list_settings():
+    """Extra arguments are part of the key, and list/dict settings values are usable as keys. - test_extra_key_parts_and_list_settings"""
+    registry = Registry(("osrm_backends",), lambda settings, name: [name])
+    settings = get_settings()
+    settings.osrm_backends = [{"url": "http://osrm-se:5000", "bbox": [-53.1, -25.4, -39.6, -14.2]}]
+
+    a = registry.get(settings, "a")
+    assert registry.get(settings, "a") is a
+    assert registry.get(settings, "b") == ["b"]
+    assert len(registry.values()) == 2
+
+    clear_registries()
+    assert registry.values() == []
@@ -0,0 +1,173 @@
+import pytest
+from httpx import AsyncClient
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.main import app
+import app.main as main_module
+import app.api.routes as routes_module
+import app.core.response_cache as response_cache_module
+from app.core.response_cache import ResponseCache, cache_key
+from app.core.config import get_settings
+
+
+"""Tests for the whole-response cache middleware (app.core.response_cache)."""
+
+ORIGIN = {"lat": -23.55052, "lon": -46.633308}
+DESTINATIONS = [
+    {"name": "Rio", "lat": -22.9068, "lon": -43.1729},
+    {"name": "Campinas", "lat": -22.9099, "lon": -47.0626},
+]
+
+
+@pytest.fixture
+def cached_settings(monkeypatch):
+    """Settings with the response cache enabled, seen by the middleware. - cached_settings"""
+    settings = get_settings()
+    settings.response_cache_enabled = True
+    monkeypatch.setattr(main_module, "get_settings", lambda: settings)
+    return settings
+
+
+@pytest.fixture
+def pipeline_runs(monkeypatch):
+    """Count how often the distance pipeline actually runs. - pipeline_runs"""
+    runs = []
+    original = routes_module._offline_results
+
+    def counting(*args, **kwargs):
+        runs.append(1)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(routes_module, "_offline_results", counting)
+    return runs
+
+
+@pytest.mark.asyncio
+async def test_repeated_query_is_served_from_cache(cached_settings, pipeline_runs):
+    """Identical queries (up to key order and time budget) run the pipeline once. - test_repeated_query_is_served_from_cache"""
+    payload = {"origin": ORIGIN, "destinations": DESTINATIONS, "method": "geodesic"}
+    reordered = {"method": "geodesic", "destinations": DESTINATIONS, "origin": ORIGIN, "time_budget_ms": 5000}
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        first = await ac.post("/api/distance", json=payload)
+        second = await ac.post("/api/distance", json=reordered)
+
+    assert first.status_code == second.status_code == 200
+    assert first.headers["x-response-cache"] == "miss"
+    assert second.headers["x-response-cache"] == "hit"
+    assert first.headers["etag"] == second.headers["etag"]
+    assert first.json() == second.json()
+    assert len(pipeline_runs) == 1
+
+
+@pytest.mark.asyncio
+async def test_if_none_match_returns_304(cached_settings, pipeline_runs):
+    """A client holding the current ETag gets 304 with an empty body. - test_if_none_match_returns_304"""
+    payload = {"origin": ORIGIN, "destinations": DESTINATIONS, "method": "fast"}
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        first = await ac.post("/api/distance", json=payload)
+        etag = first.headers["etag"]
+        not_modified = await ac.post("/api/distance", json=payload, headers={"If-None-Match": f"W/{etag}"})
+        stale = await ac.post("/api/distance", json=payload, headers={"If-None-Match": '"other"'})
+
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+    assert stale.status_code == 200
+    assert stale.json() == first.json()
+    assert len(pipeline_runs) == 1
+
+
+@pytest.mark.asyncio
+async def test_degraded_and_failed_responses_are_not_cached(cached_settings):
+    """Budget-degraded and error responses always re-run. - test_degraded_and_failed_responses_are_not_cached"""
+    degraded = {"origin": ORIGIN, "destinations": DESTINATIONS, "time_budget_ms": 0}
+    invalid = {"origin": ORIGIN, "destinations": DESTINATIONS, "method": "teleport"}
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        for _ in range(2):
+            r = await ac.post("/api/distance", json=degraded)
+            assert r.status_code == 200
+            assert "etag" not in r.headers
+            r = await ac.post("/api/distance", json=invalid)
+            assert r.status_code == 422
+    assert len(response_cache_module.get_response_cache(cached_settings)) == 0
+
+
+@pytest.mark.asyncio
+async def test_fallback_responses_are_flagged_and_not_cached(cached_settings, monkeypatch):
+    """method=auto rows answered offline because OSRM failed mark the response and keep it out of the cache. - test_fallback_responses_are_flagged_and_not_cached"""
+    import app.services.distance as distance_module
+
+    calls = []
+
+    async def failing_osrm(*args, **kwargs):
+        calls.append(1)
+        raise RuntimeError("OSRM returned status 503")
+
+    monkeypatch.setattr(distance_module, "osrm_route_distance", failing_osrm)
+    payload = {"origin": ORIGIN, "destinations": DESTINATIONS}
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        for _ in range(2):
+            r = await ac.post("/api/distance", json=payload)
+            assert r.status_code == 200
+            assert r.headers["x-distance-fallback"] == "2"
+            assert "etag" not in r.headers
+    assert len(calls) == 4
+    assert len(response_cache_module.get_response_cache(cached_settings)) == 0
+
+
+@pytest.mark.asyncio
+async def test_cache_disabled_by_default(pipeline_runs):
+    """Without RESPONSE_CACHE_ENABLED responses carry no ETag and always run. - test_cache_disabled_by_default"""
+    payload = {"origin": ORIGIN, "destinations": DESTINATIONS, "method": "fast"}
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        for _ in range(2):
+            r = await ac.post("/api/distance", json=payload)
+            assert "etag" not in r.headers
+    assert len(pipeline_runs) == 2
+
+
+def test_cache_key_covers_format_and_settings():
+    """Response format and result-relevant settings are part of the key. - test_cache_key_covers_format_and_settings"""
+    settings = get_settings()
+    body = b'{"origin": {"lat": 1, "lon": 2}}'
+    base = cache_key("/api/distance", "", "application/json", body, settings)
+
+    assert cache_key("/api/distance", "application/msgpack", "application/json", body, settings) != base
+    assert cache_key("/api/distance/addresses", "", "application/json", body, settings) != base
+    other = get_settings()
+    other.osrm_profile = "foot"
+    assert cache_key("/api/distance", "", "application/json", body, other) != base
+    other = get_settings()
+    other.trace_sample_rate = 1.0
+    assert cache_key("/api/distance", "", "application/json", body, other) == base
+
+
+def test_response_cache_ttl_and_bounds():
+    """Entries expire after the TTL, and the LRU entry goes when a bound is exceeded. - test_response_cache_ttl_and_bounds"""
+    now = [0.0]
+    cache = ResponseCache(ttl=10.0, max_entries=2, max_bytes=10, clock=lambda: now[0])
+    cache.put("a", 200, [], b"aaaa", '"a"')
+    cache.put("b", 200, [], b"bbbb", '"b"')
+    assert cache.get("a") is not None
+
+    # Over the byte bound: "b" is least recently used
+    cache.put("c", 200, [], b"cccc", '"c"')
+    assert cache.get("b") is None
+    assert len(cache) == 2
+
+    cache.put("huge", 200, [], b"x" * 11, '"x"')
+    assert cache.get("huge") is None
+
+    now[0] = 11.0
+    assert cache.get("a") is None
+    assert len(cache) == 1
@@ -0,0 +1,139 @@
+import pytest
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.services.distance import haversine_distance
+from app.services.tracking import TrackingSession
+
+
+"""Unit tests for incremental live-tracking recomputation (app.services.tracking)."""
+
+DESTINATIONS = [
+    ("Santos", -23.9608, -46.3336),
+    ("Campinas", -22.9099, -47.0626),
+    ("Rio", -22.9068, -43.1729),
+    ("Recife", -8.0476, -34.877),
+]
+
+
+@pytest.mark.asyncio
+async def test_limit_skips_destinations_that_cannot_rank():
+    """With limit=1 only destinations whose lower bound beats the best distance are evaluated. - test_limit_skips_destinations_that_cannot_rank"""
+    evaluated = []
+
+    async def road_like(origin_lat, origin_lon, lat, lon):
+        evaluated.append((lat, lon))
+        # Roads are never shorter than the straight line
+        return {"distance_km": haversine_distance(origin_lat, origin_lon, lat, lon) * 1.3, "method": "osrm"}
+
+    session = TrackingSession(DESTINATIONS, limit=1)
+    rows, removed = await session.update(-23.55052, -46.633308, road_like)
+
+    assert [row["name"] for row in rows] == ["Santos"]
+    assert removed == []
+    # Rio and Recife are farther in a straight line than Santos by road
+    assert (-22.9068, -43.1729) not in evaluated
+    assert (-8.0476, -34.877) not in evaluated
+
+
+@pytest.mark.asyncio
+async def test_unchanged_rows_are_not_repeated():
+    """A second update with the same ranking and distances yields no rows. - test_unchanged_rows_are_not_repeated"""
+
+    async def constant(origin_lat, origin_lon, lat, lon):
+        return {"distance_km": haversine_distance(0.0, 0.0, lat, lon), "method": "haversine"}
+
+    session = TrackingSession(DESTINATIONS, min_move_m=0.0)
+    rows, _ = await session.update(-23.55, -46.63, constant)
+    assert len(rows) == len(DESTINATIONS)
+
+    rows, removed = await session.update(-23.56, -46.64, constant)
+    assert rows == [] and removed == []
+
+
+@pytest.mark.asyncio
+async def test_no_limit_reuses_distances_that_cannot_change_rank():
+    """Without a limit, a small move only recomputes destinations whose rank or value could change. - test_no_limit_reuses_distances_that_cannot_change_rank"""
+    evaluated = []
+
+    async def counting(origin_lat, origin_lon, lat, lon):
+        evaluated.append((lat, lon))
+        return {"distance_km": haversine_distance(origin_lat, origin_lon, lat, lon), "method": "haversine"}
+
+    near = ("Corner", -23.5510, -46.6340)
+    session = TrackingSession(DESTINATIONS + [near], straight_line=True)
+    rows, _ = await session.update(-23.55052, -46.633308, counting)
+    assert len(rows) == len(DESTINATIONS) + 1
+    evaluated.clear()
+
+    # ~200 m north: under 1% of every city's distance, but not of the corner's
+    rows, removed = await session.update(-23.5487, -46.633308, counting)
+    assert evaluated == [near[1:]]
+    assert removed == []
+    assert [row["name"] for row in rows] == ["Corner"]
+
+
+@pytest.mark.asyncio
+async def test_no_limit_recomputes_distances_that_could_swap():
+    """Cached distances within the move of each other are recomputed, since their order may change. - test_no_limit_recomputes_distances_that_could_swap"""
+    evaluated = []
+
+    async def counting(origin_lat, origin_lon, lat, lon):
+        evaluated.append((lat, lon))
+        return {"distance_km": haversine_distance(origin_lat, origin_lon, lat, lon), "method": "haversine"}
+
+    # Campinas and its neighbour are ~0.1 km apart in distance from the origin
+    twin = ("Campinas East", -22.9099, -47.0616)
+    session = TrackingSession(DESTINATIONS + [twin], straight_line=True)
+    await session.update(-23.55052, -46.633308, counting)
+    evaluated.clear()
+
+    await session.update(-23.5487, -46.633308, counting)
+    assert sorted(evaluated) == sorted([(-22.9099, -47.0626), twin[1:]])
+
+
+@pytest.mark.asyncio
+async def test_no_limit_routed_sessions_recompute_every_row():
+    """Road distances can jump by more than the move, so routed sessions never reuse them. - test_no_limit_routed_sessions_recompute_every_row"""
+    evaluated = []
+
+    async def routed(origin_lat, origin_lon, lat, lon):
+        evaluated.append((lat, lon))
+        return {"distance_km": haversine_distance(origin_lat, origin_lon, lat, lon) * 1.3, "method": "osrm"}
+
+    session = TrackingSession(DESTINATIONS)
+    await session.update(-23.55052, -46.633308, routed)
+    evaluated.clear()
+
+    await session.update(-23.5487, -46.633308, routed)
+    assert sorted(evaluated) == sorted(d[1:] for d in DESTINATIONS)
+
+
+@pytest.mark.asyncio
+async def test_failed_update_keeps_the_previous_origin():
+    """An update whose evaluation raises does not count as a move. - test_failed_update_keeps_the_previous_origin"""
+    failing = False
+
+    async def flaky(origin_lat, origin_lon, lat, lon):
+        if failing:
+            raise RuntimeError("OSRM unavailable")
+        return {"distance_km": haversine_distance(origin_lat, origin_lon, lat, lon), "method": "osrm"}
+
+    session = TrackingSession(DESTINATIONS, min_move_m=100.0)
+    await session.update(-23.55052, -46.633308, flaky)
+
+    failing = True
+    with pytest.raises(RuntimeError):
+        await session.update(-23.5487, -46.633308, flaky)
+    assert session.origin == (-23.55052, -46.633308)
+
+    # The retry is measured from the last successful origin, so it is not skipped
+    failing = False
+    rows, _ = await session.update(-23.5487, -46.633308, flaky)
+    assert session.origin == (-23.5487, -46.633308)
+    assert rows